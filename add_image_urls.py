@@ -11,9 +11,20 @@
 5. 保存更新后的文件
 """
 
+import time
+
 import pandas as pd
 import json
 
+import recipe_store
+import run_metrics
+
+try:
+    # 若安装了 orjson，则用它解析 JSON（解析速度快数倍）
+    import orjson
+except ImportError:
+    orjson = None
+
 # 在这里修改输入和输出文件名
 INPUT_FILE = "recipes_601_700.csv"  # 输入文件名
 OUTPUT_FILE = "recipes_601_700_with_images.csv"  # 输出文件名
@@ -22,6 +33,27 @@ OUTPUT_FILE = "recipes_601_700_with_images.csv"  # 输出文件名
 REMOVE_FIRST_AND_LAST_COLUMNS = True  # 是否删除第一列和最后一列
 ADD_IMAGE_URLS = True  # 是否添加image_url
 
+# 流式模式：按块读取并追加写出，内存占用与文件大小无关（适合全量多语言导出）
+STREAMING = False
+CHUNK_SIZE = 1000  # 每块行数
+
+# 提取文件中每个stage数据前的提示词前缀
+STAGE_PROMPT_PREFIX = (
+    "该图为一张食谱图片，以下数据包括了完成这道菜的步骤（stage）。"
+    "为每个stage生成一张配图，图中不要出现文字，图片背景浅白色系，ins风格。"
+    "所有图片为正方形，长宽比为1：1。以下为数据内容："
+)
+
+
+def json_loads(text: str):
+    """解析JSON：优先使用 orjson，其不支持的输入（如 NaN、超大整数）回退到标准库 json"""
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
 
 def remove_first_and_last_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -64,6 +96,35 @@ def add_image_urls_to_stages(content_data: dict, source_id: int) -> dict:
     return content_data
 
 
+def add_image_urls_to_df(df: pd.DataFrame) -> tuple[pd.DataFrame, int]:
+    """
+    为DataFrame中每一行content的stages添加image_url
+
+    Args:
+        df: 包含'content'和'source_id'列的DataFrame
+
+    Returns:
+        (content列已更新的DataFrame, 成功更新的行数)
+    """
+    # 检查必要的列是否存在
+    if 'content' not in df.columns or 'source_id' not in df.columns:
+        raise ValueError("CSV文件必须包含'content'和'source_id'列")
+
+    updated_count = 0
+    contents = []
+    for index, raw_content, source_id in zip(df.index, df['content'], df['source_id']):
+        try:
+            # 解析content列，为每个stage添加image_url
+            content = json_loads(raw_content)
+            updated_content = add_image_urls_to_stages(content, source_id)
+            contents.append(json.dumps(updated_content, ensure_ascii=False))
+            updated_count += 1
+        except json.JSONDecodeError:
+            print(f"行 {index} 的content列无法解析为JSON")
+            contents.append(raw_content)
+    return df.assign(content=contents), updated_count
+
+
 def process_csv_to_df(input_file: str, remove_columns: bool = True, add_images: bool = True) -> pd.DataFrame:
     """
     在内存中处理CSV：可删除首尾列、为每个stage添加image_url，返回处理后的DataFrame。
@@ -82,33 +143,41 @@ def process_csv_to_df(input_file: str, remove_columns: bool = True, add_images:
     # 步骤2：添加image_url（如果需要）
     if add_images:
         print("\n步骤2：为每个stage添加image_url")
-
-        # 检查必要的列是否存在
-        if 'content' not in df.columns or 'source_id' not in df.columns:
-            raise ValueError("CSV文件必须包含'content'和'source_id'列")
-
-        # 处理每一行
-        updated_count = 0
-        
-        for index, row in df.iterrows():
-            try:
-                # 解析content列
-                content = json.loads(row['content'])
-                source_id = row['source_id']
-                
-                # 为每个stage添加image_url
-                updated_content = add_image_urls_to_stages(content, source_id)
-                df.at[index, 'content'] = json.dumps(updated_content, ensure_ascii=False)
-                updated_count += 1
-            except json.JSONDecodeError:
-                print(f"行 {index} 的content列无法解析为JSON")
-                continue
+        df, updated_count = add_image_urls_to_df(df)
         print(f"已更新 {updated_count} 行的content列")
 
     return df
 
 
- 
+def get_extract_file_name(input_file: str) -> str:
+    """提取文件名：在输入文件名基础上添加 _extract_stage 后缀（见 recipe_store.extract_file_name）"""
+    return recipe_store.extract_file_name(input_file)
+
+
+def build_extract_rows(df: pd.DataFrame) -> list:
+    """
+    从DataFrame中提取 en 语言（若存在 language_code 列）的 source_id 与带提示词前缀的stages数据
+    """
+    # 只保留 en（若有 language_code 列）
+    if 'language_code' in df.columns:
+        df = df[df['language_code'] == 'en']
+
+    # 检查必要的列是否存在
+    if 'content' not in df.columns or 'source_id' not in df.columns:
+        raise ValueError("CSV文件必须包含'content'和'source_id'列")
+
+    extracted_data = []
+    for index, raw_content, source_id in zip(df.index, df['content'], df['source_id']):
+        try:
+            content = json_loads(raw_content)
+            if 'stages' in content:
+                # 合并所有stage数据，并添加前缀
+                stages_data = json.dumps(content['stages'], ensure_ascii=False)
+                extracted_data.append({'source_id': source_id, 'stage': STAGE_PROMPT_PREFIX + stages_data})
+        except json.JSONDecodeError:
+            print(f"行 {index} 的content列无法解析为JSON")
+            continue
+    return extracted_data
 
 
 def extract_stages_and_source_id_from_df(df: pd.DataFrame, input_file: str) -> None:
@@ -117,41 +186,13 @@ def extract_stages_and_source_id_from_df(df: pd.DataFrame, input_file: str) -> N
     默认仅处理 language_code == 'en'（若存在 language_code 列）。
     """
     try:
-        # 只保留 en（若有 language_code 列）
-        if 'language_code' in df.columns:
-            df = df[df['language_code'] == 'en']
-
-        # 检查必要的列是否存在
-        if 'content' not in df.columns or 'source_id' not in df.columns:
-            print("错误：CSV文件必须包含'content'和'source_id'列")
-            return
-
-        extracted_data = []
-
-        for index, row in df.iterrows():
-            try:
-                content = json.loads(row['content'])
-                source_id = row['source_id']
-
-                if 'stages' in content:
-                    # 合并所有stage数据
-                    stages_data = json.dumps(content['stages'], ensure_ascii=False)
-                    # 添加前缀
-                    stages_data_with_prefix = (
-                        "该图为一张食谱图片，以下数据包括了完成这道菜的步骤（stage）。"
-                        "为每个stage生成一张配图，图中不要出现文字，图片背景浅白色系，ins风格。"
-                        "所有图片为正方形，长宽比为1：1。以下为数据内容：" + stages_data
-                    )
-                    extracted_data.append({'source_id': source_id, 'stage': stages_data_with_prefix})
-            except json.JSONDecodeError:
-                print(f"行 {index} 的content列无法解析为JSON")
-                continue
+        extracted_data = build_extract_rows(df)
 
         # 创建新的DataFrame
         extracted_df = pd.DataFrame(extracted_data)
 
         # 生成新文件名
-        new_file_name = f"{input_file.rsplit('.', 1)[0]}_extract_stage.csv"
+        new_file_name = get_extract_file_name(input_file)
 
         # 保存提取后的数据到新的CSV文件
         extracted_df.to_csv(new_file_name, index=False, encoding='utf-8-sig')
@@ -160,15 +201,142 @@ def extract_stages_and_source_id_from_df(df: pd.DataFrame, input_file: str) -> N
         print(f"提取文件时出错: {e}")
 
 
+def transform_chunk(df: pd.DataFrame, add_images: bool = True) -> tuple[pd.DataFrame, int, list]:
+    """
+    单次解析的融合转换：每个content只解析一次，同时生成
+    1) 添加image_url后的全量行；2) en 语言（若存在 language_code 列）的提取行。
+
+    Returns:
+        (content列已更新的DataFrame, 成功更新的行数, 提取行列表)
+    """
+    # 检查必要的列是否存在
+    if 'content' not in df.columns or 'source_id' not in df.columns:
+        raise ValueError("CSV文件必须包含'content'和'source_id'列")
+
+    if 'language_code' in df.columns:
+        is_en = (df['language_code'] == 'en').tolist()
+    else:
+        is_en = [True] * len(df)
+
+    updated_count = 0
+    contents = []
+    extracted_data = []
+    for index, raw_content, source_id, en in zip(df.index, df['content'], df['source_id'], is_en):
+        try:
+            content = json_loads(raw_content)
+        except json.JSONDecodeError:
+            print(f"行 {index} 的content列无法解析为JSON")
+            contents.append(raw_content)
+            continue
+
+        if add_images:
+            content = add_image_urls_to_stages(content, source_id)
+            contents.append(json.dumps(content, ensure_ascii=False))
+            updated_count += 1
+        else:
+            contents.append(raw_content)
+
+        if en and 'stages' in content:
+            stages_data = json.dumps(content['stages'], ensure_ascii=False)
+            extracted_data.append({'source_id': source_id, 'stage': STAGE_PROMPT_PREFIX + stages_data})
+
+    if add_images:
+        df = df.assign(content=contents)
+    return df, updated_count, extracted_data
+
+
+def _append_csv(df: pd.DataFrame, path: str, first: bool) -> None:
+    """首块覆盖写入（带BOM与表头），后续块追加写入"""
+    if first:
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+    else:
+        df.to_csv(path, mode='a', header=False, index=False, encoding='utf-8')
+
+
+def process_csv_to_files(input_file: str, output_file: str, remove_columns: bool = True,
+                         add_images: bool = True, chunksize: int | None = None,
+                         extract: bool = True, language: str | None = None,
+                         source_id_range: tuple | None = None) -> int:
+    """
+    处理CSV并直接写出含 image_url 的全量文件与 en 语言的提取文件。
+    每个content只解析一次（见 transform_chunk）。
+
+    chunksize 为 None 时整表读入；否则按 chunksize 行分块读取并追加写出，
+    内存占用与文件大小无关。input_file 也可以是列式存储目录（见 recipe_store），
+    此时 language / source_id_range 下推到存储读取，只处理命中的行；对 CSV 输入不生效。
+
+    Returns:
+        处理的总行数
+    """
+    is_store = recipe_store.is_store(input_file)
+    if (language or source_id_range) and not is_store:
+        print("提示：language / source_id_range 只对列式存储输入生效，CSV 输入将全部处理")
+    if is_store:
+        print(f"正在读取列式存储: {input_file}")
+        chunks = recipe_store.iter_recipe_frames(input_file, chunksize or recipe_store.ROW_GROUP_SIZE,
+                                                 language=language, source_id_range=source_id_range)
+    elif chunksize:
+        print(f"正在流式读取文件: {input_file}（每块 {chunksize} 行）")
+        chunks = pd.read_csv(input_file, encoding='utf-8-sig', chunksize=chunksize)
+    else:
+        print(f"正在读取文件: {input_file}")
+        chunks = [pd.read_csv(input_file, encoding='utf-8-sig')]
+
+    recorder = run_metrics.get_recorder()
+    started = time.perf_counter()
+    extract_file = get_extract_file_name(input_file)
+    total_rows = 0
+    updated_rows = 0
+    extracted_rows = 0
+    first = True
+    chunk_index = 0
+    chunk_started = time.perf_counter()
+    for chunk in chunks:
+        if remove_columns:
+            if len(chunk.columns) < 3:
+                if first:
+                    print("警告：列数少于3列，无法删除第一列和最后一列")
+            else:
+                if first:
+                    print(f"已删除的列: {chunk.columns[0]}, {chunk.columns[-1]}")
+                chunk = chunk.iloc[:, 1:-1]
+
+        chunk, updated_count, rows = transform_chunk(chunk, add_images)
+        updated_rows += updated_count
+        _append_csv(chunk, output_file, first)
+
+        if extract:
+            _append_csv(pd.DataFrame(rows, columns=['source_id', 'stage']), extract_file, first)
+            extracted_rows += len(rows)
+
+        total_rows += len(chunk)
+        first = False
+        if recorder.enabled:
+            # 耗时包含本块的读取、转换与写出
+            elapsed = time.perf_counter() - chunk_started
+            recorder.observe('csv_chunk', elapsed, label=f'chunk {chunk_index}', rows=len(chunk),
+                             rows_per_sec=round(len(chunk) / elapsed, 1) if elapsed else None)
+        chunk_index += 1
+        chunk_started = time.perf_counter()
+
+    if recorder.enabled:
+        elapsed = time.perf_counter() - started
+        recorder.event('csv_transform', input_file=input_file, rows=total_rows, extracted=extracted_rows,
+                       seconds=round(elapsed, 6), rows_per_sec=round(total_rows / elapsed, 1) if elapsed else None)
+    if add_images:
+        print(f"已更新 {updated_rows} 行的content列")
+    print(f"共处理 {total_rows} 行，已保存更新后的文件: {output_file}")
+    if extract:
+        print(f"共提取 {extracted_rows} 行，已保存提取文件: {extract_file}")
+    return total_rows
+
+
 if __name__ == "__main__":
     try:
-        # 在内存中处理，保存含 image_url 的全量CSV（所有语言）
-        df_processed = process_csv_to_df(INPUT_FILE, REMOVE_FIRST_AND_LAST_COLUMNS, ADD_IMAGE_URLS)
-        df_processed.to_csv(OUTPUT_FILE, index=False, encoding='utf-8-sig')
-        print(f"已保存更新后的文件: {OUTPUT_FILE}")
-
-        # 从处理后的数据中仅筛选 en 语言，生成用于图片生成的提取文件
-        extract_stages_and_source_id_from_df(df_processed, INPUT_FILE)
+        # 单次解析：同时保存含 image_url 的全量CSV（所有语言）与仅 en 语言的提取CSV；
+        # 流式模式下逐块读取并追加写出
+        process_csv_to_files(INPUT_FILE, OUTPUT_FILE, REMOVE_FIRST_AND_LAST_COLUMNS, ADD_IMAGE_URLS,
+                             CHUNK_SIZE if STREAMING else None)
         print("已生成含 image_url 的全量CSV与仅 en 语言的提取CSV。")
     except Exception as e:
-        print(f"处理文件时出错: {e}")
\ No newline at end of file
+        print(f"处理文件时出错: {e}")
@@ -13,13 +13,35 @@
 - 小于 min_size_kb：直接转成高质量 JPG（尽量不放大体积）
 - 位于 [min_size_kb, max_size_kb]：转成高质量 JPG 归一化格式
 - 大于 max_size_kb：按目标大小缩放分辨率并逐步降低质量，直至不超过目标大小
+
+输出编码（OUTPUT_ENCODER）：基线 JPEG（默认）、渐进式 JPEG、不同色度抽样的 JPEG 或 WebP，
+均使用同样的字节预算搜索；compare_encoders 可对比各编码在每张图片上的体积与编码耗时。
+
+可选加速（默认关闭，在“可配置参数”中开启）：WORKERS 多进程并行；INCREMENTAL 借助清单只处理
+新增或变化的图片。
+
+多规格输出（RENDITIONS）：每个源图只解码、转换一次，依次生成全尺寸、列表图、缩略图等规格，
+较小的规格由上一级缩放得到，而不是重新从原图缩放。
 """
 
+import hashlib
+import io
+import json
 import os
 import math
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass
 from pathlib import Path
 from PIL import Image
 
+import run_metrics
+
 
 # ======================== 可配置参数（请在此修改） ========================
 # 方式一：只改文件夹名称（相对于本脚本所在目录）
@@ -37,99 +59,1044 @@ MAX_SIZE_KB = 600  # 目标最大大小，同时作为压缩目标
 
 # 初始 JPEG 质量（1-100）
 INITIAL_QUALITY = 85
+
+# 并行进程数（1 表示串行，与原脚本一致；0 表示使用全部 CPU 核心）
+WORKERS = 1
+
+# 增量压缩：借助输出目录旁的清单文件（<输出目录>.manifest.json），仅处理新增或变化的图片。
+# 默认关闭，每次全部重新压缩；开启后会写出清单并跳过未变化的图片
+INCREMENTAL = False
+
+# 增量模式下清单的检查点间隔（秒）：压缩过程中每隔该时间保存一次清单，
+# 中途崩溃或中断后重新运行时，已完成的图片不会重压（0 表示每张完成都保存）
+MANIFEST_CHECKPOINT_SECONDS = 30
+
+# 内容去重：内容完全相同的源图只压缩一次，其余输出复制生成（各自独立的文件，不共享硬链接）
+DEDUP = True
+
+# 跨运行的压缩结果缓存目录（绝对路径或相对于本脚本所在目录，支持 ~；留空则不缓存，只在本次运行内去重）。
+# 以 压缩参数 + 源图内容哈希 为键，相同输入在任何目录、任何批次都不会被重复编码。
+# 默认关闭；开启时建议放在用户缓存目录，如 "~/.cache/recipe_compress"，不要放在代码仓库内
+DEDUP_CACHE_DIR = ""
+# 缓存总大小上限（MB）：每次运行结束后按最近使用时间淘汰最旧的条目；0 表示不限制
+DEDUP_CACHE_MAX_MB = 1024
+
+# 输出编码，可选值见 ENCODERS：baseline / progressive / progressive444 / jpeg444 / webp
+OUTPUT_ENCODER = "baseline"
+
+# 并行压缩的内存预算（MB）：按文件头估计每张图片解码后的内存占用，总和不超过预算才开始处理下一张；
+# 0 表示自动取当前可用内存的一半。超出预算的单张大图会在没有其他任务时单独处理
+MEMORY_BUDGET_MB = 0
+
+# 单张大图的质量/分辨率搜索中同时编码的候选数（线程并行，共享同一份解码结果）；
+# 1 表示逐个二分；0 表示自动：按 CPU 核心数与同时处理的图片数分配空闲核心
+PARALLEL_ENCODES = 0
+
+# 多规格输出（为空时只输出一份全尺寸图片）。字段见 Rendition，例如：
+# RENDITIONS = [
+#     {"name": "web"},                                                   # 全尺寸，预算为 MAX_SIZE_KB
+#     {"name": "list", "max_dimension": 800, "max_size_kb": 150, "subdir": "list"},
+#     {"name": "thumb", "max_dimension": 240, "max_size_kb": 30, "suffix": "_thumb"},
+# ]
+RENDITIONS: list[dict] = []
 # ======================================================================
 
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp"}
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """一种输出规格。
+
+    max_dimension 为最长边上限（None 表示保持全尺寸，按 ImageCompressor 的阈值策略处理）；
+    max_size_kb 为字节预算（None 表示沿用压缩器的 max_size_kb）；
+    输出为 <输出目录>/<subdir>/<文件名><suffix><扩展名>（扩展名由输出编码决定，默认 .jpg）。
+    """
+    name: str
+    max_dimension: int | None = None
+    max_size_kb: int | None = None
+    suffix: str = ""
+    subdir: str = ""
+
+    def output_path(self, output_dir: Path, stem: str, extension: str = ".jpg") -> Path:
+        return Path(output_dir) / self.subdir / f"{stem}{self.suffix}{extension}"
+
+
+# 未指定规格时的默认输出：一份全尺寸图片，文件名与源文件相同
+DEFAULT_RENDITIONS = (Rendition("full"),)
+
+
+@dataclass(frozen=True)
+class OutputEncoder:
+    """输出编码设置。
+
+    subsampling 为 JPEG 色度抽样：0 = 4:4:4，1 = 4:2:2，2 = 4:2:0，None 为 libjpeg 默认（4:2:0）；
+    method 为 WebP 的压缩力度（0-6，越大越慢、体积越小）。
+    """
+    name: str
+    format: str = "JPEG"
+    progressive: bool = False
+    optimize: bool = True
+    subsampling: int | None = None
+    method: int = 4
+
+    @property
+    def extension(self) -> str:
+        return ".webp" if self.format == "WEBP" else ".jpg"
+
+    def save_options(self, quality: int) -> dict:
+        if self.format == "WEBP":
+            return {"quality": quality, "method": self.method}
+        options = {"quality": quality, "optimize": self.optimize}
+        if self.progressive:
+            options["progressive"] = True
+        if self.subsampling is not None:
+            options["subsampling"] = self.subsampling
+        return options
+
+
+ENCODERS = {
+    # 基线 JPEG + 优化霍夫曼表（原有输出）
+    "baseline": OutputEncoder("baseline"),
+    # 渐进式 JPEG：通常体积略小，浏览器可先显示低清晰度版本
+    "progressive": OutputEncoder("progressive", progressive=True),
+    # 不做色度抽样：文字、线条边缘更清晰，体积更大
+    "progressive444": OutputEncoder("progressive444", progressive=True, subsampling=0),
+    "jpeg444": OutputEncoder("jpeg444", subsampling=0),
+    "webp": OutputEncoder("webp", format="WEBP"),
+}
+
+
+def _compress_task(compressor: "ImageCompressor", input_path: Path, outputs: list[tuple[Rendition, Path]],
+                   quality: int) -> tuple[list[str] | None, dict]:
+    """单个文件的压缩任务（可在子进程中执行），返回 (各规格输出路径, 各阶段统计)。"""
+    result = compressor.compress_renditions(input_path, outputs, quality=quality)
+    return result, compressor.last_stats
+
+
+def copy_atomic(src: Path, dst: Path) -> None:
+    """复制到临时名后原子替换 dst（各输出与缓存条目是独立的文件，编辑其一不影响其他）"""
+    temp_path = dst.with_name(f".{dst.name}.copy")
+    try:
+        shutil.copyfile(src, temp_path)
+        os.replace(temp_path, dst)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def available_memory_bytes() -> int:
+    """当前可用内存（Linux 读取 /proc/meminfo 的 MemAvailable），无法获取时返回 2GB。"""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 2 * 1024 ** 3
+
+
+def auto_parallel_encodes(concurrent_images: int) -> int:
+    """自动模式下单张图片可用的编码线程数：CPU 核心数平均分给同时处理的图片。"""
+    return max(1, (os.cpu_count() or 1) // max(1, concurrent_images))
+
+
+def list_image_files(input_dir: Path) -> list[Path]:
+    """输入目录下待压缩的图片：仅一级文件（不递归），按文件名排序保证结果顺序稳定。"""
+    return sorted(
+        (p for p in Path(input_dir).iterdir() if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS),
+        key=lambda p: p.name,
+    )
+
+
+def file_sha256(filepath: Path, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容的 SHA-256。"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CompressionManifest:
+    """增量压缩清单，保存在输出目录旁（如 compressed.manifest.json）。
+
+    每个源文件记录大小、mtime、内容哈希、压缩参数以及对应的输出文件（相对输出目录的路径）。
+    大小与 mtime 未变时直接跳过；变化时再比对内容哈希，避免仅 touch 过的文件被重压。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries: dict[str, dict] = {}
+        # 本轮待压缩文件的 (stat, 哈希)，压缩成功后由 record 写入 entries
+        self.pending: dict[str, tuple[os.stat_result, str]] = {}
+        self.load()
+
+    @classmethod
+    def for_output_dir(cls, output_dir: Path) -> "CompressionManifest":
+        output_dir = Path(output_dir)
+        return cls(output_dir.with_name(f"{output_dir.name}.manifest.json"))
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            print(f"清单文件无法读取，将全部重新压缩: {self.path} -> {exc}")
+            return
+        if data.get("version") == self.VERSION:
+            self.entries = data.get("files", {})
+
+    def save(self) -> None:
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "files": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def relative_outputs(outputs: list[tuple[Rendition, Path]], output_dir: Path) -> list[str]:
+        return [out_path.relative_to(output_dir).as_posix() for _, out_path in outputs]
+
+    @staticmethod
+    def _entry_outputs(entry: dict) -> list[str]:
+        # 旧清单只记录单个 output
+        if "outputs" in entry:
+            return entry["outputs"]
+        return [entry["output"]] if entry.get("output") else []
+
+    def plan(self, tasks: list[tuple[Path, list[tuple[Rendition, Path]]]], params: dict,
+             output_dir: Path) -> tuple[list[tuple[Path, list[tuple[Rendition, Path]]]], list[str]]:
+        """筛出需要重新压缩的任务，返回 (待处理任务, 跳过的源文件路径)。
+
+        跳过的条件：参数一致、各规格输出文件仍存在，且大小与 mtime 未变或内容哈希未变。
+        待处理任务的内容哈希会暂存在 self.pending 中，供压缩成功后写入清单
+        （可多次调用，监听模式下逐个文件规划）。
+        """
+        todo: list[tuple[Path, list[tuple[Rendition, Path]]]] = []
+        skipped: list[str] = []
+        for img_file, outputs in tasks:
+            entry = self.entries.get(img_file.name)
+            stat = img_file.stat()
+            reusable = (
+                entry is not None
+                and entry.get("params") == params
+                and self._entry_outputs(entry) == self.relative_outputs(outputs, output_dir)
+                and all(out_path.exists() for _, out_path in outputs)
+            )
+            if reusable and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                skipped.append(str(img_file))
+                continue
+
+            digest = file_sha256(img_file)
+            if reusable and entry["sha256"] == digest:
+                # 内容未变（仅被 touch 或复制），刷新 stat 即可
+                entry["size"] = stat.st_size
+                entry["mtime_ns"] = stat.st_mtime_ns
+                skipped.append(str(img_file))
+                continue
+
+            self.pending[img_file.name] = (stat, digest)
+            todo.append((img_file, outputs))
+        return todo, skipped
+
+    def record(self, img_file: Path, outputs: list[str], params: dict, output_dir: Path | None = None) -> None:
+        """记录压缩成功的源文件；outputs 为相对输出目录的路径。
+
+        给出 output_dir 时，删除该源文件上次记录、但不在本次输出中的文件
+        （切换输出编码或规格后文件名会变化），仍被其他源文件占用的输出保留。
+        """
+        previous = self.entries.get(img_file.name)
+        stale = [o for o in self._entry_outputs(previous) if o not in outputs] if previous and output_dir else []
+        if stale:
+            live = {name for other, entry in self.entries.items() if other != img_file.name
+                    for name in self._entry_outputs(entry)}
+            for output in stale:
+                path = Path(output_dir) / output
+                if output not in live and path.exists():
+                    path.unlink()
+        stat, digest = self.pending.pop(img_file.name)
+        self.entries[img_file.name] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest,
+            "params": params,
+            "outputs": outputs,
+        }
+
+    def prune(self, tasks: list[tuple[Path, list[tuple[Rendition, Path]]]], output_dir: Path) -> list[str]:
+        """删除源文件已不存在的条目及其输出（输出仍被其他源文件占用时保留）。"""
+        current = {img_file.name for img_file, _ in tasks}
+        live_outputs = {name for _, outputs in tasks for name in self.relative_outputs(outputs, output_dir)}
+        removed: list[str] = []
+        for name in [n for n in self.entries if n not in current]:
+            for output in self._entry_outputs(self.entries.pop(name)):
+                if output in live_outputs:
+                    continue
+                stale = Path(output_dir) / output
+                if stale.exists():
+                    stale.unlink()
+                    removed.append(str(stale))
+        return removed
+
+
+class CompressionCache:
+    """跨运行的压缩结果缓存：<cache_dir>/<参数摘要>/<哈希前两位>/<哈希>/<规格名><扩展名>。
+
+    压缩参数（含多规格设置）变化时参数摘要随之变化，旧结果自然不会命中。
+    写入缓存与由缓存生成输出都是复制（copy_atomic），缓存条目与输出互不影响。
+    命中时刷新条目目录的 mtime，evict 按 mtime 从旧到新淘汰，直到总大小不超过 max_bytes。
+    缓存只是优化：读写缓存失败由调用方告警后按未命中处理。
+    """
+
+    def __init__(self, cache_dir: Path, params: dict, extension: str = ".jpg", max_bytes: int = 0):
+        self.cache_dir = Path(cache_dir)
+        self.extension = extension
+        self.max_bytes = max_bytes
+        params_key = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.root = self.cache_dir / params_key
+
+    def _entry_dir(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def lookup(self, digest: str, renditions: list[Rendition]) -> list[Path] | None:
+        """返回各规格的缓存文件；任一规格缺失时视为未命中。"""
+        entry = self._entry_dir(digest)
+        paths = [entry / f"{r.name}{self.extension}" for r in renditions]
+        if not all(path.exists() for path in paths):
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return paths
+
+    def store(self, digest: str, renditions: list[Rendition], outputs: list[str]) -> None:
+        entry = self._entry_dir(digest)
+        entry.mkdir(parents=True, exist_ok=True)
+        for rendition, output in zip(renditions, outputs):
+            copy_atomic(Path(output), entry / f"{rendition.name}{self.extension}")
+
+    def evict(self) -> int:
+        """淘汰最久未使用的条目（所有参数摘要共享上限），返回删除的条目数。"""
+        if not self.max_bytes or not self.cache_dir.is_dir():
+            return 0
+        entries = []
+        total = 0
+        for entry in self.cache_dir.glob("*/*/*"):
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except OSError:
+                continue
+            total += size
+        removed = 0
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
 
 class ImageCompressor:
-    def __init__(self, min_size_kb: int = 400, max_size_kb: int = 600):
+    # 大图搜索参数：质量下限、缩放阶段使用的固定质量、最短边下限与缩放二分轮数
+    MIN_QUALITY = 15
+    FALLBACK_QUALITY = 50
+    MIN_DIMENSION = 100
+    SCALE_SEARCH_STEPS = 5
+    # 快速解码时保留的尺寸余量：预缩小后至少仍为目标尺寸的 REDUCING_GAP 倍，
+    # 最终再用 LANCZOS 精确缩放，保证画质不受影响
+    REDUCING_GAP = 2
+
+    def __init__(self, min_size_kb: int = 400, max_size_kb: int = 600, fast_decode: bool = True,
+                 parallel_encodes: int = 1, memory_budget_mb: int = 0,
+                 encoder: OutputEncoder | str = "baseline"):
         self.min_size_bytes = min_size_kb * 1024
         self.max_size_bytes = max_size_kb * 1024
         self.target_size_bytes = max_size_kb * 1024
+        # 大图在解码阶段按目标比例预缩小（JPEG 使用 DCT 缩放解码，其他格式解码后按整数倍 reduce）
+        self.fast_decode = fast_decode
+        # 搜索时每轮并行编码的候选数（>1 时改用 k 分搜索，0 表示由 compress_directory 按空闲核心数决定）
+        self.parallel_encodes = parallel_encodes
+        # 并行压缩的内存预算（MB，0 表示可用内存的一半），见 _compress_parallel
+        self.memory_budget_mb = memory_budget_mb
+        # 输出编码（ENCODERS 中的名称或 OutputEncoder）
+        self.encoder = ENCODERS[encoder] if isinstance(encoder, str) else encoder
+        # 最近一次 compress_image 的编码次数，以及最近一次 compress_directory 的编码总次数，
+        # 用于确认搜索带来的提速
+        self.last_encode_attempts = 0
+        self.total_encode_attempts = 0
+        # 最近一次 compress_image 的分阶段耗时（秒）与走的压缩分支
+        self.last_stats: dict = {}
+        # 单张图片内并行候选编码的线程池与各线程的图像副本，见 _encode_concurrently；
+        # 每张图片处理完即关闭（压缩器会随任务序列化到子进程，此时两者均为 None）
+        self._encode_pool: ThreadPoolExecutor | None = None
+        self._encode_local: threading.local | None = None
 
     def _get_file_size(self, filepath: Path) -> int:
         return os.path.getsize(filepath)
 
-    def compress_image(self, input_path: Path, output_path: Path, quality: int = 85) -> str | None:
+    @staticmethod
+    def _to_rgb(img: Image.Image) -> Image.Image:
+        # 统一转成 RGB；对带透明通道的图（PNG/WebP），使用白色背景
+        if img.mode in ("RGBA", "LA", "P"):
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            if img.mode == "P":
+                img = img.convert("RGBA")
+            background.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
+            return background
+        if img.mode != "RGB":
+            return img.convert("RGB")
+        return img
+
+    def _draft_decode(self, img: Image.Image, target_size: tuple[int, int]) -> None:
+        """JPEG 通过 draft 直接以 1/2、1/4、1/8 比例解码，结果尺寸不小于目标的 REDUCING_GAP 倍。"""
+        if img.format == "JPEG":
+            gap = self.REDUCING_GAP
+            img.draft(img.mode, (target_size[0] * gap, target_size[1] * gap))
+
+    def _pre_reduce(self, img: Image.Image, target_size: tuple[int, int]) -> Image.Image:
+        """解码后、模式转换前按整数倍 reduce，结果尺寸不小于目标的 REDUCING_GAP 倍，
+        避免在原始分辨率上做 RGBA 合成等操作。"""
+        factor = int(min(img.width / target_size[0], img.height / target_size[1]) / self.REDUCING_GAP)
+        if factor < 2:
+            return img
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        if img.mode == "RGBA":
+            # 预乘 alpha 后再降采样，避免透明边缘出现暗边
+            return img.convert("RGBa").reduce(factor).convert("RGBA")
+        if img.mode in ("RGB", "L"):
+            return img.reduce(factor)
+        return img
+
+    def _encode_timed(self, img: Image.Image, quality: int) -> tuple[bytes, float]:
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        img.save(buffer, self.encoder.format, **self.encoder.save_options(quality))
+        return buffer.getvalue(), time.perf_counter() - start
+
+    def _encode(self, img: Image.Image, quality: int) -> bytes:
+        """在内存中按输出编码编码并返回字节串，不落盘。"""
+        data, seconds = self._encode_timed(img, quality)
+        self.last_encode_attempts += 1
+        self.last_stats["encodes"].append(seconds)
+        return data
+
+    def _thread_image(self, img: Image.Image) -> Image.Image:
+        """当前编码线程专用的 img 副本（img.copy()），同一张图片在该线程内只复制一次。"""
+        local = self._encode_local
+        if getattr(local, "source", None) is not img:
+            local.source = img
+            local.image = img.copy()
+        return local.image
+
+    def _close_encode_pool(self) -> None:
+        """关闭候选编码线程池；线程退出后各线程持有的图像副本随之释放。"""
+        if self._encode_pool is not None:
+            self._encode_pool.shutdown(wait=True)
+        self._encode_pool = None
+        self._encode_local = None
+
+    def _encode_concurrently(self, img: Image.Image, jobs: list, encode) -> list[bytes]:
+        """在线程池中对同一张解码后的图片并行执行 encode(图片, 参数)，按 jobs 顺序返回编码结果。
+
+        Pillow 的编码与缩放在 C 层释放 GIL，多线程可以真正并行。save 会在 Image 对象上写入 encoderinfo，
+        同一 Image 对象不能被多个线程同时保存，因此每个线程使用自己的副本（img.copy()）。
+        线程池在一张图片的各轮搜索间复用，每个线程只复制一次，由 compress_renditions 结束时关闭。
+        """
+        if self._encode_pool is None:
+            self._encode_pool = ThreadPoolExecutor(max_workers=self.parallel_encodes)
+            self._encode_local = threading.local()
+        outcomes = list(self._encode_pool.map(lambda job: encode(self._thread_image(img), job), jobs))
+        for _, seconds in outcomes:
+            self.last_encode_attempts += 1
+            self.last_stats["encodes"].append(seconds)
+        return [data for data, _ in outcomes]
+
+    @staticmethod
+    def _narrow(results: dict, low, high, budget: int):
+        """根据一轮候选的编码结果收紧区间，保持不变式：low 可行，high 不可行。"""
+        infeasible = [value for value, data in results.items() if len(data) > budget and value < high]
+        if infeasible:
+            high = min(infeasible)
+        feasible = [value for value, data in results.items() if len(data) <= budget and low < value < high]
+        if feasible:
+            low = max(feasible)
+        return low, high
+
+    def _write_output(self, data: bytes, output_path: Path) -> str:
+        """将最终编码结果一次性写盘（先写临时文件再原子替换）。"""
+        extension = self.encoder.extension
+        final_output = output_path.with_suffix(extension)
+        temp_path = output_path.with_suffix(".tmp" + extension)
+        temp_path.write_bytes(data)
+        os.replace(temp_path, final_output)
+        return str(final_output)
+
+    def _search_quality(self, img: Image.Image, max_quality: int, budget: int | None = None) -> bytes | None:
+        """在 [MIN_QUALITY, max_quality] 内二分查找不超过目标大小（budget 字节，默认 target_size_bytes）
+        的最高质量，返回对应的编码结果；最低质量仍超标时返回 None。"""
+        budget = budget or self.target_size_bytes
+        if self.parallel_encodes > 1 and max_quality - self.MIN_QUALITY > 1:
+            return self._search_quality_parallel(img, max_quality, budget)
+        data = self._encode(img, max_quality)
+        if len(data) <= budget:
+            return data
+
+        low = self.MIN_QUALITY
+        best = self._encode(img, low) if low < max_quality else None
+        if best is None or len(best) > budget:
+            return None
+
+        # 不变式：low 可行，high 不可行
+        high = max_quality
+        while high - low > 1:
+            mid = (low + high) // 2
+            data = self._encode(img, mid)
+            if len(data) <= budget:
+                low, best = mid, data
+            else:
+                high = mid
+        return best
+
+    def _search_quality_parallel(self, img: Image.Image, max_quality: int, budget: int) -> bytes | None:
+        """k 分搜索：每轮并行编码区间内均匀分布的 k 个质量，区间每轮缩小为约 1/(k+1)。
+        在文件大小随质量单调增长时，结果与逐个二分相同。"""
+        k = self.parallel_encodes
+
+        def encode(image: Image.Image, quality: int) -> tuple[bytes, float]:
+            return self._encode_timed(image, quality)
+
+        # 第一轮同时包含两端：最高质量可行则直接返回，最低质量不可行则交给分辨率搜索
+        span = max_quality - self.MIN_QUALITY
+        qualities = sorted({self.MIN_QUALITY + round(span * i / (k - 1)) for i in range(k)})
+        results = dict(zip(qualities, self._encode_concurrently(img, qualities, encode)))
+        if len(results[max_quality]) <= budget:
+            return results[max_quality]
+        if len(results[self.MIN_QUALITY]) > budget:
+            return None
+
+        low, high = self._narrow(results, self.MIN_QUALITY, max_quality, budget)
+        best = results[low]
+        while high - low > 1:
+            qualities = sorted({low + round((high - low) * i / (k + 1)) for i in range(1, k + 1)} - {low, high})
+            results = dict(zip(qualities, self._encode_concurrently(img, qualities, encode)))
+            new_low, high = self._narrow(results, low, high, budget)
+            if new_low != low:
+                low, best = new_low, results[new_low]
+        return best
+
+    def _search_scale(self, img: Image.Image, budget: int | None = None) -> bytes:
+        """以固定质量 FALLBACK_QUALITY 二分查找不超过目标大小的最大分辨率。"""
+        budget = budget or self.target_size_bytes
+        width, height = img.size
+        # 最小允许缩放比例：短边不低于 MIN_DIMENSION
+        min_scale = self.MIN_DIMENSION / min(width, height)
+        if min_scale >= 1:
+            raise ValueError("无法压缩到目标大小，图片太大或目标尺寸太小")
+
+        def encode_at(scale: float) -> bytes:
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            return self._encode(img.resize(size, Image.Resampling.LANCZOS), self.FALLBACK_QUALITY)
+
+        if self.parallel_encodes > 1:
+            return self._search_scale_parallel(img, min_scale, budget)
+
+        best = encode_at(min_scale)
+        if len(best) > budget:
+            raise ValueError("无法压缩到目标大小，图片太大或目标尺寸太小")
+
+        # 不变式：low 可行，high 不可行（当前尺寸在最低质量下已超标）
+        low, high = min_scale, 1.0
+        for _ in range(self.SCALE_SEARCH_STEPS):
+            mid = (low + high) / 2
+            data = encode_at(mid)
+            if len(data) <= budget:
+                low, best = mid, data
+            else:
+                high = mid
+        return best
+
+    def _search_scale_parallel(self, img: Image.Image, min_scale: float, budget: int) -> bytes:
+        """分辨率的 k 分搜索：每轮并行缩放并编码 k 个比例，直到区间精度不低于逐个二分 SCALE_SEARCH_STEPS 轮。"""
+        k = self.parallel_encodes
+        width, height = img.size
+
+        def encode(image: Image.Image, scale: float) -> tuple[bytes, float]:
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            return self._encode_timed(image.resize(size, Image.Resampling.LANCZOS), self.FALLBACK_QUALITY)
+
+        # 第一轮包含下限 min_scale（必须可行）与区间内 k-1 个比例
+        scales = [min_scale] + [min_scale + (1.0 - min_scale) * i / k for i in range(1, k)]
+        results = dict(zip(scales, self._encode_concurrently(img, scales, encode)))
+        if len(results[min_scale]) > budget:
+            raise ValueError("无法压缩到目标大小，图片太大或目标尺寸太小")
+
+        # 不变式：low 可行，high 不可行（当前尺寸在最低质量下已超标）
+        precision = (1.0 - min_scale) / 2 ** self.SCALE_SEARCH_STEPS
+        low, high = self._narrow(results, min_scale, 1.0, budget)
+        best = results[low]
+        while high - low > precision:
+            scales = [low + (high - low) * i / (k + 1) for i in range(1, k + 1)]
+            results = dict(zip(scales, self._encode_concurrently(img, scales, encode)))
+            new_low, high = self._narrow(results, low, high, budget)
+            if new_low != low:
+                low, best = new_low, results[new_low]
+        return best
+
+    @staticmethod
+    def _fit_within(size: tuple[int, int], max_dimension: int) -> tuple[int, int]:
+        """等比缩小到最长边不超过 max_dimension（不放大）。"""
+        width, height = size
+        scale = min(1.0, max_dimension / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def _budget(self, rendition: Rendition) -> int:
+        """规格的字节预算：Rendition.max_size_kb，未指定时为压缩器的 max_size_kb。"""
+        return rendition.max_size_kb * 1024 if rendition.max_size_kb else self.max_size_bytes
+
+    def _full_target_size(self, original_size: int, image_size: tuple[int, int],
+                          budget: int | None = None) -> tuple[int, int] | None:
+        """全尺寸规格的目标分辨率：只依赖文件大小与头部尺寸；不超过预算（默认 max_size_kb）时返回 None（不缩放）。"""
+        if original_size <= (budget or self.max_size_bytes):
+            return None
+        scale_factor = math.sqrt((budget or self.target_size_bytes) / original_size)
+        return max(1, int(image_size[0] * scale_factor)), max(1, int(image_size[1] * scale_factor))
+
+    def _compress_full(self, img: Image.Image, original_size: int, target_size: tuple[int, int] | None,
+                       output_path: Path, quality: int, budget: int | None = None) -> tuple[str, Image.Image, str]:
+        """全尺寸规格，返回 (输出路径, 本级图像, 压缩分支)；budget 为该规格的字节预算。"""
+        # 情况一：小图，转 JPG 高质量
+        # 情况二：在区间内，标准化为 JPG
+        if target_size is None:
+            case = "small" if original_size < self.min_size_bytes else "normal"
+            return self._write_output(self._encode(img, 95), output_path), img, case
+
+        # 情况三：大图，按目标大小压缩（上一级已缩得更小时不放大）
+        target_size = (min(target_size[0], img.width), min(target_size[1], img.height))
+        if target_size != img.size:
+            step = time.perf_counter()
+            img = img.resize(target_size, Image.Resampling.LANCZOS)
+            self.last_stats["resize"] += time.perf_counter() - step
+
+        # 先在当前分辨率下二分质量；最低质量仍超标时，再固定质量二分分辨率。
+        # 所有候选都在内存中编码，只有最终结果写盘一次。
+        case = "large"
+        data = self._search_quality(img, quality, budget)
+        if data is None:
+            case = "large_rescaled"
+            data = self._search_scale(img, budget)
+        return self._write_output(data, output_path), img, case
+
+    def _compress_scaled(self, img: Image.Image, rendition: Rendition, output_path: Path,
+                         quality: int) -> tuple[str, Image.Image, str]:
+        """限制最长边的规格：由上一级图像缩放后在字节预算内搜索质量/分辨率。"""
+        target_size = self._fit_within(img.size, rendition.max_dimension)
+        if target_size != img.size:
+            step = time.perf_counter()
+            img = img.resize(target_size, Image.Resampling.LANCZOS)
+            self.last_stats["resize"] += time.perf_counter() - step
+
+        budget = self._budget(rendition)
+        case = "scaled"
+        data = self._search_quality(img, quality, budget)
+        if data is None:
+            case = "scaled_rescaled"
+            data = self._search_scale(img, budget)
+        return self._write_output(data, output_path), img, case
+
+    def compress_renditions(self, input_path: Path, outputs: list[tuple[Rendition, Path]],
+                            quality: int = 85) -> list[str] | None:
+        """一次解码生成多个规格，返回与 outputs 顺序一致的输出路径列表；失败时返回 None。
+
+        规格按尺寸从大到小处理（全尺寸在前，多个全尺寸规格按预算从大到小），每一级都从上一级的图像缩放，
+        解码阶段的预缩小以最大的一级为准。
+        """
         input_path = Path(input_path)
-        output_path = Path(output_path)
+        self.last_encode_attempts = 0
+        stats = self.last_stats = {
+            "file": input_path.name, "case": None, "renditions": {},
+            "decode": 0.0, "convert": 0.0, "resize": 0.0, "encodes": [], "total": 0.0,
+        }
+        started = time.perf_counter()
 
         if not input_path.exists():
             raise FileNotFoundError(f"文件不存在: {input_path}")
 
+        order = sorted(range(len(outputs)), key=lambda i: (-(outputs[i][0].max_dimension or math.inf),
+                                                           -self._budget(outputs[i][0])))
+        results: list[str | None] = [None] * len(outputs)
         try:
+            original_size = self._get_file_size(input_path)
             with Image.open(input_path) as img:
-                # 统一转成 RGB；对带透明通道的图（PNG/WebP），使用白色背景
-                if img.mode in ("RGBA", "LA", "P"):
-                    background = Image.new("RGB", img.size, (255, 255, 255))
-                    if img.mode == "P":
-                        img = img.convert("RGBA")
-                    background.paste(img, mask=img.split()[-1] if img.mode == "RGBA" else None)
-                    img = background
-                elif img.mode != "RGB":
-                    img = img.convert("RGB")
-
-                original_width, original_height = img.size
-                original_size = self._get_file_size(input_path)
-
-                # 情况一：小图，转 JPG 高质量
-                if original_size < self.min_size_bytes:
-                    output_path.parent.mkdir(parents=True, exist_ok=True)
-                    final_output = output_path.with_suffix(".jpg")
-                    img.save(final_output, "JPEG", quality=95, optimize=True)
-                    return str(final_output)
+                # 最大一级的目标尺寸只依赖文件大小与头部尺寸，解码前即可确定
+                first = outputs[order[0]][0]
+                source_size = img.size
+                if first.max_dimension is None:
+                    decode_target = self._full_target_size(original_size, source_size, self._budget(first))
+                else:
+                    decode_target = self._fit_within(img.size, first.max_dimension)
+                    if decode_target == img.size:
+                        decode_target = None
+                if decode_target is not None and self.fast_decode:
+                    self._draft_decode(img, decode_target)
+
+                step = time.perf_counter()
+                img.load()
+                stats["decode"] = time.perf_counter() - step
+
+                step = time.perf_counter()
+                if decode_target is not None and self.fast_decode:
+                    img = self._pre_reduce(img, decode_target)
+                img = self._to_rgb(img)
+                stats["convert"] = time.perf_counter() - step
 
-                # 情况二：在区间内，标准化为 JPG
-                if self.min_size_bytes <= original_size <= self.max_size_bytes:
+                for i in order:
+                    rendition, output_path = outputs[i]
                     output_path.parent.mkdir(parents=True, exist_ok=True)
-                    final_output = output_path.with_suffix(".jpg")
-                    img.save(final_output, "JPEG", quality=95, optimize=True)
-                    return str(final_output)
-
-                # 情况三：大图，按目标大小压缩
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-
-                scale_factor = math.sqrt(self.target_size_bytes / original_size)
-                new_width = max(1, int(original_width * scale_factor))
-                new_height = max(1, int(original_height * scale_factor))
-
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-                current_quality = quality
-                temp_path = output_path.with_suffix(".tmp.jpg")
-
-                while current_quality > 10:
-                    img.save(temp_path, "JPEG", quality=current_quality, optimize=True)
-                    current_size = self._get_file_size(temp_path)
-                    if current_size <= self.target_size_bytes:
-                        final_output = output_path.with_suffix(".jpg")
-                        os.replace(temp_path, final_output)
-                        return str(final_output)
-                    current_quality -= 5
-
-                # 若质量很低仍超标，则继续缩小分辨率
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-
-                while True:
-                    new_width = int(new_width * 0.9)
-                    new_height = int(new_height * 0.9)
-                    if new_width < 100 or new_height < 100:
-                        raise ValueError("无法压缩到目标大小，图片太大或目标尺寸太小")
-
-                    img_resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    img_resized.save(temp_path, "JPEG", quality=50, optimize=True)
-                    current_size = self._get_file_size(temp_path)
-                    if current_size <= self.target_size_bytes:
-                        final_output = output_path.with_suffix(".jpg")
-                        os.replace(temp_path, final_output)
-                        return str(final_output)
+                    if rendition.max_dimension is None:
+                        budget = self._budget(rendition)
+                        results[i], img, case = self._compress_full(
+                            img, original_size, self._full_target_size(original_size, source_size, budget),
+                            output_path, quality, budget)
+                    else:
+                        results[i], img, case = self._compress_scaled(img, rendition, output_path, quality)
+                    stats["renditions"][rendition.name] = case
+                    if stats["case"] is None:
+                        stats["case"] = case
+            return results
 
         except Exception as exc:
+            stats["error"] = str(exc)
             print(f"压缩失败: {input_path.name} -> {exc}")
             return None
+        finally:
+            self._close_encode_pool()
+            stats["total"] = time.perf_counter() - started
+
+    def compress_image(self, input_path: Path, output_path: Path, quality: int = 85) -> str | None:
+        """压缩单张图片为一份全尺寸 JPG，返回输出路径；失败时返回 None。"""
+        results = self.compress_renditions(input_path, [(DEFAULT_RENDITIONS[0], Path(output_path))], quality)
+        return results[0] if results else None
+
+    def _record_stats(self, stats: dict) -> None:
+        """汇总单张图片的统计；开启运行指标时写出各阶段耗时"""
+        self.total_encode_attempts += len(stats["encodes"])
+        recorder = run_metrics.get_recorder()
+        if recorder.enabled:
+            recorder.observe(
+                "compress_image", stats["total"], label=stats["file"],
+                case=stats["case"], renditions=stats.get("renditions"), decode=round(stats["decode"], 6), convert=round(stats["convert"], 6),
+                resize=round(stats["resize"], 6), encodes=[round(t, 6) for t in stats["encodes"]],
+                error=stats.get("error"),
+            )
+
+    def _compress_serial(self, tasks: list[tuple[Path, list[tuple[Rendition, Path]]]], initial_quality: int,
+                         on_result=None) -> tuple[list[list[str] | None], list[int]]:
+        results: list[list[str] | None] = [None] * len(tasks)
+        failed: list[int] = []
+        # 自动模式：逐张处理时所有核心都留给单张图片的候选编码
+        auto_encodes = self.parallel_encodes == 0
+        if auto_encodes:
+            self.parallel_encodes = auto_parallel_encodes(1)
+        try:
+            for i, (img_file, outputs) in enumerate(tasks):
+                try:
+                    results[i], stats = _compress_task(self, img_file, outputs, initial_quality)
+                    self._record_stats(stats)
+                except Exception as exc:
+                    print(f"处理失败: {img_file.name} -> {exc}")
+                    failed.append(i)
+                    continue
+                if on_result is not None:
+                    on_result(i, results[i])
+        finally:
+            if auto_encodes:
+                self.parallel_encodes = 0
+        return results, failed
+
+    def estimate_memory(self, input_path: Path, renditions: list[Rendition] | None = None,
+                        encodes: int | None = None) -> int:
+        """只读文件头估计处理单张图片的峰值内存（字节），不解码像素。
+
+        解码结果按 宽 × 高 × 通道数 计算（Pillow 内部多通道图像每像素占 4 字节）；
+        JPEG 大图会按最大一级规格先 draft 缩小解码尺寸，这里同样调用 draft 得到实际解码尺寸。
+        带透明通道或调色板的图片转 RGB 时还需要一份 RGBA 副本和一张白色背景。
+        每个规格另计本级图像与搜索时的缓冲：缩放候选、各编码线程的图像副本和候选编码结果；
+        encodes 为同时编码的线程数，默认取 parallel_encodes。
+        """
+        renditions = list(renditions or DEFAULT_RENDITIONS)
+        k = max(1, encodes or self.parallel_encodes or 1)
+        try:
+            file_size = os.path.getsize(input_path)
+            with Image.open(input_path) as img:
+                source_size = img.size
+                first = max(renditions, key=lambda r: (r.max_dimension or math.inf, self._budget(r)))
+                if first.max_dimension is None:
+                    decode_target = self._full_target_size(file_size, source_size, self._budget(first))
+                else:
+                    decode_target = self._fit_within(source_size, first.max_dimension)
+                    if decode_target == source_size:
+                        decode_target = None
+                if decode_target is not None and self.fast_decode:
+                    self._draft_decode(img, decode_target)
+                width, height = img.size
+                bands = len(img.getbands())
+                mode = img.mode
+        except Exception:
+            # 无法识别的文件会在压缩时立即失败，不占用预算
+            return 0
+        pixels = width * height
+        decoded = pixels * (4 if bands > 1 else bands)
+        if mode in ("RGBA", "LA", "P", "PA"):
+            converted = pixels * 8
+        elif mode != "RGB":
+            converted = pixels * 4
+        else:
+            converted = 0
+
+        levels = 0
+        search = 0
+        for rendition in renditions:
+            budget = self._budget(rendition)
+            if rendition.max_dimension is None:
+                size = self._full_target_size(file_size, source_size, budget)
+            else:
+                size = self._fit_within(source_size, rendition.max_dimension)
+            if size is None:
+                # 不缩放的全尺寸规格直接编码解码结果
+                level = pixels * 4
+            else:
+                level = min(size[0] * size[1], pixels) * 4
+                levels += level
+            # 单线程时只有一张缩放候选；k 个编码线程各持有一份本级副本和一张缩放候选
+            copies = 2 * k if k > 1 else 1
+            # 候选编码结果按预算的两倍预留（BytesIO 扩容）
+            search = max(search, level * copies + 2 * k * budget)
+        return decoded + converted + levels + search
+
+    def memory_budget_bytes(self) -> int:
+        if self.memory_budget_mb:
+            return self.memory_budget_mb * 1024 * 1024
+        return available_memory_bytes() // 2
+
+    def _compress_parallel(self, tasks: list[tuple[Path, list[tuple[Rendition, Path]]]], initial_quality: int,
+                           workers: int, on_result=None) -> tuple[list[list[str] | None], list[int]]:
+        """多进程压缩，按内存预算准入。结果按输入顺序归位；on_result(i, 输出) 在每张完成时于主进程中调用。
+
+        - 由文件头估计每张图片的内存占用，按从小到大的顺序提交，小图先完成以提高吞吐
+        - 在途任务的估计总和不超过预算时才提交下一张；超出预算的单张大图等其他任务完成后单独处理
+        - 某个进程崩溃（如被 OOM 杀死，BrokenProcessPool）时重建进程池：
+          当时在途的任务各自单独重试一次，仍失败才记为失败，其余任务照常处理
+        - parallel_encodes 为 0（自动）时每次提交都按当时同时处理的图片数重新分配编码线程
+        """
+        budget = self.memory_budget_bytes()
+        # 自动分配编码线程时按满并发估计；独占运行的大图本就单独处理
+        encodes = self.parallel_encodes or auto_parallel_encodes(workers)
+        estimates = [self.estimate_memory(img_file, [rendition for rendition, _ in outputs], encodes)
+                     for img_file, outputs in tasks]
+        pending = deque(sorted(range(len(tasks)), key=lambda i: (estimates[i], i)))
+        results: list[list[str] | None] = [None] * len(tasks)
+        failed: list[int] = []
+        retried: set[int] = set()
+        in_flight: dict = {}
+        reserved = 0
+        peak_reserved = 0
+        exclusive_runs = 0
+
+        def exclusive(i: int) -> bool:
+            return estimates[i] > budget or i in retried
+
+        auto_encodes = self.parallel_encodes == 0
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            while pending or in_flight:
+                # 准入：并发数与内存预算都有余量时提交；独占任务只在没有其他在途任务时提交
+                while pending and len(in_flight) < workers:
+                    i = pending[0]
+                    if in_flight and (exclusive(i) or any(exclusive(j) for j in in_flight.values())
+                                      or reserved + estimates[i] > budget):
+                        break
+                    if auto_encodes:
+                        # 核心数平均分给本张提交后预计同时处理的图片：队尾只剩几张大图、
+                        # 或独占运行时，空闲核心分给单张图片的候选编码（self 随每次提交序列化，取当时的值）
+                        concurrent = 1 if exclusive(i) else min(workers, len(in_flight) + len(pending))
+                        self.parallel_encodes = auto_parallel_encodes(concurrent)
+                    pending.popleft()
+                    img_file, outputs = tasks[i]
+                    in_flight[executor.submit(_compress_task, self, img_file, outputs, initial_quality)] = i
+                    reserved += estimates[i]
+                    peak_reserved = max(peak_reserved, reserved)
+                    if exclusive(i):
+                        exclusive_runs += 1
+                        break
+
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    i = in_flight.pop(future)
+                    reserved -= estimates[i]
+                    try:
+                        results[i], stats = future.result()
+                        self._record_stats(stats)
+                        if on_result is not None:
+                            on_result(i, results[i])
+                    except BrokenProcessPool:
+                        broken = True
+                        in_flight[future] = i
+                        reserved += estimates[i]
+                    except Exception as exc:
+                        print(f"处理失败: {tasks[i][0].name} -> {exc}")
+                        failed.append(i)
+
+                if broken:
+                    # 进程池已不可用：在途任务无法区分是谁导致崩溃，首次崩溃的逐个单独重试
+                    victims = sorted(in_flight.values(), key=lambda i: (estimates[i], i))
+                    in_flight.clear()
+                    reserved = 0
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=workers)
+                    for i in reversed(victims):
+                        if i in retried:
+                            print(f"处理失败: {tasks[i][0].name} -> 子进程异常退出（可能内存不足）")
+                            failed.append(i)
+                        else:
+                            retried.add(i)
+                            pending.appendleft(i)
+        finally:
+            executor.shutdown(wait=True)
+            if auto_encodes:
+                self.parallel_encodes = 0
+
+        recorder = run_metrics.get_recorder()
+        if recorder.enabled:
+            recorder.event("memory_schedule", budget_mb=round(budget / 1024 ** 2, 1),
+                           peak_reserved_mb=round(peak_reserved / 1024 ** 2, 1),
+                           largest_estimate_mb=round(max(estimates, default=0) / 1024 ** 2, 1),
+                           exclusive_runs=exclusive_runs, retried=len(retried))
+        return results, sorted(failed)
+
+    def _dispatch(self, tasks: list[tuple[Path, list[tuple[Rendition, Path]]]], initial_quality: int,
+                  workers: int, on_result=None) -> tuple[list[list[str] | None], list[int]]:
+        if workers > 1 and len(tasks) > 1:
+            return self._compress_parallel(tasks, initial_quality, min(workers, len(tasks)), on_result)
+        return self._compress_serial(tasks, initial_quality, on_result)
+
+    @staticmethod
+    def _materialize(sources: list, outputs: list[tuple[Rendition, Path]]) -> list[str]:
+        """由已有的压缩结果（同内容源图的输出或缓存文件）生成本任务的各规格输出。"""
+        materialized = []
+        for source, (_, out_path) in zip(sources, outputs):
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+            if Path(source) != out_path:
+                copy_atomic(Path(source), out_path)
+            materialized.append(str(out_path))
+        return materialized
+
+    def _compress_deduplicated(self, tasks: list[tuple[Path, list[tuple[Rendition, Path]]]], digests: list[str],
+                               initial_quality: int, workers: int, cache: CompressionCache | None,
+                               counts: dict, on_result=None) -> tuple[list[list[str] | None], list[int]]:
+        """按内容哈希分组：缓存命中的组直接生成输出；其余每组只压缩第一个文件，
+        同组其他文件的输出复制生成。counts 中累计 duplicates（组内复用）与 cache_hits（缓存命中）。
+        每组在首个文件压缩完成时立即写入缓存并生成同组输出，on_result 随之对组内每个文件调用。"""
+        groups: dict[str, list[int]] = {}
+        for i, digest in enumerate(digests):
+            groups.setdefault(digest, []).append(i)
+
+        results: list[list[str] | None] = [None] * len(tasks)
+        failed: list[int] = []
+        leaders: list[int] = []
+        for digest, members in groups.items():
+            cached = cache.lookup(digest, [r for r, _ in tasks[members[0]][1]]) if cache else None
+            if cached is None:
+                leaders.append(members[0])
+                continue
+            try:
+                materialized = [self._materialize(cached, tasks[i][1]) for i in members]
+            except OSError as exc:
+                # 缓存文件不可读等：按未命中处理，重新压缩
+                print(f"警告：读取压缩缓存失败，重新压缩 {tasks[members[0]][0].name} -> {exc}")
+                leaders.append(members[0])
+                continue
+            for i, result in zip(members, materialized):
+                results[i] = result
+                if on_result is not None:
+                    on_result(i, result)
+            counts["cache_hits"] += len(members)
+
+        cache_failed = False
+
+        def leader_done(j: int, result: list[str] | None) -> None:
+            nonlocal cache_failed
+            i = leaders[j]
+            results[i] = result
+            if not result:
+                return
+            if cache is not None and not cache_failed:
+                try:
+                    cache.store(digests[i], [r for r, _ in tasks[i][1]], result)
+                except OSError as exc:
+                    # 缓存只是优化，写入失败后本次运行不再写缓存
+                    cache_failed = True
+                    print(f"警告：写入压缩缓存失败，本次运行不再写入缓存 -> {exc}")
+            members = groups[digests[i]]
+            for m in members[1:]:
+                try:
+                    results[m] = self._materialize(result, tasks[m][1])
+                except OSError as exc:
+                    print(f"处理失败: {tasks[m][0].name} -> 无法由同内容文件生成输出: {exc}")
+                    failed.append(m)
+                    continue
+                counts["duplicates"] += 1
+            if on_result is not None:
+                for m in members:
+                    if results[m]:
+                        on_result(m, results[m])
+
+        _, leader_failed = self._dispatch([tasks[i] for i in leaders], initial_quality, workers, leader_done)
+        for j in leader_failed:
+            failed.extend(groups[digests[leaders[j]]])
+        return results, sorted(failed)
+
+    def manifest_params(self, initial_quality: int, renditions: tuple[Rendition, ...] = DEFAULT_RENDITIONS) -> dict:
+        """影响压缩输出的参数；任一变化都会使清单中的记录失效。"""
+        params = {
+            "min_size_kb": self.min_size_bytes // 1024,
+            "max_size_kb": self.max_size_bytes // 1024,
+            "initial_quality": initial_quality,
+        }
+        if tuple(renditions) != DEFAULT_RENDITIONS:
+            # 默认单规格不写入，保持与旧清单兼容
+            params["renditions"] = [asdict(r) for r in renditions]
+        if self.encoder != ENCODERS["baseline"]:
+            params["encoder"] = asdict(self.encoder)
+        return params
 
     def compress_directory(self, input_dir: Path, output_dir: Path | None = None,
-                            initial_quality: int = 85) -> list[str]:
+                            initial_quality: int = 85, workers: int = 1,
+                            incremental: bool = False,
+                            renditions: list[Rendition] | None = None, dedup: bool = False,
+                            cache_dir: Path | None = None) -> list[str]:
+        """压缩目录下的所有图片。
+
+        workers > 1 时使用多进程并行处理（0 或 None 表示使用全部 CPU 核心），
+        返回结果与串行模式一致，按文件名顺序排列。
+        incremental=True 时借助 CompressionManifest 只处理新增、变化或压缩参数变化的图片，
+        并清理源文件已删除的输出；返回值仅包含本次实际压缩的文件。压缩过程中清单按
+        MANIFEST_CHECKPOINT_SECONDS 定期保存，中途失败后重新运行可从断点继续。
+        renditions 为多规格输出（见 Rendition），每个源图只解码一次；返回值包含所有规格的输出。
+        dedup=True 时内容相同的源图只压缩一次；给出 cache_dir 时还会跨运行复用相同内容的压缩结果。
+        """
         input_dir = Path(input_dir)
         if not input_dir.exists():
             raise FileNotFoundError(f"目录不存在: {input_dir}")
@@ -141,25 +1108,86 @@ class ImageCompressor:
 
         output_dir.mkdir(exist_ok=True)
 
-        image_extensions = {".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp"}
-        processed_files: list[str] = []
-        failed_files: list[str] = []
+        if not workers:
+            workers = os.cpu_count() or 1
+        self.total_encode_attempts = 0
+        started = time.perf_counter()
 
-        # 仅遍历输入目录下的一级文件（不递归）
-        for img_file in input_dir.iterdir():
-            if img_file.is_file() and img_file.suffix.lower() in image_extensions:
-                out_path = output_dir / f"{img_file.stem}.jpg"
-                try:
-                    result = self.compress_image(img_file, out_path, quality=initial_quality)
-                    if result:
-                        processed_files.append(result)
-                except Exception as exc:
-                    print(f"处理失败: {img_file.name} -> {exc}")
-                    failed_files.append(str(img_file))
+        renditions = tuple(renditions) if renditions else DEFAULT_RENDITIONS
+        if len({r.name for r in renditions}) != len(renditions):
+            raise ValueError("规格名称不能重复")
+        tasks = [
+            (img_file, [(r, r.output_path(output_dir, img_file.stem, self.encoder.extension)) for r in renditions])
+            for img_file in list_image_files(input_dir)
+        ]
+
+        manifest = None
+        skipped: list[str] = []
+        removed: list[str] = []
+        params = self.manifest_params(initial_quality, renditions)
+        if incremental:
+            manifest = CompressionManifest.for_output_dir(output_dir)
+            removed = manifest.prune(tasks, output_dir)
+            tasks, skipped = manifest.plan(tasks, params, output_dir)
+
+        dedup_counts = {"duplicates": 0, "cache_hits": 0}
+        on_result = None
+        if manifest is not None:
+            last_checkpoint = time.monotonic()
+
+            def on_result(i: int, result: list[str] | None) -> None:
+                # 每张完成即写入清单，按检查点间隔落盘
+                nonlocal last_checkpoint
+                if not result:
+                    return
+                img_file, outputs = tasks[i]
+                manifest.record(img_file, manifest.relative_outputs(outputs, output_dir), params, output_dir)
+                if time.monotonic() - last_checkpoint >= MANIFEST_CHECKPOINT_SECONDS:
+                    manifest.save()
+                    last_checkpoint = time.monotonic()
+        try:
+            if dedup and tasks:
+                # 增量模式下 plan 已计算过待处理文件的哈希
+                digests = [manifest.pending[img_file.name][1] if manifest is not None else file_sha256(img_file)
+                           for img_file, _ in tasks]
+                cache = (CompressionCache(cache_dir, params, self.encoder.extension, DEDUP_CACHE_MAX_MB * 1024 * 1024)
+                         if cache_dir else None)
+                results, failed = self._compress_deduplicated(tasks, digests, initial_quality, workers,
+                                                              cache, dedup_counts, on_result)
+                if cache is not None:
+                    cache.evict()
+            else:
+                results, failed = self._dispatch(tasks, initial_quality, workers, on_result)
+        finally:
+            if manifest is not None:
+                # 中断时也保存已完成的部分，重新运行时从断点继续
+                manifest.save()
+
+        processed_files: list[str] = [path for result in results if result for path in result]
+        processed_count = sum(1 for result in results if result)
+        failed_files: list[str] = [str(tasks[i][0]) for i in failed]
+
+        recorder = run_metrics.get_recorder()
+        if recorder.enabled:
+            elapsed = time.perf_counter() - started
+            recorder.event("compress_directory", input_dir=str(input_dir), files=len(tasks),
+                           processed=processed_count, outputs=len(processed_files), failed=len(failed_files),
+                           skipped=len(skipped), duplicates=dedup_counts["duplicates"],
+                           cache_hits=dedup_counts["cache_hits"],
+                           encodes=self.total_encode_attempts, seconds=round(elapsed, 6),
+                           images_per_sec=round(len(tasks) / elapsed, 2) if elapsed else None)
 
         print("\n批量处理完成!")
-        print(f"成功处理: {len(processed_files)} 个文件")
+        print(f"成功处理: {processed_count} 个文件")
+        if len(renditions) > 1:
+            print(f"输出规格: {', '.join(r.name for r in renditions)}，共写出 {len(processed_files)} 个文件")
+        if dedup:
+            print(f"重复内容复用: {dedup_counts['duplicates']} 个文件，缓存命中: {dedup_counts['cache_hits']} 个文件")
+        if incremental:
+            print(f"未变化跳过: {len(skipped)} 个文件")
+            print(f"清理过期输出: {len(removed)} 个文件")
         print(f"失败: {len(failed_files)} 个文件")
+        print(f"编码次数: {self.total_encode_attempts}")
         if failed_files:
             print("失败文件列表：")
             for f in failed_files:
@@ -168,6 +1196,76 @@ class ImageCompressor:
         return processed_files
 
 
+def compare_encoders(files: list[Path], encoder_names: list[str], min_size_kb: int = 400,
+                     max_size_kb: int = 600, initial_quality: int = 85) -> list[dict]:
+    """用各输出编码分别压缩同一批图片（写入临时目录，不影响正式输出），
+    返回每张图片、每种编码的一行：file, encoder, bytes, encodes, encode_seconds, total_seconds, case。"""
+    rows: list[dict] = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in encoder_names:
+            compressor = ImageCompressor(min_size_kb=min_size_kb, max_size_kb=max_size_kb, encoder=name)
+            for img_file in files:
+                result = compressor.compress_image(img_file, Path(temp_dir) / f"{name}_{img_file.stem}",
+                                                   quality=initial_quality)
+                stats = compressor.last_stats
+                rows.append({
+                    "file": img_file.name,
+                    "encoder": name,
+                    "bytes": os.path.getsize(result) if result else None,
+                    "encodes": len(stats["encodes"]),
+                    "encode_seconds": sum(stats["encodes"]),
+                    "total_seconds": stats["total"],
+                    "case": stats["case"],
+                })
+    return rows
+
+
+def print_encoder_report(rows: list[dict], max_size_kb: int) -> str | None:
+    """打印每张图片各编码的体积与编码耗时，以及各编码的汇总；返回全部不超过 max_size_kb 且总体积最小的编码。"""
+    encoder_names = list(dict.fromkeys(row["encoder"] for row in rows))
+    by_file: dict[str, dict[str, dict]] = {}
+    for row in rows:
+        by_file.setdefault(row["file"], {})[row["encoder"]] = row
+
+    print("每张图片（体积 KB / 编码耗时 ms）：")
+    print("文件".ljust(24) + "".join(name.rjust(20) for name in encoder_names))
+    for file_name, per_encoder in by_file.items():
+        cells = []
+        for name in encoder_names:
+            row = per_encoder[name]
+            cells.append("失败".rjust(20) if row["bytes"] is None else
+                         f"{row['bytes'] / 1024:.1f} / {row['encode_seconds'] * 1000:.0f}".rjust(20))
+        print(file_name[:24].ljust(24) + "".join(cells))
+
+    # 所有编码都失败的文件（如源图损坏）与编码无关，不参与比较
+    unreadable = {file_name for file_name, per_encoder in by_file.items()
+                  if all(row["bytes"] is None for row in per_encoder.values())}
+    if unreadable:
+        print(f"\n无法读取的源图（不参与比较）：{', '.join(sorted(unreadable))}")
+
+    print("\n汇总：")
+    best = None
+    best_bytes = None
+    limit = max_size_kb * 1024
+    for name in encoder_names:
+        encoder_rows = [row for row in rows if row["encoder"] == name and row["file"] not in unreadable]
+        done = [row for row in encoder_rows if row["bytes"] is not None]
+        total_bytes = sum(row["bytes"] for row in done)
+        over = sum(1 for row in done if row["bytes"] > limit)
+        failed = len(encoder_rows) - len(done)
+        encode_seconds = sum(row["encode_seconds"] for row in encoder_rows)
+        encodes = sum(row["encodes"] for row in encoder_rows)
+        print(f"  {name}: 总体积 {total_bytes / 1024:.1f} KB，编码 {encodes} 次共 {encode_seconds:.2f} s，"
+              f"超出 {max_size_kb}KB {over} 个，失败 {failed} 个")
+        if not over and not failed and (best_bytes is None or total_bytes < best_bytes):
+            best, best_bytes = name, total_bytes
+    if best:
+        print(f"推荐：{best}（全部不超过 {max_size_kb}KB 且总体积最小）")
+    else:
+        print(f"没有能让全部图片不超过 {max_size_kb}KB 的编码")
+    return best
+
+
 def resolve_input_directory() -> Path:
     # 若指定绝对路径，则优先使用
     if INPUT_DIR_ABS.strip():
@@ -177,6 +1275,12 @@ def resolve_input_directory() -> Path:
     return (base_dir / TARGET_DIR_NAME).resolve()
 
 
+def resolve_cache_dir() -> Path | None:
+    if not DEDUP_CACHE_DIR.strip():
+        return None
+    return (Path(__file__).resolve().parent / Path(DEDUP_CACHE_DIR).expanduser()).resolve()
+
+
 def main() -> None:
     input_dir = resolve_input_directory()
     output_dir = input_dir / OUTPUT_SUBDIR_NAME
@@ -185,9 +1289,14 @@ def main() -> None:
     print(f"输入目录: {input_dir}")
     print(f"输出目录: {output_dir}")
     print(f"阈值设置: MIN={MIN_SIZE_KB}KB, MAX/TARGET={MAX_SIZE_KB}KB, 初始质量={INITIAL_QUALITY}")
+    print(f"并行进程数: {WORKERS or os.cpu_count()}，增量模式: {'开' if INCREMENTAL else '关'}")
 
-    compressor = ImageCompressor(min_size_kb=MIN_SIZE_KB, max_size_kb=MAX_SIZE_KB)
-    results = compressor.compress_directory(input_dir, output_dir, initial_quality=INITIAL_QUALITY)
+    compressor = ImageCompressor(min_size_kb=MIN_SIZE_KB, max_size_kb=MAX_SIZE_KB, parallel_encodes=PARALLEL_ENCODES,
+                                 memory_budget_mb=MEMORY_BUDGET_MB, encoder=OUTPUT_ENCODER)
+    results = compressor.compress_directory(input_dir, output_dir, initial_quality=INITIAL_QUALITY,
+                                            workers=WORKERS, incremental=INCREMENTAL,
+                                            renditions=[Rendition(**spec) for spec in RENDITIONS],
+                                            dedup=DEDUP, cache_dir=resolve_cache_dir() if DEDUP else None)
 
     print(f"\n完成，共处理 {len(results)} 个文件")
     print("============================================")
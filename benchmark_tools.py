@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试：生成合成数据，测量各工具的耗时、吞吐量与峰值内存，并与基线比较
+
+合成数据（固定随机种子，可复现）：
+- 食谱 CSV：id, source_id, language_code, title, content(JSON，含 stages), updated_at，与真实导出一致
+- 图片目录：RGBA PNG、P 模式 PNG、大尺寸 JPEG、中小尺寸 JPEG
+- 审计目录：按 NNN_S.jpg 命名的空文件（审计只看文件名）
+
+基准项目：
+  csv_transform       add_image_urls.process_csv_to_df
+  extract_stages      add_image_urls.extract_stages_and_source_id_from_df
+  compress_directory  auto_folder_compress.ImageCompressor.compress_directory
+  audit               check_missing_images_from_csv 的 CSV 解析 + 目录扫描 + 比对
+  db_update           update_recipes_from_csv.update_rows_batched（仅在专用的本地基准数据库上运行，见下）
+
+db_update 需要显式指定本机实例与基准专用账号：
+  RECIPES_DB_HOST=127.0.0.1 RECIPES_DB_USER=bench RECIPES_DB_NAME=recipe_bench RECIPES_DB_SSL=0
+基准数据库由本工具创建（已存在时拒绝运行），计时结束后整个删除；不会读写其他数据库。
+
+每个基准在独立子进程中运行，峰值内存取子进程的 VmHWM（无 /proc 时取 ru_maxrss）。
+
+使用方法：
+  python benchmark_tools.py                     # 运行全部基准并与基线比较
+  python benchmark_tools.py --save-baseline     # 运行并保存为新的基线
+  python benchmark_tools.py --only audit --recipes 5000
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(SCRIPT_DIR, 'benchmark_baseline.json')
+
+# 相对基线变慢超过该比例即视为性能回退
+REGRESSION_TOLERANCE = 0.2
+
+LANGUAGES = ['en', 'zh', 'fr', 'de', 'es']
+
+# db_update 基准的专用数据库名、允许的主机与账号前缀
+BENCH_DB_NAME = 'recipe_bench'
+BENCH_DB_HOSTS = {'localhost', '127.0.0.1', '::1'}
+BENCH_DB_USER_PREFIX = 'bench'
+
+
+# ======================== 合成数据 ========================
+
+def generate_recipes_csv(path, recipes=1000, languages=LANGUAGES, seed=42):
+    """生成与真实导出同结构的食谱 CSV，返回行数"""
+    rng = random.Random(seed)
+    rows = 0
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'source_id', 'language_code', 'title', 'content', 'updated_at'])
+        for source_id in range(1, recipes + 1):
+            stage_count = rng.randint(3, 8)
+            for language_code in languages:
+                stages = [
+                    {
+                        'stage': stage,
+                        'title': f'步骤 {stage} / Step {stage}',
+                        'description': ' '.join(rng.choice(['切', '炒', '煮', 'stir', 'bake', 'mix', '盐', 'oil'])
+                                                for _ in range(rng.randint(20, 60))),
+                        'duration': rng.randint(1, 30),
+                    }
+                    for stage in range(1, stage_count + 1)
+                ]
+                content = {
+                    'name': f'Recipe {source_id} ({language_code})',
+                    'ingredients': [{'name': f'ingredient {i}', 'amount': rng.randint(1, 500)}
+                                    for i in range(rng.randint(3, 12))],
+                    'stages': stages,
+                }
+                rows += 1
+                writer.writerow([rows, source_id, language_code, f'Recipe {source_id}',
+                                 json.dumps(content, ensure_ascii=False), '2024-01-01 00:00:00'])
+    return rows
+
+
+def _photo_like(rng, size, mode='RGB'):
+    """低分辨率随机噪声放大并模糊，得到近似照片的可压缩内容"""
+    from PIL import Image, ImageFilter
+
+    base = Image.frombytes('RGB', (64, 64), rng.randbytes(64 * 64 * 3))
+    img = base.resize(size, Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(1))
+    if mode == 'RGBA':
+        img = img.convert('RGBA')
+        img.putalpha(Image.frombytes('L', (64, 64), rng.randbytes(64 * 64)).resize(size))
+    elif mode == 'P':
+        img = img.convert('P', palette=Image.Palette.ADAPTIVE)
+    return img
+
+
+def generate_image_folder(directory, count=24, seed=42):
+    """生成覆盖多种尺寸与模式的图片目录，返回文件数"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    kinds = [
+        ('png', (2000, 2000), 'RGBA'),
+        ('png', (1024, 1024), 'P'),
+        ('jpg', (4000, 4000), 'RGB'),
+        ('jpg', (1200, 1200), 'RGB'),
+        ('jpg', (600, 600), 'RGB'),
+        ('webp', (1500, 1500), 'RGB'),
+    ]
+    for i in range(count):
+        ext, size, mode = kinds[i % len(kinds)]
+        img = _photo_like(rng, size, mode)
+        path = os.path.join(directory, f'{i // len(kinds) + 1}_{i % len(kinds) + 1}.{ext}')
+        if ext == 'jpg':
+            img.save(path, 'JPEG', quality=97)
+        else:
+            img.save(path)
+    return count
+
+
+def generate_audit_folder(directory, extract_csv, missing_ratio=0.05, extra=100, seed=42):
+    """按提取 CSV 中的 image_url 生成空图片文件，按比例缺失并加入多余文件"""
+    sys.path.insert(0, SCRIPT_DIR)
+    from check_missing_images_from_csv import collect_expected_filenames
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    names = sorted(collect_expected_filenames(extract_csv))
+    for name in names:
+        if rng.random() >= missing_ratio:
+            open(os.path.join(directory, f'{name}.jpg'), 'wb').close()
+    for i in range(extra):
+        open(os.path.join(directory, f'{900000 + i}_1.jpg'), 'wb').close()
+    return len(names)
+
+
+def prepare_workdir(workdir, recipes, images):
+    """生成全部合成数据（已存在则复用），返回各数据路径"""
+    os.makedirs(workdir, exist_ok=True)
+    paths = {
+        'recipes_csv': os.path.join(workdir, f'recipes_{recipes}.csv'),
+        'image_dir': os.path.join(workdir, f'images_{images}'),
+        'audit_dir': os.path.join(workdir, f'audit_{recipes}'),
+    }
+    paths['extract_csv'] = os.path.splitext(paths['recipes_csv'])[0] + '_extract_stage.csv'
+    sys.path.insert(0, SCRIPT_DIR)
+
+    if not os.path.exists(paths['recipes_csv']):
+        print(f"生成食谱 CSV：{paths['recipes_csv']}")
+        generate_recipes_csv(paths['recipes_csv'], recipes)
+    if not os.path.exists(paths['extract_csv']):
+        import add_image_urls
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            add_image_urls.process_csv_to_files(paths['recipes_csv'], os.path.join(workdir, 'with_images.csv'))
+    if not os.path.isdir(paths['image_dir']):
+        print(f"生成图片目录：{paths['image_dir']}")
+        generate_image_folder(paths['image_dir'], images)
+    if not os.path.isdir(paths['audit_dir']):
+        print(f"生成审计目录：{paths['audit_dir']}")
+        generate_audit_folder(paths['audit_dir'], paths['extract_csv'])
+    return paths
+
+
+# ======================== 基准项目 ========================
+# 每个函数返回 (处理条数, 单位, 耗时秒)，只计时被测部分
+
+def bench_csv_transform(paths):
+    import add_image_urls
+    start = time.perf_counter()
+    df = add_image_urls.process_csv_to_df(paths['recipes_csv'])
+    return len(df), 'rows', time.perf_counter() - start
+
+
+def bench_extract_stages(paths):
+    import add_image_urls
+    df = add_image_urls.process_csv_to_df(paths['recipes_csv'])
+    target = os.path.join(os.path.dirname(paths['recipes_csv']), 'bench_extract.csv')
+    start = time.perf_counter()
+    add_image_urls.extract_stages_and_source_id_from_df(df, target)
+    return len(df), 'rows', time.perf_counter() - start
+
+
+def bench_compress_directory(paths):
+    from auto_folder_compress import ImageCompressor
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        ImageCompressor().compress_directory(paths['image_dir'], output_dir, workers=1)
+        seconds = time.perf_counter() - start
+    return len(os.listdir(paths['image_dir'])), 'images', seconds
+
+
+def bench_audit(paths):
+    import check_missing_images_from_csv as audit
+    start = time.perf_counter()
+    expected = {audit.parse_image_stem(name) for name in audit.collect_expected_filenames(paths['extract_csv'])}
+    present, others = audit.scan_image_dir(paths['audit_dir'])
+    audit.audit_images(expected, present, others)
+    return len(expected), 'images', time.perf_counter() - start
+
+
+def db_benchmark_refusal():
+    """返回拒绝运行 db_update 基准的原因；主机、账号与数据库名都显式指向基准专用实例时返回 None"""
+    host = os.environ.get('RECIPES_DB_HOST', '')
+    user = os.environ.get('RECIPES_DB_USER', '')
+    name = os.environ.get('RECIPES_DB_NAME', '')
+    if host not in BENCH_DB_HOSTS:
+        return f"RECIPES_DB_HOST 必须为本机地址（{', '.join(sorted(BENCH_DB_HOSTS))}）"
+    if not user.startswith(BENCH_DB_USER_PREFIX):
+        return f"RECIPES_DB_USER 必须为基准专用账号（以 {BENCH_DB_USER_PREFIX} 开头）"
+    if name != BENCH_DB_NAME:
+        return f"RECIPES_DB_NAME 必须为 {BENCH_DB_NAME}"
+    return None
+
+
+def bench_db_update(paths):
+    """新建基准专用数据库、建表并灌入初始数据，计时批量更新，最后删除整个数据库"""
+    import pandas as pd
+    import pymysql
+    import update_recipes_from_csv as urc
+
+    refusal = db_benchmark_refusal()
+    if refusal:
+        raise RuntimeError(refusal)
+    config = urc.get_db_config()
+    # 不指定数据库连接，由本基准创建专用库；库已存在说明不是本工具创建的，拒绝使用
+    admin_config = {key: value for key, value in config.items() if key != 'database'}
+    admin = pymysql.connect(**admin_config)
+    try:
+        with admin.cursor() as cur:
+            try:
+                cur.execute(f"CREATE DATABASE `{BENCH_DB_NAME}`")
+            except pymysql.err.ProgrammingError as exc:
+                raise RuntimeError(f"数据库 {BENCH_DB_NAME} 已存在，请确认后手动删除再运行：{exc}")
+        try:
+            conn = urc.connect()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("CREATE TABLE recipes (source_id INT NOT NULL, "
+                                "language_code VARCHAR(16) NOT NULL, content LONGTEXT, "
+                                "PRIMARY KEY (source_id, language_code))")
+                    df = pd.read_csv(paths['recipes_csv'], dtype=str).fillna('')
+                    cur.executemany("INSERT INTO recipes (source_id, language_code, content) VALUES (%s, %s, %s)",
+                                    list(zip(df['source_id'], df['language_code'], ['[]'] * len(df))))
+                conn.commit()
+                rows = list(urc.iter_update_rows(df))
+                start = time.perf_counter()
+                urc.update_rows_batched(conn, rows)
+                return len(rows), 'rows', time.perf_counter() - start
+            finally:
+                conn.close()
+        finally:
+            with admin.cursor() as cur:
+                cur.execute(f"DROP DATABASE `{BENCH_DB_NAME}`")
+    finally:
+        admin.close()
+
+
+BENCHMARKS = {
+    'csv_transform': bench_csv_transform,
+    'extract_stages': bench_extract_stages,
+    'compress_directory': bench_compress_directory,
+    'audit': bench_audit,
+    'db_update': bench_db_update,
+}
+
+
+def _peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）
+
+    优先读取 /proc/self/status 的 VmHWM：ru_maxrss 会在 exec 时继承父进程的峰值，
+    父进程生成过大图时会掩盖子进程的真实值。
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # Linux 上 ru_maxrss 单位为 KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _run_benchmark(name, paths):
+    """子进程内执行：屏蔽被测函数的输出，返回计时与峰值内存"""
+    sys.path.insert(0, SCRIPT_DIR)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        items, unit, seconds = BENCHMARKS[name](paths)
+    return {
+        'items': items,
+        'unit': unit,
+        'seconds': round(seconds, 4),
+        'throughput': round(items / seconds, 1) if seconds else None,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def run_benchmarks(names, paths):
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        if name == 'db_update' and db_benchmark_refusal():
+            # 默认配置指向共享数据库，只有显式指定本机的基准专用账号与数据库时才运行
+            print(f"{name:<20} 跳过（{db_benchmark_refusal()}）")
+            continue
+        with context.Pool(1) as pool:
+            try:
+                result = pool.apply(_run_benchmark, (name, paths))
+            except Exception as exc:
+                print(f"{name:<20} 失败：{exc}")
+                continue
+        results[name] = result
+        print(f"{name:<20} {result['seconds']:>9.3f} s  {result['throughput']:>10} {result['unit']}/s  "
+              f"峰值内存 {result['peak_rss_mb']} MB")
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """返回性能回退的项目列表（耗时超过基线的 1 + tolerance 倍）"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or base.get('items') != result['items']:
+            continue
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1.0
+        print(f"{name:<20} 相对基线 {ratio:.2f}x（内存 {base['peak_rss_mb']} -> {result['peak_rss_mb']} MB）")
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='食谱工具性能基准测试')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'recipe_bench'),
+                        help='合成数据目录（已存在的数据会复用）')
+    parser.add_argument('--recipes', type=int, default=1000, help='合成食谱数量（每个食谱 5 种语言）')
+    parser.add_argument('--images', type=int, default=24, help='合成图片数量')
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help='只运行指定基准（可重复）')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='基线文件路径')
+    parser.add_argument('--save-baseline', action='store_true', help='将本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, help='允许的变慢比例')
+    args = parser.parse_args(argv)
+
+    paths = prepare_workdir(args.workdir, args.recipes, args.images)
+    results = run_benchmarks(args.only or list(BENCHMARKS), paths)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"已保存基线：{args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("未找到基线文件，使用 --save-baseline 生成")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"性能回退：{', '.join(regressions)}")
+        return 1
+    print("未发现性能回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
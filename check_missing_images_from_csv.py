@@ -2,16 +2,41 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import asyncio
+import csv
 import os
 import re
+import ssl
+import struct
 import sys
-from typing import List, Set
-
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
 
 #读取文件名在main中修改
 
 IMAGE_URL_PATTERN = re.compile(r'image_url"\s*:\s*"https?://[^/]+/recipe/(\d+_\d+)\.jpg"', re.IGNORECASE)
+# 列式存储的阶段表中 image_url 为单独一列，直接匹配 URL 本身
+BARE_IMAGE_URL_PATTERN = re.compile(r'https?://[^/]+/recipe/(\d+_\d+)\.jpg', re.IGNORECASE)
+
+# 兼容不同列名：stage 或 content 等（按顺序取第一个存在的列）
+STAGE_COLUMN_CANDIDATES = ['stage', 'stages', 'content']
+
+# 图片体积上限（KB），与 auto_folder_compress.MAX_SIZE_KB 保持一致
+DEFAULT_MAX_SIZE_KB = 600
+
+# JPEG 中携带尺寸信息的 SOF 标记（排除 DHT=C4、JPG=C8、DAC=CC）
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# 远程校验：并发连接数（每个连接保持 keep-alive 复用）与单个请求超时（秒）
+REMOTE_CONCURRENCY = 32
+REMOTE_TIMEOUT = 10.0
+# 连接被服务器提前关闭等瞬时错误时的重试次数
+REMOTE_RETRIES = 2
+EXPECTED_CONTENT_TYPE = 'image/jpeg'
+
+# content 单元格可能超过 csv 模块默认的 128KB 字段上限
+csv.field_size_limit(2 ** 31 - 1)
 
 
 def extract_filenames_from_text(text: str) -> List[str]:
@@ -24,100 +49,509 @@ def extract_filenames_from_text(text: str) -> List[str]:
     return IMAGE_URL_PATTERN.findall(text)
 
 
-def collect_expected_filenames(csv_path: str) -> Set[str]:
-    """读取 CSV，汇总所有期望存在的图片文件基名集合（不含扩展名）。"""
-    df = pd.read_csv(csv_path, encoding='utf-8-sig')
+def extract_urls_from_text(text: str) -> List[str]:
+    """与 extract_filenames_from_text 相同的匹配规则，返回完整的 image_url。"""
+    if not isinstance(text, str) or not text:
+        return []
+    # 匹配形如 image_url": "https://host/recipe/206_1.jpg"，取引号内的 URL
+    return [m.group(0).rsplit('"', 2)[1] for m in IMAGE_URL_PATTERN.finditer(text)]
+
 
-    # 兼容不同列名：stage 或 content 等
-    candidate_cols = [
-        'stage', 'stages', 'content',  # 最常见
-    ]
-    col = None
-    for c in candidate_cols:
-        if c in df.columns:
-            col = c
-            break
-    if col is None:
-        raise ValueError(f"未找到包含阶段数据的列，尝试列名：{candidate_cols}")
+def collect_expected_filenames_from_store(store_dir: str, language: Optional[str] = None,
+                                         source_id_range: Optional[Tuple[int, int]] = None) -> Set[str]:
+    """从列式存储的阶段表中只投影 image_url 列，汇总期望存在的图片文件基名集合。"""
+    import recipe_store
 
+    table = recipe_store.read_stages(store_dir, columns=['image_url'],
+                                     language=language, source_id_range=source_id_range)
     expected: Set[str] = set()
-    for cell in df[col].astype(str).tolist():
-        names = extract_filenames_from_text(cell)
-        expected.update(names)
+    for url in table.column('image_url').to_pylist():
+        if url:
+            match = BARE_IMAGE_URL_PATTERN.fullmatch(url)
+            if match:
+                expected.add(match.group(1))
     return expected
 
 
-def main() -> int:
+def _iter_stage_cells(csv_path: str):
+    """逐行读取 CSV，只生成阶段数据列的单元格文本。"""
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        col = next((c for c in STAGE_COLUMN_CANDIDATES if c in header), None)
+        if col is None:
+            raise ValueError(f"未找到包含阶段数据的列，尝试列名：{STAGE_COLUMN_CANDIDATES}")
+
+        index = header.index(col)
+        for row in reader:
+            if index < len(row):
+                yield row[index]
+
+
+def collect_expected_filenames(csv_path: str, language: Optional[str] = None,
+                               source_id_range: Optional[Tuple[int, int]] = None) -> Set[str]:
+    """流式读取 CSV，汇总所有期望存在的图片文件基名集合（不含扩展名）。
+
+    逐行读取并只对阶段数据列运行正则，不加载 pandas，也不整列物化到内存。
+    csv_path 为列式存储目录时改为读取其阶段表，language / source_id_range 下推到存储读取；
+    对 CSV 输入不生效。
+    """
+    if os.path.isdir(csv_path):
+        return collect_expected_filenames_from_store(csv_path, language=language, source_id_range=source_id_range)
+
+    expected: Set[str] = set()
+    for text in _iter_stage_cells(csv_path):
+        expected.update(extract_filenames_from_text(text))
+    return expected
+
+
+def collect_expected_urls(csv_path: str, base_url: Optional[str] = None, language: Optional[str] = None,
+                          source_id_range: Optional[Tuple[int, int]] = None) -> Dict[str, str]:
+    """汇总 基名 -> image_url；base_url 不为空时替换 URL 中 /recipe/ 之前的部分（如指向本地测试服务器）。
+
+    language / source_id_range 只对列式存储输入生效（见 collect_expected_filenames）。
+    """
+    urls: Dict[str, str] = {}
+    if os.path.isdir(csv_path):
+        import recipe_store
+
+        table = recipe_store.read_stages(csv_path, columns=['image_url'],
+                                         language=language, source_id_range=source_id_range)
+        found = (url for url in table.column('image_url').to_pylist() if url and BARE_IMAGE_URL_PATTERN.fullmatch(url))
+    else:
+        found = (url for text in _iter_stage_cells(csv_path) for url in extract_urls_from_text(text))
+    for url in found:
+        stem = BARE_IMAGE_URL_PATTERN.search(url).group(1)
+        if stem not in urls:
+            urls[stem] = f"{base_url.rstrip('/')}/{stem}.jpg" if base_url else url
+    return urls
+
+
+ImageKey = Tuple[int, int]
+
+
+def parse_image_stem(stem: str) -> Optional[ImageKey]:
+    """将 NNN_S 形式的基名解析为 (source_id, stage) 整数键；不符合时返回 None。
+
+    CSV 中的基名与目录中的文件名使用同一解析，前导零按整数归一（01_2 与 1_2 为同一张图）。
+    """
+    source_id, sep, stage = stem.partition('_')
+    if not sep or not (source_id.isascii() and source_id.isdigit() and stage.isascii() and stage.isdigit()):
+        return None
+    return int(source_id), int(stage)
+
+
+def format_image_key(key: ImageKey) -> str:
+    return f"{key[0]}_{key[1]}"
+
+
+def scan_image_dir(image_dir: str, recursive: bool = False,
+                   accepted_exts: Tuple[str, ...] = ('.jpg',)) -> Tuple[Dict[ImageKey, List[str]], List[str]]:
+    """单次 os.scandir 遍历图片目录，建立索引。
+
+    Returns:
+        present：(source_id, stage) -> 实际文件名列表（递归时为相对路径，可能含不同扩展或多个子目录）
+        others：扩展名符合但命名不符合 NNN_S 的图片文件（如 500.jpg）
+    """
+    present: Dict[ImageKey, List[str]] = {}
+    others: List[str] = []
+    pending = [(image_dir, '')]
+    while pending:
+        directory, prefix = pending.pop()
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if recursive:
+                        pending.append((entry.path, prefix + entry.name + '/'))
+                    continue
+                if not entry.is_file():
+                    continue
+                name = entry.name
+                stem, dot, ext = name.rpartition('.')
+                # 不处理无扩展名或其他扩展的文件
+                if not dot or '.' + ext.lower() not in accepted_exts:
+                    continue
+                key = parse_image_stem(stem)
+                if key is None:
+                    others.append(prefix + name)
+                else:
+                    present.setdefault(key, []).append(prefix + name)
+    return present, others
+
+
+def audit_images(expected: Set[ImageKey], present: Dict[ImageKey, List[str]],
+                 others: List[str], names: Optional[Dict[ImageKey, str]] = None) -> Tuple[List[str], List[str]]:
+    """由集合差得到缺失与多余的图片，均按 (source_id, stage) 排序。
+
+    names 为 键 -> CSV 中的原始基名，缺失列表按原始基名输出（未给出时按键格式化）。
+    """
+    names = names or {}
+    missing = [f"{names.get(key) or format_image_key(key)}.jpg" for key in sorted(expected - present.keys())]
+    extras: List[str] = []
+    # a) 符合 NNN_S 但 CSV 未包含的基名 -> 列出其实际文件名
+    for key in sorted(present.keys() - expected):
+        extras.extend(sorted(present[key]))
+    # b) 不符合 NNN_S 的图片文件，直接视为多余（如 500.jpg）
+    extras.extend(sorted(others))
+    return missing, extras
+
+
+def _read_jpeg_size(f) -> Optional[Tuple[int, int]]:
+    """逐段跳读 JPEG 标记直到 SOF，返回 (宽, 高)；只读取各段头部的少量字节。"""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue
+        if marker in (0xD9, 0xDA):
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>xHH', data)
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_image_header(path: str) -> Dict[str, object]:
+    """只读取文件头与文件尾，识别真实格式、尺寸以及是否截断（不做完整解码）。"""
+    info: Dict[str, object] = {'format': None, 'width': None, 'height': None, 'truncated': False}
+    size = os.path.getsize(path)
+    info['size'] = size
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\xff\xd8\xff'):
+            info['format'] = 'JPEG'
+            dims = _read_jpeg_size(f)
+            f.seek(max(0, size - 2))
+            info['truncated'] = f.read(2) != b'\xff\xd9'
+        elif head.startswith(b'\x89PNG\r\n\x1a\n'):
+            info['format'] = 'PNG'
+            dims = struct.unpack('>II', head[16:24]) if len(head) >= 24 else None
+            f.seek(max(0, size - 8))
+            info['truncated'] = f.read(8) != b'IEND\xaeB`\x82'
+        elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            info['format'] = 'WEBP'
+            dims = None
+        elif head[:6] in (b'GIF87a', b'GIF89a'):
+            info['format'] = 'GIF'
+            dims = struct.unpack('<HH', head[6:10])
+        else:
+            dims = None
+    if dims:
+        info['width'], info['height'] = dims
+    return info
+
+
+def validate_image(path: str, max_bytes: int, require_square: bool = True) -> List[str]:
+    """基于文件头校验单张图片，返回问题列表（空列表表示通过）。"""
+    try:
+        info = read_image_header(path)
+    except OSError as e:
+        return [f"读取失败：{e}"]
+
+    issues: List[str] = []
+    if info['format'] is None:
+        issues.append('无法识别的格式')
+    elif info['format'] != 'JPEG':
+        issues.append(f"实际格式为 {info['format']}")
+    if info['truncated']:
+        issues.append('文件可能被截断')
+    if info['width'] is None:
+        issues.append('无法从文件头读取尺寸')
+    elif require_square and info['width'] != info['height']:
+        issues.append(f"非正方形 {info['width']}x{info['height']}")
+    if info['size'] > max_bytes:
+        issues.append(f"超出体积上限 {info['size'] // 1024}KB > {max_bytes // 1024}KB")
+    return issues
+
+
+def confirm_with_full_decode(path: str, issues: List[str]) -> List[str]:
+    """对已标记的文件做一次完整解码复核：解码失败则补充原因；截断标记若能完整解码则撤销。"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return issues
+    try:
+        with Image.open(path) as img:
+            img.load()
+            size = img.size
+    except Exception as e:
+        return issues + [f"完整解码失败：{e}"]
+
+    confirmed = [issue for issue in issues if issue not in ('文件可能被截断', '无法从文件头读取尺寸')]
+    if '无法从文件头读取尺寸' in issues and size[0] != size[1]:
+        confirmed.append(f"非正方形 {size[0]}x{size[1]}")
+    return confirmed
+
+
+def validate_images(image_dir: str, names: List[str], max_bytes: int, require_square: bool = True,
+                    workers: Optional[int] = None) -> Dict[str, List[str]]:
+    """并行校验多张图片：先只读文件头，再只对被标记的文件完整解码复核。
+
+    Returns:
+        文件名 -> 问题列表（仅包含有问题的文件）
+    """
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+
+    def check(name: str) -> Tuple[str, List[str]]:
+        path = os.path.join(image_dir, name)
+        issues = validate_image(path, max_bytes, require_square)
+        if issues:
+            issues = confirm_with_full_decode(path, issues)
+        return name, issues
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return {name: issues for name, issues in executor.map(check, names) if issues}
+
+
+class _HeadConnection:
+    """单个 keep-alive 连接，按 (scheme, host, port) 复用；服务器要求关闭时自动重连。"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.origin: Optional[Tuple[str, str, int]] = None
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reused = False
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+        self.reader = self.writer = self.origin = None
+
+    async def _connect(self, origin: Tuple[str, str, int]) -> None:
+        await self.close()
+        scheme, host, port = origin
+        context = ssl.create_default_context() if scheme == 'https' else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context), self.timeout)
+        self.origin = origin
+        self.reused = False
+
+    async def head(self, url: str) -> Dict[str, object]:
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        if self.origin != origin:
+            await self._connect(origin)
+        host = parts.netloc
+        path = parts.path + (f"?{parts.query}" if parts.query else '')
+        request = (f"HEAD {path or '/'} HTTP/1.1\r\nHost: {host}\r\n"
+                   f"User-Agent: recipe-image-audit\r\nConnection: keep-alive\r\n\r\n")
+        self.writer.write(request.encode('ascii'))
+        await self.writer.drain()
+
+        status_line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not status_line:
+            raise ConnectionResetError('服务器关闭了连接')
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        headers: Dict[str, str] = {}
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        # HEAD 响应没有响应体；服务器不支持 keep-alive 时下次请求重新连接
+        keep_alive = headers.get('connection', '').lower() != 'close' and version.upper() != 'HTTP/1.0'
+        if keep_alive:
+            self.reused = True
+        else:
+            await self.close()
+        length = headers.get('content-length')
+        return {
+            'status': int(status),
+            'content_length': int(length) if length and length.isdigit() else None,
+            'content_type': headers.get('content-type'),
+        }
+
+
+async def _head_all(urls: List[str], concurrency: int, timeout: float) -> Dict[str, Dict[str, object]]:
+    """以 concurrency 个协程（各持一个 keep-alive 连接）并发发送 HEAD 请求。"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+    results: Dict[str, Dict[str, object]] = {}
+
+    async def worker() -> None:
+        conn = _HeadConnection(timeout)
+        try:
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                for attempt in range(REMOTE_RETRIES + 1):
+                    try:
+                        results[url] = await conn.head(url)
+                        break
+                    except (OSError, asyncio.TimeoutError, ssl.SSLError, ValueError) as e:
+                        # 复用的连接可能已被服务器关闭，重连后重试
+                        await conn.close()
+                        if attempt == REMOTE_RETRIES:
+                            results[url] = {'status': None, 'error': str(e) or type(e).__name__}
+        finally:
+            await conn.close()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(urls))))))
+    return results
+
+
+def verify_remote_images(urls: Dict[str, str], local_sizes: Optional[Dict[str, int]] = None,
+                         max_bytes: Optional[int] = None, concurrency: int = REMOTE_CONCURRENCY,
+                         timeout: float = REMOTE_TIMEOUT) -> Tuple[List[str], Dict[str, List[str]]]:
+    """并发 HEAD 校验图床上的图片。
+
+    Args:
+        urls：基名 -> URL
+        local_sizes：基名 -> 本地文件大小；给出时核对 Content-Length 是否一致
+
+    Returns:
+        (远程缺失的基名列表, 基名 -> 不一致问题列表)，均按 (source_id, stage) 排序
+    """
+    responses = asyncio.run(_head_all(list(urls.values()), concurrency, timeout)) if urls else {}
+    missing: List[str] = []
+    problems: Dict[str, List[str]] = {}
+    for stem in sorted(urls, key=lambda s: parse_image_stem(s) or (sys.maxsize, 0)):
+        response = responses[urls[stem]]
+        status = response['status']
+        if status == 404:
+            missing.append(stem)
+            continue
+        issues: List[str] = []
+        if status is None:
+            issues.append(f"请求失败：{response['error']}")
+        elif not 200 <= status < 300:
+            issues.append(f"HTTP {status}")
+        else:
+            content_type = (response['content_type'] or '').split(';')[0].strip().lower()
+            if content_type != EXPECTED_CONTENT_TYPE:
+                issues.append(f"Content-Type 为 {response['content_type'] or '空'}")
+            length = response['content_length']
+            if local_sizes and stem in local_sizes and length is not None and length != local_sizes[stem]:
+                issues.append(f"大小与本地不一致 {length} != {local_sizes[stem]} 字节")
+            if max_bytes and length is not None and length > max_bytes:
+                issues.append(f"超出体积上限 {length // 1024}KB > {max_bytes // 1024}KB")
+        if issues:
+            problems[stem] = issues
+    return missing, problems
+
+
+def run_remote_check(csv_path: str, base_url: Optional[str], image_dir: Optional[str],
+                     present_map: Dict[ImageKey, List[str]], max_bytes: int,
+                     concurrency: int, timeout: float, **filters) -> int:
+    """远程校验并打印结果，返回远程缺失的图片数"""
+    urls = collect_expected_urls(csv_path, base_url, **filters)
+    local_sizes: Dict[str, int] = {}
+    if image_dir:
+        for key, names in present_map.items():
+            stem = format_image_key(key)
+            if stem in urls and f"{stem}.jpg" in names:
+                local_sizes[stem] = os.path.getsize(os.path.join(image_dir, f"{stem}.jpg"))
+
+    missing, problems = verify_remote_images(urls, local_sizes, max_bytes, concurrency, timeout)
+    print(f"远程校验 URL 数：{len(urls)}")
+    print(f"远程缺失图片数量：{len(missing)}")
+    for stem in missing:
+        print(urls[stem])
+    print(f"远程校验未通过数量：{len(problems)}")
+    for stem, issues in problems.items():
+        print(f"{urls[stem]}：{'；'.join(issues)}")
+    return len(missing)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import recipe_store
+
     parser = argparse.ArgumentParser(description='检查 CSV 中 image_url 对应图片在目录下是否存在')
-    parser.add_argument('--csv', default='recipes_801_934_extract_stage.csv', help='输入 CSV 文件路径')
+    parser.add_argument('--csv', default='recipes_801_934_extract_stage.csv',
+                        help='输入 CSV 文件路径（也可以是列式存储目录，见 recipe_store.py）')
     parser.add_argument('--image-dir', default=os.path.join('801_934'), help='图片所在目录')
-    args = parser.parse_args()
+    parser.add_argument('--recursive', action='store_true', help='递归扫描子目录（适用于按分片存放的图片）')
+    parser.add_argument('--validate', action='store_true',
+                        help='校验已存在图片的真实格式、尺寸、是否正方形、是否截断与体积（只读文件头）')
+    parser.add_argument('--max-kb', type=int, default=DEFAULT_MAX_SIZE_KB, help='校验时的体积上限（KB）')
+    parser.add_argument('--allow-non-square', action='store_true', help='校验时不要求正方形')
+    parser.add_argument('--workers', type=int, default=None, help='校验并行线程数')
+    parser.add_argument('--remote', action='store_true',
+                        help='并发发送 HEAD 请求，校验 image_url 在图床上是否存在、类型与大小是否一致')
+    parser.add_argument('--base-url', help='远程校验时替换 URL 中 /recipe/ 之前的部分，'
+                                           '如 http://127.0.0.1:8000/recipe（用于本地测试服务器）')
+    parser.add_argument('--concurrency', type=int, default=REMOTE_CONCURRENCY, help='远程校验并发连接数')
+    parser.add_argument('--timeout', type=float, default=REMOTE_TIMEOUT, help='远程校验单个请求超时（秒）')
+    parser.add_argument('--fail-on-missing', action='store_true',
+                        help='存在缺失图片（本地，或 --remote 时远程）时以状态码 1 退出，供流水线据此阻止后续步骤')
+    parser.add_argument('--language', help='只审计指定语言（仅列式存储输入，下推到存储读取）')
+    parser.add_argument('--source-id-range', type=recipe_store.parse_source_id_range,
+                        help='只审计 source_id 闭区间，如 100-200、100-、-200（仅列式存储输入）')
+    args = parser.parse_args(argv)
 
     csv_path = args.csv
     image_dir = args.image_dir
+    filters = {'language': args.language, 'source_id_range': args.source_id_range}
 
     if not os.path.exists(csv_path):
         print(f"错误：找不到 CSV 文件：{csv_path}")
         return 1
+    if (args.language or args.source_id_range) and not os.path.isdir(csv_path):
+        print("提示：--language / --source-id-range 只对列式存储输入生效，CSV 输入将全部审计")
     if not os.path.isdir(image_dir):
-        print(f"错误：找不到图片目录：{image_dir}")
-        return 1
+        if not args.remote:
+            print(f"错误：找不到图片目录：{image_dir}")
+            return 1
+        # 只做远程校验
+        print(f"未找到图片目录：{image_dir}，跳过本地检查")
+        try:
+            remote_missing = run_remote_check(csv_path, args.base_url, None, {}, args.max_kb * 1024,
+                                              args.concurrency, args.timeout, **filters)
+        except Exception as e:
+            print(f"远程校验失败：{e}")
+            return 1
+        return 1 if args.fail_on_missing and remote_missing else 0
 
     try:
-        expected = collect_expected_filenames(csv_path)
+        expected = collect_expected_filenames(csv_path, **filters)
     except Exception as e:
         print(f"解析 CSV 失败：{e}")
         return 1
 
-    missing: List[str] = []
-    for name in sorted(expected, key=lambda x: (int(x.split('_')[0]), int(x.split('_')[1])) if '_' in x else x):
-        jpg_path = os.path.join(image_dir, f"{name}.jpg")
-        if not os.path.exists(jpg_path):
-            missing.append(f"{name}.jpg")
-
-    # 接受的图片扩展名（仅 .jpg）
-    accepted_exts = ['.jpg']
-
-    # 实际存在的图片：
-    # 1) present_map：命名符合 NNN_S（如 233_3） 的基名 -> 实际文件名列表（可能含不同扩展）
-    # 2) other_present_files：图片文件但命名不符合 NNN_S（如 500.jpg、readme.jpeg 等）
-    present_map: dict[str, list[str]] = {}
-    other_present_files: list[str] = []
+    # CSV 中的基名统一转为 (source_id, stage) 整数键；无法解析的基名（理论上不会出现）原样记为缺失
+    expected_names: Dict[ImageKey, str] = {}
+    unparsed: List[str] = []
+    for name in expected:
+        key = parse_image_stem(name)
+        if key is None:
+            unparsed.append(f"{name}.jpg")
+        else:
+            expected_names[key] = name
+    expected_keys = set(expected_names)
+
+    # 实际存在的图片：单次扫描建立 (source_id, stage) -> 文件名 的索引
     try:
-        for entry in os.scandir(image_dir):
-            if not entry.is_file():
-                continue
-            name = entry.name
-            name_lower = name.lower()
-            matched = False
-            for ext in accepted_exts:
-                if name_lower.endswith(ext):
-                    matched = True
-                    stem = name_lower[:-len(ext)]
-                    if re.fullmatch(r"\d+_\d+", stem):
-                        present_map.setdefault(stem, []).append(name)
-                    else:
-                        # 不是 NNN_S 的图片文件（如仅数字 500.jpg），记为多余
-                        other_present_files.append(name)
-                    break
-            # 不处理无扩展名或其他扩展的文件
-    except Exception as e:
+        present_map, other_present_files = scan_image_dir(image_dir, recursive=args.recursive)
+    except OSError as e:
         print(f"读取图片目录失败：{e}")
+        present_map, other_present_files = {}, []
 
-    # 统计缺失：若该基名在 present_map 中存在任一扩展名，即不缺失
-    missing: List[str] = []
-    for name in sorted(expected, key=lambda x: (int(x.split('_')[0]), int(x.split('_')[1])) if '_' in x else x):
-        if name not in present_map:
-            # 按原始规则输出为 .jpg 名称
-            missing.append(f"{name}.jpg")
-
-    # 统计“多出来的图片”
-    extras: List[str] = []
-    # a) 符合 NNN_S 但 CSV 未包含的基名 -> 列出其实际文件名
-    for stem in sorted(set(present_map.keys()) - expected, key=lambda x: (int(x.split('_')[0]), int(x.split('_')[1]))):
-        extras.extend(sorted(present_map[stem]))
-    # b) 不符合 NNN_S 的图片文件，直接视为多余（如 500.jpg）
-    extras.extend(sorted(other_present_files))
+    missing, extras = audit_images(expected_keys, present_map, other_present_files, expected_names)
+    missing.extend(sorted(unparsed))
 
     total_expected = len(expected)
     # 目录内图片总数（符合扩展的全部文件 + 无扩展但疑似图片名）
@@ -141,6 +575,27 @@ def main() -> int:
     else:
         print("多出来的图片数量：0")
 
+    if args.validate:
+        names = [name for key in sorted(present_map.keys() & expected_keys) for name in sorted(present_map[key])]
+        problems = validate_images(image_dir, names, args.max_kb * 1024,
+                                   require_square=not args.allow_non_square, workers=args.workers)
+        print(f"已校验图片数：{len(names)}")
+        if problems:
+            print(f"校验未通过图片数量：{len(problems)}")
+            print("问题列表（文件名：问题）：")
+            for name in names:
+                if name in problems:
+                    print(f"{name}：{'；'.join(problems[name])}")
+        else:
+            print("校验未通过图片数量：0")
+
+    remote_missing = 0
+    if args.remote:
+        remote_missing = run_remote_check(csv_path, args.base_url, None if args.recursive else image_dir,
+                                          present_map, args.max_kb * 1024, args.concurrency, args.timeout, **filters)
+
+    if args.fail_on_missing and (missing or remote_missing):
+        return 1
     return 0
 
 
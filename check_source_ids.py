@@ -1,4 +1,28 @@
-import pandas as pd
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按 source_id 批量过滤 CSV
+
+- 包含/排除的 source_id 可来自文件（每行若干个，逗号或空白分隔，支持 100-200 区间，# 开头为注释），
+  也可直接在命令行给出
+- 可按 language_code 过滤
+- 支持通配符一次处理多个文件（如 'recipes_*_extract_stage.csv'），多进程并行，逐行流式读写
+- 每个文件输出 *_filtered.csv，并报告每个文件删除的行数
+- 输入也可以是列式存储目录（见 recipe_store.py）
+
+不带参数运行时，沿用下方的 input_file 与 target_source_ids（删除这些 source_id 的行）。
+
+使用方法：
+  python check_source_ids.py 'recipes_*_extract_stage.csv' --exclude-file bad_ids.txt
+  python check_source_ids.py recipes_601_700.csv --include 601-650 --language en
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
 # 指定要删除的source_id列表
 target_source_ids = {1, 9, 16, 19, 20, 22, 27, 28, 30, 31, 34, 43, 44, 59, 63, 74, 80, 94, 99, 101, 113, 123, 139, 143, 182, 203, 205, 209, 234, 252, 253, 254, 280, 291, 321, 463, 495, 508}
@@ -6,19 +30,256 @@ target_source_ids = {1, 9, 16, 19, 20, 22, 27, 28, 30, 31, 34, 43, 44, 59, 63, 7
 # 指定要读取的文件名
 input_file = 'recipes_401_500_extract_stage.csv'
 
-# 读取CSV文件
-df = pd.read_csv(input_file, encoding='utf-8-sig')
-
-# 检查source_id列是否存在
-if 'source_id' not in df.columns:
-    print("错误：CSV文件必须包含'source_id'列")
-else:
-    # 删除包含指定source_id的行
-    df_filtered = df[~df['source_id'].isin(target_source_ids)]
-    
-    # 生成输出文件名（在原文件名基础上添加_filtered后缀）
-    output_file = input_file.replace('.csv', '_filtered.csv')
-    
-    # 保存过滤后的数据到新的CSV文件
-    df_filtered.to_csv(output_file, index=False, encoding='utf-8-sig')
-    print(f"已删除指定source_id的行，并保存到 {output_file}") 
\ No newline at end of file
+csv.field_size_limit(2 ** 31 - 1)
+
+
+def parse_id_spec(text):
+    """解析 '1, 9 16\\n100-200' 形式的 source_id 说明，返回 (id 集合, [(起, 止), ...])"""
+    ids = set()
+    ranges = []
+    for line in text.splitlines():
+        line = line.split('#', 1)[0]
+        for token in line.replace(',', ' ').split():
+            if '-' in token:
+                low, high = token.split('-', 1)
+                ranges.append((int(low), int(high)))
+            else:
+                ids.add(int(token))
+    return ids, ranges
+
+
+def load_id_spec(path):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        return parse_id_spec(f.read())
+
+
+class SourceIdFilter:
+    """行过滤条件：source_id 在包含集合/区间内（若指定）、不在排除集合/区间内，且语言匹配（若指定）"""
+
+    def __init__(self, include_ids=None, include_ranges=None, exclude_ids=None, exclude_ranges=None,
+                 languages=None):
+        self.include_ids = set(include_ids or ())
+        self.include_ranges = list(include_ranges or ())
+        self.exclude_ids = set(exclude_ids or ())
+        self.exclude_ranges = list(exclude_ranges or ())
+        self.languages = set(languages) if languages else None
+        self.has_include = bool(self.include_ids or self.include_ranges)
+
+    @staticmethod
+    def _matches(source_id, ids, ranges):
+        return source_id in ids or any(low <= source_id <= high for low, high in ranges)
+
+    def keep(self, source_id, language_code=None):
+        if self.languages is not None and language_code not in self.languages:
+            return False
+        try:
+            sid = int(source_id)
+        except (TypeError, ValueError):
+            # 无法解析的 source_id 不会命中任何集合：有包含条件时丢弃，否则保留
+            return not self.has_include
+        if self.has_include and not self._matches(sid, self.include_ids, self.include_ranges):
+            return False
+        return not self._matches(sid, self.exclude_ids, self.exclude_ranges)
+
+    def store_filters(self):
+        """可下推到列式存储读取的条件（见 recipe_store._filter_expression）。
+
+        只下推能精确表达的部分：单一语言、仅由集合或仅由单个区间构成的包含条件、排除集合；
+        其余条件（多个区间、集合与区间混合、排除区间）仍由 keep 逐行判断，下推只负责提前裁剪。
+        """
+        filters = {}
+        if self.languages is not None and len(self.languages) == 1:
+            filters['language'] = next(iter(self.languages))
+        if self.include_ids and not self.include_ranges:
+            filters['source_ids'] = self.include_ids
+        elif len(self.include_ranges) == 1 and not self.include_ids:
+            filters['source_id_range'] = self.include_ranges[0]
+        if self.exclude_ids:
+            filters['exclude_ids'] = self.exclude_ids
+        return filters
+
+
+def default_output_file(path, suffix='_filtered', output_dir=None):
+    """在原文件名基础上添加后缀（列式存储目录输出为同名 CSV）"""
+    stem = os.path.splitext(path.rstrip('/\\'))[0]
+    output = f"{stem}{suffix}.csv"
+    if output_dir:
+        output = os.path.join(output_dir, os.path.basename(output))
+    return output
+
+
+def _iter_rows(path, id_filter=None):
+    """返回 (表头, 行迭代器, 总行数)；列式存储目录按行读取原始字符串，id_filter 中可下推的条件作用于读取阶段。
+
+    下推后被裁掉的行不会出现在迭代器中，因此存储的总行数取自元数据；CSV 的总行数为 None（由调用方计数）。
+    """
+    if os.path.isdir(path):
+        import recipe_store
+
+        header = recipe_store.recipe_columns(path)
+        filters = id_filter.store_filters() if id_filter is not None else {}
+        return header, recipe_store.iter_recipe_rows(path, header, **filters), recipe_store.count_recipes(path)
+
+    f = open(path, 'r', encoding='utf-8-sig', newline='')
+    reader = csv.reader(f)
+    header = next(reader, [])
+
+    def rows():
+        try:
+            yield from reader
+        finally:
+            f.close()
+    return header, rows(), None
+
+
+def filter_csv_file(path, output_file, id_filter):
+    """流式过滤单个文件，返回统计字典：input, output, rows, kept, removed, error"""
+    result = {'input': path, 'output': output_file, 'rows': 0, 'kept': 0, 'removed': 0, 'error': None}
+    need_language = id_filter.languages is not None
+    try:
+        header, rows, total = _iter_rows(path, id_filter)
+        if 'source_id' not in header:
+            raise ValueError("CSV文件必须包含'source_id'列")
+        if need_language and 'language_code' not in header:
+            raise ValueError("按语言过滤时CSV文件必须包含'language_code'列")
+        sid_index = header.index('source_id')
+        lang_index = header.index('language_code') if 'language_code' in header else None
+
+        with open(output_file, 'w', encoding='utf-8-sig', newline='') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            writer.writerow(header)
+            for row in rows:
+                result['rows'] += 1
+                language = row[lang_index] if lang_index is not None and lang_index < len(row) else None
+                source_id = row[sid_index].strip() if sid_index < len(row) and row[sid_index] else None
+                if id_filter.keep(source_id, language):
+                    writer.writerow(row)
+                    result['kept'] += 1
+        if total is not None:
+            result['rows'] = total
+        result['removed'] = result['rows'] - result['kept']
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def expand_inputs(patterns, suffix='_filtered'):
+    """展开通配符并去重，保持给定顺序。
+
+    通配符匹配到的、以本次输出后缀结尾的文件（上次运行的输出）会被跳过并给出提示；显式给出的文件总是处理。
+    """
+    files = []
+    for pattern in patterns:
+        from_glob = glob.has_magic(pattern)
+        matches = sorted(glob.glob(pattern)) if from_glob else [pattern]
+        for path in matches:
+            if path in files:
+                continue
+            if from_glob and suffix and path.rstrip('/\\').endswith(f"{suffix}.csv"):
+                print(f"提示：跳过通配符匹配到的输出文件 {path}（如需处理请显式指定）")
+                continue
+            files.append(path)
+    return files
+
+
+def find_output_collisions(jobs):
+    """返回 {输出文件: [输入, ...]}：多个输入映射到同一输出，或输出会覆盖某个输入"""
+    targets = {}
+    for path, output in jobs:
+        targets.setdefault(os.path.normcase(os.path.abspath(output)), []).append(path)
+    inputs = {os.path.normcase(os.path.abspath(path)) for path, _ in jobs}
+    return {output: sources for output, sources in targets.items() if len(sources) > 1 or output in inputs}
+
+
+def filter_files(paths, id_filter, suffix='_filtered', output_dir=None, workers=None):
+    """多进程并行过滤多个文件，结果按输入顺序返回。
+
+    多个输入会写到同一输出文件（如 r.csv 与 r.store 都对应 r_filtered.csv）或输出会覆盖输入时
+    抛出 ValueError，不处理任何文件。
+    """
+    jobs = [(path, default_output_file(path, suffix, output_dir)) for path in paths]
+    collisions = find_output_collisions(jobs)
+    if collisions:
+        details = '；'.join(f"{output} <- {', '.join(sources)}" for output, sources in collisions.items())
+        raise ValueError(f"输出文件名冲突（请分开处理或指定不同的 --suffix / --output-dir）：{details}")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if len(jobs) <= 1 or workers == 1:
+        return [filter_csv_file(path, output, id_filter) for path, output in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(filter_csv_file, path, output, id_filter) for path, output in jobs]
+        return [future.result() for future in futures]
+
+
+def filter_source_ids(input_file, source_ids, output_file=None):
+    """删除包含指定source_id的行，保存到 output_file（默认在原文件名基础上添加_filtered后缀）
+
+    Returns:
+        输出文件名；失败（如缺少source_id列）时返回 None
+    """
+    output_file = output_file or default_output_file(input_file)
+    result = filter_csv_file(input_file, output_file, SourceIdFilter(exclude_ids=source_ids))
+    if result['error']:
+        print(f"错误：{result['error']}")
+        return None
+    print(f"已删除指定source_id的行（删除 {result['removed']} 行），并保存到 {output_file}")
+    return output_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='按 source_id / 语言批量过滤 CSV')
+    parser.add_argument('inputs', nargs='*', default=[input_file], help='输入文件或通配符（可多个）')
+    parser.add_argument('--include', help="只保留这些 source_id，如 '601-650,700'")
+    parser.add_argument('--include-file', help='只保留文件中列出的 source_id')
+    parser.add_argument('--exclude', help="删除这些 source_id，如 '1,9,100-200'")
+    parser.add_argument('--exclude-file', help='删除文件中列出的 source_id')
+    parser.add_argument('--language', action='append', help='只保留指定 language_code（可重复）')
+    parser.add_argument('--output-dir', help='输出目录（默认与输入文件同目录）')
+    parser.add_argument('--suffix', default='_filtered', help='输出文件名后缀')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数')
+    args = parser.parse_args(argv)
+
+    include_ids, include_ranges = set(), []
+    exclude_ids, exclude_ranges = set(), []
+    for spec, ids, ranges in ((args.include, include_ids, include_ranges),
+                              (args.exclude, exclude_ids, exclude_ranges)):
+        if spec:
+            parsed_ids, parsed_ranges = parse_id_spec(spec)
+            ids.update(parsed_ids)
+            ranges.extend(parsed_ranges)
+    for path, ids, ranges in ((args.include_file, include_ids, include_ranges),
+                              (args.exclude_file, exclude_ids, exclude_ranges)):
+        if path:
+            parsed_ids, parsed_ranges = load_id_spec(path)
+            ids.update(parsed_ids)
+            ranges.extend(parsed_ranges)
+    if not (include_ids or include_ranges or exclude_ids or exclude_ranges or args.language):
+        # 未指定任何条件时沿用脚本内置的删除列表
+        exclude_ids = set(target_source_ids)
+
+    id_filter = SourceIdFilter(include_ids, include_ranges, exclude_ids, exclude_ranges, args.language)
+    paths = expand_inputs(args.inputs, args.suffix)
+    if not paths:
+        print("错误：没有匹配的输入文件")
+        return 1
+
+    try:
+        results = filter_files(paths, id_filter, args.suffix, args.output_dir, args.workers)
+    except ValueError as e:
+        print(f"错误：{e}")
+        return 1
+    failed = 0
+    for result in results:
+        if result['error']:
+            failed += 1
+            print(f"{result['input']}：失败 -> {result['error']}")
+        else:
+            print(f"{result['input']}：共 {result['rows']} 行，删除 {result['removed']} 行，"
+                  f"保留 {result['kept']} 行 -> {result['output']}")
+    total_removed = sum(r['removed'] for r in results)
+    print(f"共处理 {len(results)} 个文件，删除 {total_removed} 行，失败 {failed} 个文件")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式食谱存储（Parquet，可选依赖 pyarrow）
+
+一个存储是一个目录（约定以 .store 结尾），包含：
+- recipes.parquet：CSV 的全部原始列（均为字符串，保持原列顺序与原值），
+  外加派生列 _source_id_int（整数，供按 source_id 范围过滤）
+- stages.parquet：规范化的阶段表，每个 stage 一行：
+  source_id, language_code, stage_index, stage, image_url, stage_json
+
+CSV 与存储之间的转换是无损的：store_to_csv 输出的每个单元格与原 CSV 完全一致。
+读取时支持列投影与谓词下推（语言、source_id 范围、source_id 集合），
+image-urls / 提取 / 审计 / 过滤工具均可直接以存储目录作为输入。
+
+使用方法：
+  python recipe_store.py import recipes_601_700.csv recipes_601_700.store
+  python recipe_store.py export recipes_601_700.store recipes_601_700.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RECIPES_FILE = 'recipes.parquet'
+STAGES_FILE = 'stages.parquet'
+SOURCE_ID_INT = '_source_id_int'
+
+# 每个 row group 的行数；谓词下推以 row group 的统计信息为粒度
+ROW_GROUP_SIZE = 10000
+
+csv.field_size_limit(2 ** 31 - 1)
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("列式存储需要安装 pyarrow：pip install pyarrow")
+
+
+def _json_loads(text):
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_file_name(input_file):
+    """提取文件名：去掉输入（CSV 或存储目录）的扩展名后添加 _extract_stage 后缀。
+
+    只在最后一级路径上去扩展名，'./data/store' 得到 './data/store_extract_stage.csv'
+    """
+    stem = os.path.splitext(input_file.rstrip('/\\'))[0]
+    return f"{stem}_extract_stage.csv"
+
+
+def is_store(path):
+    """判断路径是否为列式存储目录"""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, RECIPES_FILE))
+
+
+def _stage_rows(source_id, language_code, raw_content):
+    """解析 content，返回该食谱的阶段行；无法解析或没有 stages 时返回空列表"""
+    try:
+        content = _json_loads(raw_content)
+    except (ValueError, TypeError):
+        return []
+    if not isinstance(content, dict) or not isinstance(content.get('stages'), list):
+        return []
+    rows = []
+    for index, stage in enumerate(content['stages']):
+        if not isinstance(stage, dict):
+            continue
+        stage_value = stage.get('stage')
+        rows.append({
+            'source_id': _to_int(source_id),
+            'language_code': language_code,
+            'stage_index': index,
+            'stage': stage_value if isinstance(stage_value, int) else _to_int(stage_value),
+            'image_url': stage.get('image_url'),
+            'stage_json': json.dumps(stage, ensure_ascii=False),
+        })
+    return rows
+
+
+def csv_to_store(csv_path, store_dir, row_group_size=ROW_GROUP_SIZE):
+    """流式将 CSV 转为列式存储，返回 (食谱行数, 阶段行数)"""
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    stages_schema = pa.schema([
+        ('source_id', pa.int64()),
+        ('language_code', pa.string()),
+        ('stage_index', pa.int32()),
+        ('stage', pa.int64()),
+        ('image_url', pa.string()),
+        ('stage_json', pa.string()),
+    ])
+
+    os.makedirs(store_dir, exist_ok=True)
+    recipe_rows = 0
+    stage_rows = 0
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        if len(set(header)) != len(header):
+            raise ValueError("CSV 存在重复列名，无法无损转换")
+        recipes_schema = pa.schema([(name, pa.string()) for name in header] + [(SOURCE_ID_INT, pa.int64())])
+        sid_index = header.index('source_id') if 'source_id' in header else None
+        lang_index = header.index('language_code') if 'language_code' in header else None
+        content_index = header.index('content') if 'content' in header else None
+
+        recipes_writer = pq.ParquetWriter(os.path.join(store_dir, RECIPES_FILE), recipes_schema)
+        stages_writer = pq.ParquetWriter(os.path.join(store_dir, STAGES_FILE), stages_schema)
+        try:
+            batch = []
+            stage_batch = []
+            for row in reader:
+                # 短行按 CSV 语义补空串，保证列数一致
+                row = row + [''] * (len(header) - len(row))
+                batch.append(row)
+                if content_index is not None:
+                    stage_batch.extend(_stage_rows(
+                        row[sid_index] if sid_index is not None else None,
+                        row[lang_index] if lang_index is not None else None,
+                        row[content_index],
+                    ))
+                if len(batch) >= row_group_size:
+                    recipe_rows += _write_recipes(recipes_writer, recipes_schema, header, batch, sid_index)
+                    stage_rows += _write_stages(stages_writer, stages_schema, stage_batch)
+                    batch, stage_batch = [], []
+            recipe_rows += _write_recipes(recipes_writer, recipes_schema, header, batch, sid_index)
+            stage_rows += _write_stages(stages_writer, stages_schema, stage_batch)
+        finally:
+            recipes_writer.close()
+            stages_writer.close()
+    return recipe_rows, stage_rows
+
+
+def _write_recipes(writer, schema, header, batch, sid_index):
+    if not batch:
+        return 0
+    import pyarrow as pa
+    columns = {name: [row[i] for row in batch] for i, name in enumerate(header)}
+    columns[SOURCE_ID_INT] = [_to_int(row[sid_index]) if sid_index is not None else None for row in batch]
+    writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+    return len(batch)
+
+
+def _write_stages(writer, schema, rows):
+    if not rows:
+        return 0
+    import pyarrow as pa
+    writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+    return len(rows)
+
+
+def parse_source_id_range(text):
+    """解析命令行的 source_id 闭区间 '100-200'，任一端可省略（'100-'、'-200'），返回 (起, 止)"""
+    low, sep, high = text.strip().partition('-')
+    try:
+        if not sep:
+            raise ValueError(text)
+        source_id_range = (int(low) if low.strip() else None, int(high) if high.strip() else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的 source_id 范围：{text}（应为 起-止，如 100-200、100-、-200）")
+    if source_id_range == (None, None):
+        raise argparse.ArgumentTypeError(f"无效的 source_id 范围：{text}（至少指定一端）")
+    return source_id_range
+
+
+def _filter_expression(language=None, source_id_range=None, source_ids=None, exclude_ids=None,
+                       id_column=SOURCE_ID_INT):
+    """组合谓词：语言、闭区间 source_id 范围、包含/排除的 source_id 集合"""
+    import pyarrow.dataset as ds
+
+    expression = None
+
+    def combine(part):
+        return part if expression is None else expression & part
+
+    if language is not None:
+        expression = combine(ds.field('language_code') == language)
+    if source_id_range is not None:
+        low, high = source_id_range
+        if low is not None:
+            expression = combine(ds.field(id_column) >= low)
+        if high is not None:
+            expression = combine(ds.field(id_column) <= high)
+    if source_ids is not None:
+        expression = combine(ds.field(id_column).isin(sorted(source_ids)))
+    if exclude_ids:
+        # source_id 无法解析为整数的行不会命中排除集合，需显式保留
+        expression = combine(~ds.field(id_column).isin(sorted(exclude_ids)) | ds.field(id_column).is_null())
+    return expression
+
+
+def _dataset(store_dir, name):
+    _require_pyarrow()
+    import pyarrow.dataset as ds
+    return ds.dataset(os.path.join(store_dir, name), format='parquet')
+
+
+def recipe_columns(store_dir):
+    """原始 CSV 列名（不含派生列），保持原顺序"""
+    return [name for name in _dataset(store_dir, RECIPES_FILE).schema.names if name != SOURCE_ID_INT]
+
+
+def read_recipes(store_dir, columns=None, **filters):
+    """读取食谱表，返回 pyarrow.Table；columns 为列投影，filters 见 _filter_expression"""
+    dataset = _dataset(store_dir, RECIPES_FILE)
+    return dataset.to_table(columns=columns or recipe_columns(store_dir),
+                            filter=_filter_expression(**filters))
+
+
+def read_stages(store_dir, columns=None, **filters):
+    """读取阶段表，返回 pyarrow.Table；source_id 过滤作用于整数列 source_id"""
+    dataset = _dataset(store_dir, STAGES_FILE)
+    return dataset.to_table(columns=columns, filter=_filter_expression(id_column='source_id', **filters))
+
+
+def count_recipes(store_dir):
+    """食谱表的总行数（取自 Parquet 元数据，不读取数据）"""
+    return _dataset(store_dir, RECIPES_FILE).count_rows()
+
+
+def iter_recipe_frames(store_dir, batch_size=ROW_GROUP_SIZE, columns=None, **filters):
+    """按批生成 pandas.DataFrame（所有列为字符串，与 CSV 中的原值一致）"""
+    dataset = _dataset(store_dir, RECIPES_FILE)
+    scanner = dataset.scanner(columns=columns or recipe_columns(store_dir),
+                              filter=_filter_expression(**filters), batch_size=batch_size)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def iter_recipe_rows(store_dir, columns=None, **filters):
+    """按行生成原始字符串列表（不依赖 pandas）"""
+    dataset = _dataset(store_dir, RECIPES_FILE)
+    names = columns or recipe_columns(store_dir)
+    scanner = dataset.scanner(columns=names, filter=_filter_expression(**filters))
+    for batch in scanner.to_batches():
+        data = batch.to_pydict()
+        yield from zip(*(data[name] for name in names))
+
+
+def store_to_csv(store_dir, csv_path, **filters):
+    """将存储导出为 CSV（与 pandas to_csv 相同的方言：最小引用、\\n 换行、utf-8-sig），返回行数"""
+    names = recipe_columns(store_dir)
+    count = 0
+    with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(names)
+        for row in iter_recipe_rows(store_dir, names, **filters):
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='食谱 CSV 与列式存储互相转换')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('import', help='CSV -> 存储')
+    p.add_argument('csv')
+    p.add_argument('store')
+    p = subparsers.add_parser('export', help='存储 -> CSV')
+    p.add_argument('store')
+    p.add_argument('csv')
+    p.add_argument('--language', help='只导出指定语言')
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        recipes, stages = csv_to_store(args.csv, args.store)
+        print(f"已导入 {recipes} 行食谱、{stages} 个阶段到 {args.store}")
+    else:
+        count = store_to_csv(args.store, args.csv, language=args.language)
+        print(f"已导出 {count} 行到 {args.csv}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
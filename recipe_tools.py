@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+食谱数据与图片处理的统一命令行入口
+
+子命令：
+  image-urls     为 content 中的每个 stage 添加 image_url，并生成 en 语言提取文件（add_image_urls.py）
+  compress       批量压缩图片目录（auto_folder_compress.py）
+  watch          监听图片目录并自动压缩（watch_folder_compress.py）
+  audit          检查 CSV 中 image_url 对应的图片是否存在（check_missing_images_from_csv.py）
+  filter         按 source_id / 语言批量过滤 CSV（check_source_ids.py）
+  db-update      将 CSV 中的 content 写回数据库（update_recipes_from_csv.py）
+  store          食谱 CSV 与列式存储互相转换（recipe_store.py，需要 pyarrow）
+  pipeline       按依赖依次运行以上各步骤，可断点续跑（run_pipeline.py）
+  startup-check  测量本工具的冷启动耗时是否在预算内
+
+pandas / PIL / pymysql 等重量级依赖只在对应子命令内部导入，
+未指定的参数沿用各脚本中的默认配置。
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# 冷启动预算（毫秒）：`recipe_tools.py --help` 从启动到退出的中位耗时上限
+COLD_START_BUDGET_MS = 150
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 入口模块（构建参数解析器、输出帮助）不应加载的重量级依赖
+HEAVY_MODULES = ('pandas', 'PIL', 'pymysql', 'pyarrow')
+
+# 在全新的解释器中导入本模块并构建参数解析器，输出其间被加载的重量级依赖
+_HEAVY_IMPORT_PROBE = (
+    "import sys\n"
+    "sys.path.insert(0, {script_dir!r})\n"
+    "import recipe_tools\n"
+    "recipe_tools.build_parser().format_help()\n"
+    "print(','.join(name for name in {modules!r} if name in sys.modules))\n"
+)
+
+
+def _source_id_range(text):
+    import recipe_store
+
+    return recipe_store.parse_source_id_range(text)
+
+
+def cmd_image_urls(args):
+    import add_image_urls
+
+    input_file = args.input or add_image_urls.INPUT_FILE
+    output_file = args.output or add_image_urls.OUTPUT_FILE
+    chunksize = args.chunksize if args.stream else None
+    add_image_urls.process_csv_to_files(input_file, output_file, remove_columns=not args.keep_columns,
+                                        add_images=not args.no_images, chunksize=chunksize,
+                                        language=args.language, source_id_range=args.source_id_range)
+    return 0
+
+
+def cmd_compress(args):
+    import auto_folder_compress as afc
+    from pathlib import Path
+
+    input_dir = Path(args.input_dir).expanduser().resolve() if args.input_dir else afc.resolve_input_directory()
+    encoder = args.encoder or afc.OUTPUT_ENCODER
+    for name in ([encoder] + ([] if args.compare_encoders in (None, 'all') else args.compare_encoders.split(','))):
+        if name not in afc.ENCODERS:
+            print(f"未知的输出编码: {name}（可选：{', '.join(afc.ENCODERS)}）")
+            return 1
+    if args.compare_encoders:
+        names = list(afc.ENCODERS) if args.compare_encoders == 'all' else args.compare_encoders.split(',')
+        max_kb = args.max_kb or afc.MAX_SIZE_KB
+        rows = afc.compare_encoders(afc.list_image_files(input_dir), names,
+                                    min_size_kb=args.min_kb or afc.MIN_SIZE_KB, max_size_kb=max_kb,
+                                    initial_quality=args.quality or afc.INITIAL_QUALITY)
+        afc.print_encoder_report(rows, max_kb)
+        return 0
+    output_dir = Path(args.output_dir) if args.output_dir else input_dir / afc.OUTPUT_SUBDIR_NAME
+    compressor = afc.ImageCompressor(min_size_kb=args.min_kb or afc.MIN_SIZE_KB,
+                                     max_size_kb=args.max_kb or afc.MAX_SIZE_KB,
+                                     parallel_encodes=afc.PARALLEL_ENCODES if args.parallel_encodes is None
+                                     else args.parallel_encodes,
+                                     memory_budget_mb=afc.MEMORY_BUDGET_MB if args.memory_budget_mb is None
+                                     else args.memory_budget_mb,
+                                     encoder=encoder)
+    results = compressor.compress_directory(
+        input_dir, output_dir,
+        initial_quality=args.quality or afc.INITIAL_QUALITY,
+        workers=afc.WORKERS if args.workers is None else args.workers,
+        incremental=afc.INCREMENTAL if args.incremental is None else args.incremental,
+        renditions=[afc.Rendition(**spec) for spec in afc.RENDITIONS],
+        dedup=afc.DEDUP and not args.no_dedup,
+        cache_dir=Path(args.cache_dir) if args.cache_dir else afc.resolve_cache_dir(),
+    )
+    print(f"\n完成，共处理 {len(results)} 个文件")
+    return 0
+
+
+def cmd_watch(args):
+    import watch_folder_compress
+
+    return watch_folder_compress.main(args.forwarded_args)
+
+
+def cmd_audit(args):
+    import check_missing_images_from_csv
+
+    return check_missing_images_from_csv.main(args.forwarded_args)
+
+
+def cmd_store(args):
+    import recipe_store
+
+    return recipe_store.main(args.forwarded_args)
+
+
+def cmd_filter(args):
+    import check_source_ids
+
+    return check_source_ids.main(args.forwarded_args)
+
+
+def cmd_db_update(args):
+    import update_recipes_from_csv as urc
+
+    return urc.main(
+        csv_file=args.csv or urc.CSV_FILE,
+        mode=args.mode or urc.WRITE_MODE,
+        batch_size=args.batch_size or urc.BATCH_SIZE,
+        sync=urc.SYNC_MODE if args.sync is None else args.sync,
+        connections=urc.WRITER_CONNECTIONS if args.connections is None else args.connections,
+        checkpoint=urc.CHECKPOINT if args.checkpoint is None else args.checkpoint,
+    )
+
+
+def cmd_pipeline(args):
+    import run_pipeline
+
+    return run_pipeline.main(args.forwarded_args)
+
+
+def cmd_startup_check(args):
+    """多次以子进程运行 `--help`，取中位耗时与 COLD_START_BUDGET_MS 比较"""
+    command = [sys.executable, os.path.abspath(__file__), '--help']
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    budget = args.budget_ms or COLD_START_BUDGET_MS
+    print(f"冷启动耗时（{args.runs} 次）：中位 {median:.1f} ms，最快 {timings[0]:.1f} ms，最慢 {timings[-1]:.1f} ms")
+    print(f"预算：{budget} ms -> {'通过' if median <= budget else '超出预算'}")
+    # 必须在子进程中检查：当前进程的 sys.modules 反映的是本次调用，而不是冷启动
+    probe = _HEAVY_IMPORT_PROBE.format(script_dir=SCRIPT_DIR, modules=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True).stdout
+    heavy = [name for name in output.strip().split(',') if name]
+    if heavy:
+        print(f"警告：入口模块加载了重量级依赖：{', '.join(heavy)}")
+    return 0 if median <= budget and not heavy else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='食谱数据与图片处理工具')
+    parser.add_argument('--metrics', metavar='FILE', help='将运行指标以 JSON-lines 写入 FILE（默认关闭）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('image-urls', help='为每个 stage 添加 image_url 并生成 en 提取文件')
+    p.add_argument('--input', help='输入 CSV 或列式存储目录（默认 add_image_urls.INPUT_FILE）')
+    p.add_argument('--output', help='输出 CSV（默认 add_image_urls.OUTPUT_FILE）')
+    p.add_argument('--keep-columns', action='store_true', help='不删除第一列和最后一列')
+    p.add_argument('--no-images', action='store_true', help='不添加 image_url')
+    p.add_argument('--stream', action='store_true', help='分块流式处理')
+    p.add_argument('--chunksize', type=int, default=1000, help='流式模式下每块行数')
+    p.add_argument('--language', help='只处理指定语言（仅列式存储输入，下推到存储读取）')
+    p.add_argument('--source-id-range', type=_source_id_range,
+                   help='只处理 source_id 闭区间，如 100-200、100-、-200（仅列式存储输入）')
+    p.set_defaults(func=cmd_image_urls)
+
+    p = subparsers.add_parser('compress', help='批量压缩图片目录')
+    p.add_argument('--input-dir', help='输入目录（默认按 auto_folder_compress 中的配置解析）')
+    p.add_argument('--output-dir', help='输出目录（默认为输入目录下的 compressed）')
+    p.add_argument('--min-kb', type=int, help='小图阈值（KB）')
+    p.add_argument('--max-kb', type=int, help='目标最大大小（KB）')
+    p.add_argument('--quality', type=int, help='初始 JPEG 质量')
+    p.add_argument('--workers', type=int, help='并行进程数（1 为串行，0 为全部核心）')
+    p.add_argument('--incremental', action=argparse.BooleanOptionalAction,
+                   help='增量模式：借助清单只处理新增或变化的图片（默认见 auto_folder_compress.INCREMENTAL）')
+    p.add_argument('--no-dedup', action='store_true', help='关闭内容去重')
+    p.add_argument('--cache-dir', help='跨运行的压缩结果缓存目录（默认 auto_folder_compress.DEDUP_CACHE_DIR，为空时不缓存）')
+    p.add_argument('--encoder', help='输出编码：baseline / progressive / progressive444 / jpeg444 / webp')
+    p.add_argument('--compare-encoders', metavar='NAMES',
+                   help="对比各输出编码的体积与编码耗时（逗号分隔或 all），不写正式输出")
+    p.add_argument('--memory-budget-mb', type=int, help='并行压缩的内存预算（MB，0 为可用内存的一半）')
+    p.add_argument('--parallel-encodes', type=int, help='单张大图搜索时并行编码的候选数（1 为逐个二分，0 为自动）')
+    p.set_defaults(func=cmd_compress)
+
+    # watch / audit / filter / store / pipeline 的参数原样转交对应脚本的 main
+    p = subparsers.add_parser('watch', help='监听图片目录并自动压缩（参数见 watch --help）', add_help=False)
+    p.set_defaults(func=cmd_watch, passthrough=True)
+
+    p = subparsers.add_parser('audit', help='检查缺失/多余的图片（参数见 audit --help）', add_help=False)
+    p.set_defaults(func=cmd_audit, passthrough=True)
+
+    p = subparsers.add_parser('store', help='CSV 与列式存储互转（参数见 store --help）', add_help=False)
+    p.set_defaults(func=cmd_store, passthrough=True)
+
+    p = subparsers.add_parser('filter', help='按 source_id / 语言批量过滤（参数见 filter --help）', add_help=False)
+    p.set_defaults(func=cmd_filter, passthrough=True)
+
+    p = subparsers.add_parser('pipeline', help='端到端批处理，可断点续跑（参数见 pipeline --help）', add_help=False)
+    p.set_defaults(func=cmd_pipeline, passthrough=True)
+
+    p = subparsers.add_parser('db-update', help='将 CSV 中的 content 写回数据库')
+    p.add_argument('--csv', help='输入 CSV（默认 update_recipes_from_csv.CSV_FILE）')
+    p.add_argument('--mode', choices=['row', 'case', 'temp_table'], help='写入模式')
+    p.add_argument('--batch-size', type=int, help='每批行数')
+    p.add_argument('--sync', action=argparse.BooleanOptionalAction,
+                   help='差异同步：只写入与数据库不同的行（默认见 update_recipes_from_csv.SYNC_MODE）')
+    p.add_argument('--connections', type=int, help='并发写入的连接数（>1 时各分区独立按批提交）')
+    p.add_argument('--checkpoint', action=argparse.BooleanOptionalAction,
+                   help='记录已提交的批次，重新运行时跳过（默认见 update_recipes_from_csv.CHECKPOINT）')
+    p.set_defaults(func=cmd_db_update)
+
+    p = subparsers.add_parser('startup-check', help='测量冷启动耗时')
+    p.add_argument('--runs', type=int, default=7, help='测量次数')
+    p.add_argument('--budget-ms', type=int, help=f'预算（毫秒，默认 {COLD_START_BUDGET_MS}）')
+    p.set_defaults(func=cmd_startup_check)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if getattr(args, 'passthrough', False):
+        args.forwarded_args = extra
+    elif extra:
+        parser.error(f"无法识别的参数: {' '.join(extra)}")
+    # 各脚本按文件名导入，保证从任意目录调用都能找到
+    if SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, SCRIPT_DIR)
+    if args.metrics:
+        import run_metrics
+        run_metrics.configure(args.metrics)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
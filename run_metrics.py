@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标（JSON-lines），默认关闭
+
+开启方式：设置环境变量 RECIPE_METRICS_FILE=metrics.jsonl，或调用 configure(path)
+（recipe_tools.py 的 --metrics 参数即调用此函数）。
+
+- event(name, **fields)：写出一行事件
+- observe(name, seconds, label, **fields)：写出事件并记录耗时，用于汇总
+- 进程退出时写出 summary：每类耗时的次数、p50、p95、最大值与最慢的若干项
+
+关闭时 enabled 为 False，调用方应先判断 enabled 再组装字段，开销仅为一次属性读取。
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+METRICS_ENV = 'RECIPE_METRICS_FILE'
+
+# summary 中列出的最慢项数量
+SLOWEST_COUNT = 5
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class MetricsRecorder:
+    def __init__(self, path=None):
+        self.path = path
+        self.enabled = bool(path)
+        self._fd = None
+        self._lock = threading.Lock()
+        self._durations = {}
+        if self.enabled:
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            atexit.register(self.close)
+
+    def event(self, name, **fields):
+        if not self.enabled:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), 'event': name, **fields}, ensure_ascii=False, default=str)
+        # 不经缓冲，每行一次 O_APPEND 写入：流水线的多个子进程共用同一文件时行与行不会交错
+        data = (line + '\n').encode('utf-8')
+        with self._lock:
+            os.write(self._fd, data)
+
+    def observe(self, name, seconds, label=None, **fields):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._durations.setdefault(name, []).append((seconds, label))
+        self.event(name, seconds=round(seconds, 6), label=label, **fields)
+
+    def summary(self):
+        result = {}
+        for name, samples in self._durations.items():
+            values = sorted(seconds for seconds, _ in samples)
+            slowest = sorted(samples, key=lambda item: item[0], reverse=True)[:SLOWEST_COUNT]
+            result[name] = {
+                'count': len(values),
+                'total': round(sum(values), 6),
+                'p50': round(_percentile(values, 0.5), 6),
+                'p95': round(_percentile(values, 0.95), 6),
+                'max': round(values[-1], 6),
+                'slowest': [{'label': label, 'seconds': round(seconds, 6)} for seconds, label in slowest],
+            }
+        return result
+
+    def close(self):
+        if not self.enabled or self._fd is None:
+            return
+        self.event('summary', stats=self.summary())
+        with self._lock:
+            os.close(self._fd)
+            self._fd = None
+        self.enabled = False
+
+
+_recorder = MetricsRecorder(os.environ.get(METRICS_ENV))
+
+
+def get_recorder():
+    return _recorder
+
+
+def configure(path):
+    """切换到新的指标文件（path 为空时关闭），返回新的记录器"""
+    global _recorder
+    _recorder.close()
+    _recorder = MetricsRecorder(path)
+    return _recorder
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端批处理流水线：依次（可并行的部分并行）运行已有的各个脚本，支持断点续跑
+
+阶段（括号内为依赖）：
+  image-urls  添加 image_url 并生成 en 提取文件（add_image_urls.py）
+  filter      按 source_id 过滤提取文件与含 image_url 的 CSV，仅在给出 --exclude-file / --include-file 时启用（image-urls）
+  audit       检查提取文件中的图片是否存在，有缺失时失败（check_missing_images_from_csv.py）（image-urls / filter）
+  compress    压缩图片目录（auto_folder_compress.py），与 audit 互不依赖，同时运行
+  db-update   将含 image_url 的 CSV（启用 filter 时为其过滤结果）写回数据库（update_recipes_from_csv.py）
+              （image-urls / filter、audit、compress）
+
+- 每个阶段以子进程运行 recipe_tools.py 的对应子命令，输出写入日志文件
+- 阶段键 = 命令行 + 各输入的内容指纹（文件为 SHA-256，图片目录为一级图片文件的名称/大小/mtime）；
+  键与上次一致且输出未被改动时跳过；输出文件按阶段键存入 CACHE_DIR，输入变回旧内容时直接恢复
+- 每个阶段完成即写入状态文件；长阶段内部也有检查点：压缩按清单定期保存，
+  数据库写入按已提交批次记录，失败后重新运行会从断点继续
+- 某阶段失败时，依赖它的阶段不再运行，其余阶段照常完成
+
+使用方法：
+  python run_pipeline.py
+  python run_pipeline.py --input recipes_801_934.csv --image-dir recipes_801_934 --exclude-file bad_ids.txt
+  python run_pipeline.py --skip db-update --force audit
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import run_metrics
+from check_source_ids import default_output_file
+from recipe_store import extract_file_name
+
+# ======================== 可配置参数（请在此修改） ========================
+# 原始导出 CSV（或列式存储目录）与生成图片所在目录
+INPUT_FILE = "recipes_801_934.csv"
+IMAGE_DIR = "recipes_801_934"
+
+# 同时运行的阶段数
+JOBS = 2
+
+# 阶段输出的内容寻址缓存目录（相对本脚本所在目录；留空则不缓存）
+CACHE_DIR = ".pipeline_cache"
+# ======================================================================
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RECIPE_TOOLS = os.path.join(SCRIPT_DIR, "recipe_tools.py")
+
+STAGE_NAMES = ("image-urls", "filter", "audit", "compress", "db-update")
+
+# 以下与 auto_folder_compress 中的约定一致。调度进程只启动子进程，不导入该模块，以免加载 PIL
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp"}
+OUTPUT_SUBDIR_NAME = "compressed"
+
+
+@dataclass
+class Stage:
+    """一个流水线阶段：command 为 recipe_tools.py 的子命令及参数；image_dirs 为作为输入的图片目录"""
+    name: str
+    command: list[str]
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+    after: tuple[str, ...] = ()
+    image_dirs: list[str] = field(default_factory=list)
+
+
+def fingerprint(path: str, images_only: bool = False) -> str | None:
+    """输入/输出的内容指纹：文件为 SHA-256；目录为其中文件的相对路径、大小与 mtime 的摘要。
+
+    images_only=True 时只取一级图片文件（与压缩、审计的扫描范围一致，压缩输出子目录与清单不影响指纹），
+    否则（列式存储、压缩输出）递归统计全部文件。路径不存在时返回 None。
+    """
+    p = Path(path)
+    if p.is_file():
+        digest = hashlib.sha256()
+        with open(p, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    if not p.is_dir():
+        return None
+    if images_only:
+        files = [c for c in p.iterdir() if c.is_file() and c.suffix.lower() in IMAGE_EXTENSIONS]
+    else:
+        files = [c for c in p.rglob("*") if c.is_file()]
+    digest = hashlib.sha256()
+    for c in sorted(files):
+        stat = c.stat()
+        digest.update(f"{c.relative_to(p).as_posix()}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return "dir:" + digest.hexdigest()
+
+
+def copy_file(src: Path, dst: Path) -> None:
+    """复制到临时文件后原子替换。各脚本会原地覆盖自己的输出，因此缓存与输出之间不能共享硬链接。"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = dst.with_name(f".{dst.name}.tmp")
+    shutil.copyfile(src, temp_path)
+    os.replace(temp_path, dst)
+
+
+class PipelineRunner:
+    """按依赖调度各阶段；状态文件记录每个已完成阶段的键、输出指纹、耗时与日志路径"""
+
+    VERSION = 1
+
+    def __init__(self, stages: list[Stage], state_path: Path, log_dir: Path, cache_dir: Path | None = None,
+                 jobs: int = JOBS, force: set[str] | None = None, skip: set[str] | None = None):
+        self.stages = stages
+        self.state_path = Path(state_path)
+        self.log_dir = Path(log_dir)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.jobs = max(1, jobs)
+        self.force = force or set()
+        self.skip = skip or set()
+        self.state: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            print(f"状态文件无法读取，将从头运行: {self.state_path} -> {exc}")
+            return
+        if data.get("version") == self.VERSION:
+            self.state = data.get("stages", {})
+
+    def save(self) -> None:
+        temp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "stages": self.state}, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.state_path)
+
+    @staticmethod
+    def stage_key(stage: Stage, inputs: dict[str, str | None]) -> str:
+        payload = json.dumps({"stage": stage.name, "command": stage.command, "inputs": inputs}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def is_current(self, stage: Stage, key: str) -> bool:
+        """键一致且各输出仍与完成时相同"""
+        entry = self.state.get(stage.name)
+        return (entry is not None and entry.get("key") == key
+                and all(fingerprint(path) == digest for path, digest in entry.get("outputs", {}).items()))
+
+    def _cache_entry(self, stage: Stage, key: str) -> Path:
+        return self.cache_dir / stage.name / key[:2] / key
+
+    def _cached_file(self, entry: Path, index: int, path: str) -> Path:
+        return entry / f"{index}_{Path(path).name}"
+
+    def restore(self, stage: Stage, key: str) -> bool:
+        """从内容寻址缓存恢复各输出文件；输出含目录或缓存不完整时返回 False"""
+        if self.cache_dir is None or not stage.outputs:
+            return False
+        entry = self._cache_entry(stage, key)
+        cached = [self._cached_file(entry, i, path) for i, path in enumerate(stage.outputs)]
+        if not all(c.is_file() for c in cached):
+            return False
+        for source, path in zip(cached, stage.outputs):
+            copy_file(source, Path(path))
+        log = entry / "stage.log"
+        self.record(stage, key, 0.0, str(log) if log.exists() else None, cached=True)
+        return True
+
+    def store(self, stage: Stage, key: str, log_path: Path) -> None:
+        if self.cache_dir is None or not stage.outputs or not all(Path(p).is_file() for p in stage.outputs):
+            return
+        entry = self._cache_entry(stage, key)
+        entry.mkdir(parents=True, exist_ok=True)
+        for i, path in enumerate(stage.outputs):
+            copy_file(Path(path), self._cached_file(entry, i, path))
+        copy_file(log_path, entry / "stage.log")
+
+    def record(self, stage: Stage, key: str, seconds: float, log: str | None, cached: bool = False) -> None:
+        entry = {
+            "key": key,
+            "outputs": {path: fingerprint(path) for path in stage.outputs},
+            "seconds": round(seconds, 3),
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "log": log,
+        }
+        with self._lock:
+            self.state[stage.name] = entry
+            self.save()
+        recorder = run_metrics.get_recorder()
+        if recorder.enabled:
+            recorder.observe("pipeline_stage", seconds, label=stage.name, cached=cached)
+
+    def _log(self, message: str) -> None:
+        # 各阶段在不同线程中结束，整行输出避免交错
+        with self._lock:
+            print(message, flush=True)
+
+    def run_stage(self, stage: Stage) -> bool:
+        inputs = {path: fingerprint(path) for path in stage.inputs}
+        inputs.update({path: fingerprint(path, images_only=True) for path in stage.image_dirs})
+        key = self.stage_key(stage, inputs)
+        if stage.name not in self.force:
+            if self.is_current(stage, key):
+                self._log(f"[{stage.name}] 输入未变化，跳过（日志：{self.state[stage.name].get('log')}）")
+                return True
+            if self.restore(stage, key):
+                self._log(f"[{stage.name}] 命中缓存，已恢复输出")
+                return True
+
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        log_path = self.log_dir / f"{stage.name}.log"
+        self._log(f"[{stage.name}] 开始，日志：{log_path}")
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        recorder = run_metrics.get_recorder()
+        if recorder.enabled:
+            # 子进程追加写入同一个指标文件
+            env[run_metrics.METRICS_ENV] = recorder.path
+        started = time.perf_counter()
+        with open(log_path, "w", encoding="utf-8") as log:
+            returncode = subprocess.run([sys.executable, RECIPE_TOOLS, *stage.command], stdout=log,
+                                        stderr=subprocess.STDOUT, env=env).returncode
+        elapsed = time.perf_counter() - started
+        if returncode != 0:
+            self._log(f"[{stage.name}] 失败（退出码 {returncode}，耗时 {elapsed:.1f} 秒），日志：{log_path}")
+            return False
+        self.store(stage, key, log_path)
+        self.record(stage, key, elapsed, str(log_path))
+        self._log(f"[{stage.name}] 完成，耗时 {elapsed:.1f} 秒")
+        return True
+
+    def run(self) -> int:
+        """运行全部阶段，返回 0 表示全部成功（或被跳过）"""
+        done = {stage.name for stage in self.stages if stage.name in self.skip}
+        failed: set[str] = set()
+        blocked: set[str] = set()
+        waiting = [stage for stage in self.stages if stage.name not in done]
+        running: dict = {}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while waiting or running:
+                for stage in list(waiting):
+                    if any(dep in failed or dep in blocked for dep in stage.after):
+                        waiting.remove(stage)
+                        blocked.add(stage.name)
+                        self._log(f"[{stage.name}] 前置阶段失败，未运行")
+                    elif all(dep in done for dep in stage.after) and len(running) < self.jobs:
+                        waiting.remove(stage)
+                        running[executor.submit(self.run_stage, stage)] = stage
+                if not running:
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    (done if future.result() else failed).add(stage.name)
+
+        print(f"\n流水线结束，耗时 {time.perf_counter() - started:.1f} 秒")
+        for stage in self.stages:
+            if stage.name in self.skip:
+                status = "已跳过"
+            elif stage.name in done:
+                status = "完成"
+            elif stage.name in failed:
+                status = "失败"
+            else:
+                status = "未运行"
+            print(f"  {stage.name}: {status}")
+        if failed or blocked:
+            print("修复问题后重新运行即可从断点继续（已完成的阶段与阶段内已完成的部分不会重做）")
+        return 1 if failed or blocked else 0
+
+
+def build_stages(input_file: str, image_dir: str, exclude_file: str | None = None,
+                 include_file: str | None = None, validate: bool = False) -> list[Stage]:
+    """按约定的文件名组装各阶段：<输入>_with_images.csv、<输入>_extract_stage.csv、<图片目录>/compressed"""
+    stem = os.path.splitext(input_file.rstrip("/\\"))[0]
+    images_csv = f"{stem}_with_images.csv"
+    extract_csv = extract_file_name(input_file)
+    compressed_dir = os.path.join(image_dir, OUTPUT_SUBDIR_NAME)
+
+    stages = [Stage("image-urls", ["image-urls", "--input", input_file, "--output", images_csv],
+                    inputs=[input_file], outputs=[images_csv, extract_csv])]
+    audit_csv = extract_csv
+    db_csv = images_csv
+    db_after = "image-urls"
+    if exclude_file or include_file:
+        # 提取文件（审计用）与含 image_url 的全量 CSV（写库用）按同一条件过滤，被过滤掉的行不会写入数据库
+        audit_csv = default_output_file(extract_csv)
+        db_csv = default_output_file(images_csv)
+        db_after = "filter"
+        command = ["filter", extract_csv, images_csv]
+        for option, path in (("--exclude-file", exclude_file), ("--include-file", include_file)):
+            if path:
+                command += [option, path]
+        stages.append(Stage("filter", command,
+                            inputs=[extract_csv, images_csv] + [p for p in (exclude_file, include_file) if p],
+                            outputs=[audit_csv, db_csv], after=("image-urls",)))
+    # --fail-on-missing：有缺失图片时审计失败，db-update 不会运行
+    stages.append(Stage("audit", ["audit", "--csv", audit_csv, "--image-dir", image_dir, "--fail-on-missing"]
+                        + (["--validate"] if validate else []),
+                        inputs=[audit_csv], image_dirs=[image_dir], after=(stages[-1].name,)))
+    # 增量模式的清单让压缩阶段中断后可以从断点继续
+    stages.append(Stage("compress", ["compress", "--input-dir", image_dir, "--output-dir", compressed_dir,
+                                     "--incremental"],
+                        image_dirs=[image_dir], outputs=[compressed_dir]))
+    # 流水线需要断点续跑，数据库写入显式开启批次检查点
+    stages.append(Stage("db-update", ["db-update", "--csv", db_csv, "--checkpoint"], inputs=[db_csv],
+                        after=(db_after, "audit", "compress")))
+    return stages
+
+
+def resolve_cache_dir() -> Path | None:
+    if not CACHE_DIR.strip():
+        return None
+    return (Path(SCRIPT_DIR) / Path(CACHE_DIR).expanduser()).resolve()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="端到端批处理流水线（可断点续跑）")
+    parser.add_argument("--input", default=INPUT_FILE, help="原始导出 CSV 或列式存储目录")
+    parser.add_argument("--image-dir", default=IMAGE_DIR, help="生成图片所在目录")
+    parser.add_argument("--exclude-file", help="过滤阶段：删除文件中列出的 source_id")
+    parser.add_argument("--include-file", help="过滤阶段：只保留文件中列出的 source_id")
+    parser.add_argument("--validate", action="store_true", help="审计阶段同时校验图片格式、尺寸与体积")
+    parser.add_argument("--jobs", type=int, default=JOBS, help="同时运行的阶段数")
+    parser.add_argument("--force", action="append", default=[], choices=STAGE_NAMES + ("all",),
+                        help="忽略缓存重新运行该阶段（可重复，all 为全部）")
+    parser.add_argument("--skip", action="append", default=[], choices=STAGE_NAMES, help="不运行该阶段（可重复）")
+    parser.add_argument("--state-file", help="状态文件（默认 <输入>.pipeline.json）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用内容寻址缓存")
+    args = parser.parse_args(argv)
+
+    stages = build_stages(args.input, args.image_dir, args.exclude_file, args.include_file, args.validate)
+    base = args.input.rstrip("/\\")
+    base = base[:-4] if base.endswith(".csv") else base
+    force = set(STAGE_NAMES) if "all" in args.force else set(args.force)
+    runner = PipelineRunner(stages, Path(args.state_file or f"{base}.pipeline.json"), Path(f"{base}.pipeline_logs"),
+                            cache_dir=None if args.no_cache else resolve_cache_dir(),
+                            jobs=args.jobs, force=force, skip=set(args.skip))
+    return runner.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
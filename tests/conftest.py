@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 各工具为仓库根目录下的独立脚本，按文件名导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,171 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('PIL')
+
+import auto_folder_compress as afc
+from auto_folder_compress import CompressionCache, ImageCompressor, Rendition
+
+
+def write_image(path, size=(64, 48), color='red'):
+    from PIL import Image
+    Image.new('RGB', size, color).save(path, 'JPEG', quality=95)
+
+
+def make_cache(tmp_path, max_bytes=0, **params):
+    return CompressionCache(tmp_path / 'cache', {'q': 85, **params}, '.jpg', max_bytes)
+
+
+def test_cache_store_and_lookup(tmp_path):
+    cache = make_cache(tmp_path)
+    renditions = [Rendition('full'), Rendition('thumb', max_dimension=10)]
+    outputs = [tmp_path / 'a.jpg', tmp_path / 'a_thumb.jpg']
+    for path in outputs:
+        path.write_bytes(b'data-' + path.name.encode())
+
+    assert cache.lookup('ab' * 32, renditions) is None
+    cache.store('ab' * 32, renditions, [str(p) for p in outputs])
+    hit = cache.lookup('ab' * 32, renditions)
+    assert [p.read_bytes() for p in hit] == [p.read_bytes() for p in outputs]
+    # 缺少任一规格即视为未命中；压缩参数不同的缓存互不命中
+    assert cache.lookup('ab' * 32, renditions + [Rendition('list')]) is None
+    assert make_cache(tmp_path, q=70).lookup('ab' * 32, renditions) is None
+
+
+def test_cache_entries_do_not_share_inodes_with_outputs(tmp_path):
+    cache = make_cache(tmp_path)
+    output = tmp_path / 'a.jpg'
+    output.write_bytes(b'original')
+    cache.store('cd' * 32, [Rendition('full')], [str(output)])
+    with open(output, 'r+b') as f:
+        f.write(b'EDITED!!')
+    assert cache.lookup('cd' * 32, [Rendition('full')])[0].read_bytes() == b'original'
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=2500)
+    source = tmp_path / 'src.jpg'
+    source.write_bytes(b'x' * 1000)
+    digests = [f'{i:02d}' * 32 for i in range(3)]
+    for i, digest in enumerate(digests):
+        cache.store(digest, [Rendition('full')], [str(source)])
+        entry = cache._entry_dir(digest)
+        os.utime(entry, (time.time() - 100 + i, time.time() - 100 + i))
+    # 命中刷新使用时间：最早写入的条目被访问后不会被淘汰
+    assert cache.lookup(digests[0], [Rendition('full')]) is not None
+
+    assert cache.evict() == 1
+    assert cache.lookup(digests[1], [Rendition('full')]) is None
+    assert cache.lookup(digests[0], [Rendition('full')]) is not None
+    assert cache.lookup(digests[2], [Rendition('full')]) is not None
+
+
+def test_cache_disabled_by_default():
+    assert afc.DEDUP_CACHE_DIR == '' and afc.resolve_cache_dir() is None
+
+
+def test_dedup_outputs_are_independent_copies(tmp_path):
+    src = tmp_path / 'in'
+    src.mkdir()
+    write_image(src / 'a.jpg')
+    (src / 'b.jpg').write_bytes((src / 'a.jpg').read_bytes())
+    out = tmp_path / 'out'
+    compressor = ImageCompressor(min_size_kb=0, max_size_kb=600)
+    compressor.compress_directory(src, out, workers=1, incremental=False, dedup=True,
+                                  cache_dir=tmp_path / 'cache')
+
+    a, b = out / 'a.jpg', out / 'b.jpg'
+    assert a.read_bytes() == b.read_bytes()
+    assert not os.path.samefile(a, b)
+    cached = [p for p in (tmp_path / 'cache').rglob('*.jpg')]
+    assert len(cached) == 1 and not os.path.samefile(cached[0], a)
+
+
+def run_incremental(src, out, quality=85):
+    compressor = ImageCompressor(min_size_kb=0, max_size_kb=600)
+    processed = compressor.compress_directory(src, out, initial_quality=quality, workers=1,
+                                              incremental=True, dedup=False)
+    return sorted(os.path.basename(p) for p in processed)
+
+
+def test_manifest_skips_unchanged_and_prunes_removed(tmp_path):
+    src, out = tmp_path / 'in', tmp_path / 'out'
+    src.mkdir()
+    write_image(src / 'a.jpg', color='red')
+    write_image(src / 'b.jpg', color='green')
+    _write_png(src / 'c.png')
+
+    assert run_incremental(src, out) == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert (tmp_path / 'out.manifest.json').exists()
+    assert run_incremental(src, out) == []
+
+    # 内容变化的文件重新压缩；源文件删除后其输出被清理
+    write_image(src / 'a.jpg', color='yellow')
+    (src / 'b.jpg').unlink()
+    assert run_incremental(src, out) == ['a.jpg']
+    assert not (out / 'b.jpg').exists() and (out / 'c.jpg').exists()
+
+    # 输出被删除时重新生成；压缩参数变化时全部重新压缩
+    (out / 'c.jpg').unlink()
+    assert run_incremental(src, out) == ['c.jpg']
+    assert run_incremental(src, out, quality=70) == ['a.jpg', 'c.jpg']
+
+
+def test_manifest_ignores_mtime_only_changes(tmp_path):
+    src, out = tmp_path / 'in', tmp_path / 'out'
+    src.mkdir()
+    write_image(src / 'a.jpg')
+    assert run_incremental(src, out) == ['a.jpg']
+    # 只改 mtime、内容不变：按内容哈希判定为未变化
+    os.utime(src / 'a.jpg', (time.time() + 10, time.time() + 10))
+    assert run_incremental(src, out) == []
+
+
+def test_incremental_is_opt_in():
+    assert afc.INCREMENTAL is False and afc.WORKERS == 1
+
+
+def _write_png(path):
+    from PIL import Image
+    Image.new('RGBA', (40, 40), (0, 0, 255, 128)).save(path, 'PNG')
+
+
+def test_parallel_search_respects_budget_and_releases_pool(tmp_path):
+    import pickle
+    import random
+    from PIL import Image
+
+    rng = random.Random(0)
+    img = Image.frombytes('RGB', (600, 600), bytes(rng.getrandbits(8) for _ in range(600 * 600 * 3)))
+    img.save(tmp_path / 'noise.png')
+    compressor = ImageCompressor(min_size_kb=20, max_size_kb=60, parallel_encodes=4)
+    output = compressor.compress_image(tmp_path / 'noise.png', tmp_path / 'out.jpg')
+
+    assert output and os.path.getsize(output) <= 60 * 1024
+    assert compressor.last_encode_attempts >= 4
+    # 线程池按图片创建、处理完即关闭，压缩器可以序列化到子进程
+    assert compressor._encode_pool is None
+    pickle.dumps(compressor)
+
+
+def test_memory_estimate_counts_renditions_and_encode_threads(tmp_path):
+    source = tmp_path / 'a.jpg'
+    write_image(source, size=(400, 300))
+    compressor = ImageCompressor(min_size_kb=1, max_size_kb=2)
+    full = compressor.estimate_memory(source)
+    with_renditions = compressor.estimate_memory(
+        source, [Rendition('full'), Rendition('list', max_dimension=200), Rendition('thumb', max_dimension=50)])
+    assert with_renditions > full
+    # 每个编码线程持有一份图像副本
+    assert compressor.estimate_memory(source, encodes=4) > full
+    assert compressor.estimate_memory(tmp_path / 'missing.jpg') == 0
+
+
+def test_list_image_files_is_flat_and_sorted(tmp_path):
+    for name in ('b.PNG', 'a.jpg', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'x')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'c.jpg').write_bytes(b'x')
+    assert [p.name for p in afc.list_image_files(tmp_path)] == ['a.jpg', 'b.PNG']
@@ -0,0 +1,66 @@
+import csv
+import json
+
+import pytest
+
+import check_missing_images_from_csv as audit
+
+
+def write_extract_csv(path, stems):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['source_id', 'stage'])
+        for stem in stems:
+            stages = [{'stage': 1, 'image_url': f'https://img.example.com/recipe/{stem}.jpg'}]
+            writer.writerow([stem.split('_')[0], '阶段：' + json.dumps(stages)])
+
+
+def write_jpeg(path, size=(64, 64)):
+    Image = pytest.importorskip('PIL.Image')
+    Image.new('RGB', size, 'white').save(path, 'JPEG')
+
+
+def test_parse_image_stem_normalises_leading_zeros():
+    assert audit.parse_image_stem('01_2') == (1, 2)
+    assert audit.parse_image_stem('1_2') == (1, 2)
+    assert audit.parse_image_stem('500') is None
+    assert audit.parse_image_stem('1_a') is None
+
+
+def test_missing_and_extras(tmp_path, capsys):
+    csv_path = tmp_path / 'e.csv'
+    write_extract_csv(csv_path, ['1_1', '007_2', '3_1'])
+    images = tmp_path / 'imgs'
+    images.mkdir()
+    for name in ('1_1.jpg', '007_2.jpg', '9_1.jpg', '500.jpg', 'notes.txt'):
+        (images / name).write_bytes(b'x')
+
+    assert audit.main(['--csv', str(csv_path), '--image-dir', str(images)]) == 0
+    out = capsys.readouterr().out
+    assert '缺失图片数量：1' in out and '3_1.jpg' in out
+    assert '007_2.jpg' not in out.split('多出来的图片数量')[0].split('缺失图片数量')[1]
+    assert '多出来的图片数量：2' in out and '9_1.jpg' in out and '500.jpg' in out
+
+    assert audit.main(['--csv', str(csv_path), '--image-dir', str(images), '--fail-on-missing']) == 1
+    (images / '3_1.jpg').write_bytes(b'x')
+    assert audit.main(['--csv', str(csv_path), '--image-dir', str(images), '--fail-on-missing']) == 0
+
+
+def test_missing_reports_csv_name(tmp_path):
+    missing, extras = audit.audit_images({(7, 2)}, {}, [], {(7, 2): '007_2'})
+    assert missing == ['007_2.jpg'] and extras == []
+
+
+def test_validate_reads_headers(tmp_path):
+    good = tmp_path / '1_1.jpg'
+    wide = tmp_path / '2_1.jpg'
+    fake = tmp_path / '3_1.jpg'
+    write_jpeg(good)
+    write_jpeg(wide, (80, 40))
+    fake.write_bytes(b'not an image')
+
+    assert audit.validate_image(str(good), 600 * 1024) == []
+    assert any('非正方形' in issue for issue in audit.validate_image(str(wide), 600 * 1024))
+    assert audit.validate_image(str(wide), 600 * 1024, require_square=False) == []
+    assert audit.validate_image(str(fake), 600 * 1024)
+    assert any('超出体积上限' in issue for issue in audit.validate_image(str(good), 10))
@@ -0,0 +1,88 @@
+import csv
+import os
+
+import pytest
+
+import check_source_ids
+from check_source_ids import SourceIdFilter, expand_inputs, filter_csv_file, filter_files
+
+
+def write_recipes_csv(path, count=1000):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['source_id', 'language_code', 'title', 'content'])
+        for i in range(1, count + 1):
+            writer.writerow([i, 'en' if i % 2 else 'zh', f't{i}', '{"stages": []}'])
+
+
+def read_rows(path):
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        return list(csv.reader(f))
+
+
+@pytest.fixture
+def recipes(tmp_path):
+    csv_path = tmp_path / 'r.csv'
+    write_recipes_csv(csv_path)
+    return csv_path
+
+
+@pytest.fixture
+def store(tmp_path, recipes):
+    recipe_store = pytest.importorskip('recipe_store')
+    pytest.importorskip('pyarrow')
+    store_dir = tmp_path / 'r.store'
+    recipe_store.csv_to_store(str(recipes), str(store_dir))
+    return store_dir
+
+
+@pytest.mark.parametrize('id_filter', [
+    SourceIdFilter(exclude_ids={5, 7}),
+    SourceIdFilter(include_ranges=[(10, 12)]),
+    SourceIdFilter(include_ids={1, 2, 3}, exclude_ids={2}),
+    SourceIdFilter(exclude_ranges=[(100, 199)], languages=['en']),
+])
+def test_store_and_csv_report_same_counts(tmp_path, recipes, store, id_filter):
+    from_csv = filter_csv_file(str(recipes), str(tmp_path / 'a.csv'), id_filter)
+    from_store = filter_csv_file(str(store), str(tmp_path / 'b.csv'), id_filter)
+
+    assert from_csv['error'] is None and from_store['error'] is None
+    for key in ('rows', 'kept', 'removed'):
+        assert from_store[key] == from_csv[key]
+    assert from_csv['rows'] == 1000
+    assert from_csv['removed'] == 1000 - from_csv['kept'] > 0
+    assert read_rows(tmp_path / 'a.csv') == read_rows(tmp_path / 'b.csv')
+
+
+def test_exclude_counts(tmp_path, recipes):
+    result = filter_csv_file(str(recipes), str(tmp_path / 'out.csv'), SourceIdFilter(exclude_ids=set(range(1, 11))))
+    assert (result['rows'], result['kept'], result['removed']) == (1000, 990, 10)
+    kept_ids = {int(row[0]) for row in read_rows(tmp_path / 'out.csv')[1:]}
+    assert kept_ids.isdisjoint(range(1, 11))
+
+
+def test_unparseable_source_id_kept_only_without_include():
+    assert SourceIdFilter(exclude_ids={1}).keep('abc')
+    assert not SourceIdFilter(include_ids={1}).keep('abc')
+
+
+def test_output_collisions_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        filter_files([str(tmp_path / 'r.csv'), str(tmp_path / 'r.store')], SourceIdFilter(exclude_ids={1}))
+
+
+def test_expand_inputs_skips_only_globbed_outputs_of_current_suffix(tmp_path, capsys):
+    for name in ('a.csv', 'a_filtered.csv', 'b_done.csv'):
+        (tmp_path / name).write_text('source_id\n')
+    pattern = os.path.join(str(tmp_path), '*.csv')
+
+    assert [os.path.basename(p) for p in expand_inputs([pattern])] == ['a.csv', 'b_done.csv']
+    assert 'a_filtered.csv' in capsys.readouterr().out
+    assert [os.path.basename(p) for p in expand_inputs([pattern], '_done')] == ['a.csv', 'a_filtered.csv']
+    explicit = str(tmp_path / 'a_filtered.csv')
+    assert expand_inputs([explicit]) == [explicit]
+
+
+def test_main_reports_removed_rows_for_store(store, tmp_path, capsys):
+    assert check_source_ids.main([str(store), '--exclude', '5,7', '--output-dir', str(tmp_path / 'out')]) == 0
+    assert '共 1000 行，删除 2 行' in capsys.readouterr().out
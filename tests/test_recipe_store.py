@@ -0,0 +1,75 @@
+import argparse
+import csv
+import json
+
+import pytest
+
+import recipe_store
+from check_source_ids import default_output_file
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('recipes.csv', 'recipes_extract_stage.csv'),
+    ('full.store', 'full_extract_stage.csv'),
+    ('./data/store', './data/store_extract_stage.csv'),
+    ('./data/store/', './data/store_extract_stage.csv'),
+    ('a.b.csv', 'a.b_extract_stage.csv'),
+])
+def test_extract_file_name(path, expected):
+    assert recipe_store.extract_file_name(path) == expected
+
+
+def test_default_output_file_for_directory_without_extension():
+    assert default_output_file('./data/store') == './data/store_filtered.csv'
+
+
+@pytest.fixture
+def store(tmp_path):
+    pytest.importorskip('pyarrow')
+    csv_path = tmp_path / 'r.csv'
+    with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['source_id', 'language_code', 'content'])
+        for i in range(1, 21):
+            for lang in ('en', 'zh'):
+                content = {'stages': [{'stage': 1, 'image_url': f'https://h/recipe/{i}_1.jpg'}]}
+                writer.writerow([i, lang, json.dumps(content)])
+        writer.writerow(['abc', 'en', 'not json'])
+    store_dir = tmp_path / 'r.store'
+    assert recipe_store.csv_to_store(str(csv_path), str(store_dir)) == (41, 40)
+    return csv_path, store_dir
+
+
+def test_store_round_trip_is_lossless(tmp_path, store):
+    csv_path, store_dir = store
+    out = tmp_path / 'out.csv'
+    assert recipe_store.store_to_csv(str(store_dir), str(out)) == 41
+    assert out.read_bytes() == csv_path.read_bytes()
+
+
+def test_pushdown_filters(store):
+    _, store_dir = store
+    header = recipe_store.recipe_columns(str(store_dir))
+    sid = header.index('source_id')
+
+    def ids(**filters):
+        return [row[sid] for row in recipe_store.iter_recipe_rows(str(store_dir), header, **filters)]
+
+    assert recipe_store.count_recipes(str(store_dir)) == 41
+    assert ids(language='zh', source_id_range=(5, 7)) == ['5', '6', '7']
+    assert ids(language='en', source_ids={3, 4}) == ['3', '4']
+    # 排除集合保留无法解析为整数的 source_id
+    assert ids(language='en', exclude_ids=set(range(2, 21))) == ['1', 'abc']
+    table = recipe_store.read_stages(str(store_dir), columns=['image_url'], language='en', source_id_range=(None, 2))
+    assert table.column('image_url').to_pylist() == ['https://h/recipe/1_1.jpg', 'https://h/recipe/2_1.jpg']
+
+
+@pytest.mark.parametrize('text, expected', [('100-200', (100, 200)), ('100-', (100, None)), ('-200', (None, 200))])
+def test_parse_source_id_range(text, expected):
+    assert recipe_store.parse_source_id_range(text) == expected
+
+
+@pytest.mark.parametrize('text', ['x', '100', '-', 'a-b'])
+def test_parse_source_id_range_rejects(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        recipe_store.parse_source_id_range(text)
@@ -0,0 +1,150 @@
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pymysql')
+
+import update_recipes_from_csv as urc
+
+
+class FakeCursor:
+    def __init__(self, fail_on=None):
+        self.statements = []
+        self.fail_on = fail_on or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+        error = self.fail_on.pop(len(self.statements), None)
+        if error is not None:
+            raise error
+        return 1
+
+    def executemany(self, sql, rows):
+        self.statements.append((sql, list(rows)))
+        return len(self.statements[-1][1])
+
+
+class FakeConnection:
+    def __init__(self, cursor=None):
+        self.cur = cursor or FakeCursor()
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def make_rows(count, prefix='s'):
+    fields = len(urc.update_fields)
+    return [(f'{prefix}{i}', 'en', [f'v{i}_{j}' for j in range(fields)]) for i in range(count)]
+
+
+def test_iter_update_rows_keeps_last_duplicate_and_skips_missing_keys(capsys):
+    columns = {csv_col: ['a', 'b', '', 'c'] for csv_col in urc.update_fields}
+    df = pd.DataFrame({'source_id': ['1', '2', '', '1'], 'language_code': ['en', 'en', 'en', 'en'], **columns})
+    rows = list(urc.iter_update_rows(df))
+    # 重复键按首次出现的位置输出，取值以最后一行为准
+    assert [(s, l) for s, l, _ in rows] == [('1', 'en'), ('2', 'en')]
+    assert rows[0][2] == [urc.prepare_value('c')] * len(urc.update_fields)
+    out = capsys.readouterr().out
+    assert '第3行缺少source_id，跳过' in out
+    assert '共有 1 行重复' in out
+
+
+def test_case_batch_sql_and_params():
+    cur = FakeCursor()
+    batch = make_rows(3)
+    urc._apply_case_batch(cur, batch)
+    [(sql, params)] = cur.statements
+    fields = list(urc.update_fields.values())
+    for col in fields:
+        assert f"{col} = CASE " + ' '.join(['WHEN source_id = %s AND language_code = %s THEN %s'] * 3) \
+            + f" ELSE {col} END" in sql
+    assert sql.endswith("WHERE (source_id, language_code) IN ((%s, %s), (%s, %s), (%s, %s))")
+    assert sql.count('%s') == len(params) == len(fields) * 3 * 3 + 3 * 2
+    # 第一个字段的 CASE 参数依次为各行的键与取值，末尾是 IN 列表的键
+    assert params[:3] == ['s0', 'en', 'v0_0']
+    assert params[-6:] == ['s0', 'en', 's1', 'en', 's2', 'en']
+
+
+def test_temp_table_batch_loads_rows_then_joins():
+    cur = FakeCursor()
+    batch = make_rows(2)
+    urc._apply_temp_table_batch(cur, batch)
+    (delete, _), (insert, inserted), (update, _) = cur.statements
+    assert delete == f"DELETE FROM {urc.TEMP_TABLE}"
+    assert insert.startswith(f"INSERT INTO {urc.TEMP_TABLE} (source_id, language_code, ")
+    assert inserted == [('s0', 'en', *batch[0][2]), ('s1', 'en', *batch[1][2])]
+    assert update.startswith(f"UPDATE recipes r JOIN {urc.TEMP_TABLE} t ")
+    assert "ON r.source_id = t.source_id AND r.language_code = t.language_code" in update
+
+
+def test_update_rows_batched_commits_each_batch():
+    conn = FakeConnection()
+    stats = urc.update_rows_batched(conn, make_rows(5), batch_size=2, mode='case')
+    assert (stats['rows'], stats['batches'], stats['affected']) == (5, 3, 3)
+    assert conn.commits == 3
+    assert conn.rollbacks == 0
+
+
+def test_update_rows_batched_rolls_back_failed_batch(tmp_path):
+    # temp_table 模式：建表 1 条，每批 3 条语句；第二批的 UPDATE 失败
+    conn = FakeConnection(FakeCursor(fail_on={7: RuntimeError('boom')}))
+    checkpoint = urc.BatchCheckpoint(str(tmp_path / 'x.db_checkpoint'), 'test')
+    rows = make_rows(4)
+    with pytest.raises(RuntimeError):
+        urc.update_rows_batched(conn, rows, batch_size=2, mode='temp_table', checkpoint=checkpoint)
+    assert (conn.commits, conn.rollbacks) == (1, 1)
+    # 只有已提交的第一批写入检查点
+    assert checkpoint.pending(rows) == (rows[2:], 2)
+
+
+def test_partition_rows_keeps_source_id_in_one_partition():
+    rows = make_rows(20) + make_rows(20)
+    buckets = urc.partition_rows(rows, 3)
+    assert sum(len(b) for b in buckets) == 40
+    owners = {}
+    for index, bucket in enumerate(buckets):
+        for source_id, _, _ in bucket:
+            assert owners.setdefault(source_id, index) == index
+
+
+def test_write_partition_reconnects_after_transient_error(monkeypatch):
+    import pymysql
+    # 第一个连接上的 UPDATE 遇到死锁，重连后重试成功
+    connections = [FakeConnection(FakeCursor(fail_on={1: pymysql.err.OperationalError(1213, 'Deadlock')})),
+                   FakeConnection()]
+    monkeypatch.setattr(urc, 'connect', lambda: connections.pop(0) if connections else FakeConnection())
+    monkeypatch.setattr(urc.time, 'sleep', lambda seconds: None)
+    first, second = connections
+    stats = urc._write_partition(0, make_rows(3), 2, 'case', retries=2)
+    assert stats['error'] is None
+    assert (stats['rows'], stats['batches'], stats['retries']) == (3, 2, 1)
+    assert first.rollbacks == 1 and first.closed
+    assert second.commits == 2 and second.closed
+
+
+def test_write_partition_stops_on_permanent_error(monkeypatch):
+    import pymysql
+    conn = FakeConnection(FakeCursor(fail_on={2: pymysql.err.ProgrammingError(1064, 'syntax')}))
+    monkeypatch.setattr(urc, 'connect', lambda: conn)
+    stats = urc._write_partition(1, make_rows(4), 2, 'case', retries=3)
+    assert stats['retries'] == 0
+    assert (stats['rows'], stats['batches']) == (2, 1)
+    assert 'syntax' in stats['error']
+    assert conn.closed
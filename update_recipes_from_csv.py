@@ -1,7 +1,16 @@
+import hashlib
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import pymysql
 import json
 
+import run_metrics
+
 # 数据库连接配置
 db_config = {
     'host': 'mysql-testn-80.mysql.database.azure.com',
@@ -16,6 +25,35 @@ db_config = {
     }
 }
 
+# 要导入的CSV文件
+CSV_FILE = 'recipes_801_934_with_images.csv'
+
+# 写入模式：
+#   'row'        逐行 UPDATE（原方式，每行一次往返）；全部行在同一事务中提交，出错时整体回滚
+#   'case'       每批一条多行 UPDATE ... SET col = CASE ... END
+#   'temp_table' 每批先批量写入临时表，再一条 UPDATE ... JOIN（按 source_id, language_code）
+# 'case' / 'temp_table' 每批单独提交：中途失败时已提交的批次保留（不再是整体原子更新），需显式选择
+WRITE_MODE = 'row'
+BATCH_SIZE = 500  # 批量模式下每批行数，每批单独提交
+
+# 并发写入的连接数（默认 1：单连接。>1 时按 source_id 分区，多连接并行写入，
+# 各分区独立按批提交，某个分区失败时其他分区的写入保留，不再是整体原子更新）
+WRITER_CONNECTIONS = 1
+# 瞬时错误（锁等待超时、死锁、连接断开、连接数已满、暂时无法连接）的重试次数
+MAX_RETRIES = 3
+TRANSIENT_ERROR_CODES = {1040, 1205, 1213, 2003, 2006, 2013}
+
+# 差异同步：先批量读取数据库中的当前内容，仅写入与CSV不同的行（默认关闭，写入全部行）
+SYNC_MODE = False
+
+# 批次检查点：每批提交后把该批的键与取值摘要追加到 <CSV>.db_checkpoint，
+# 中途失败后重新运行时跳过已提交且取值未变的行；全部写入成功后删除检查点文件。
+# 默认关闭（流水线 run_pipeline.py 的 db-update 阶段会显式开启）
+CHECKPOINT = False
+
+# 临时表名（仅当前连接可见）
+TEMP_TABLE = 'tmp_recipe_updates'
+
 # 需要更新的字段映射（csv列名 -> 数据库列名）
 update_fields = {
     'content': 'content',
@@ -46,48 +84,459 @@ def prepare_value(value):
         return json.dumps([value], ensure_ascii=False)
     return json.dumps([value], ensure_ascii=False)
 
-def main():
+def get_db_config():
+    """返回数据库连接配置；可通过环境变量覆盖，便于指向本地 MySQL 兼容实例测试
+
+    RECIPES_DB_HOST / RECIPES_DB_PORT / RECIPES_DB_USER / RECIPES_DB_PASSWORD / RECIPES_DB_NAME，
+    RECIPES_DB_SSL=0 时关闭 SSL。
+    """
+    config = dict(db_config)
+    overrides = {
+        'host': 'RECIPES_DB_HOST',
+        'user': 'RECIPES_DB_USER',
+        'password': 'RECIPES_DB_PASSWORD',
+        'database': 'RECIPES_DB_NAME',
+    }
+    for key, env in overrides.items():
+        if os.environ.get(env):
+            config[key] = os.environ[env]
+    if os.environ.get('RECIPES_DB_PORT'):
+        config['port'] = int(os.environ['RECIPES_DB_PORT'])
+    if os.environ.get('RECIPES_DB_SSL') == '0':
+        config.pop('ssl', None)
+    return config
+
+
+def connect():
+    return pymysql.connect(**get_db_config())
+
+
+def iter_update_rows(df):
+    """逐行生成 (source_id, language_code, [按 update_fields 顺序的取值])，跳过缺少主键的行
+
+    同一 (source_id, language_code) 出现多次时只保留最后一行（与逐行模式依次覆盖的结果一致），
+    否则批量与并发模式中同一批/不同分区内的重复键会使各模式的最终结果不一致。
+    """
+    rows = {}
+    duplicates = 0
+    for idx, row in df.iterrows():
+        source_id = row.get('source_id', '').strip()
+        language_code = row.get('language_code', '').strip()
+
+        if not source_id:
+            print(f"第{idx+1}行缺少source_id，跳过")
+            continue
+
+        if not language_code:
+            print(f"第{idx+1}行缺少language_code，跳过")
+            continue
+
+        values = [prepare_value(row.get(csv_col, '')) for csv_col in update_fields]
+        key = (source_id, language_code)
+        if key in rows:
+            duplicates += 1
+            print(f"第{idx+1}行与之前的行重复（source_id={source_id}, language_code={language_code}），以此行为准")
+        rows[key] = values
+
+    if duplicates:
+        print(f"共有 {duplicates} 行重复的 (source_id, language_code)，已按最后一次出现的取值写入")
+    for (source_id, language_code), values in rows.items():
+        yield source_id, language_code, values
+
+
+class BatchCheckpoint:
+    """已提交批次的检查点（JSON-lines）
+
+    首行记录目标数据库与字段，之后每行是一个已提交批次的 [source_id, language_code, 取值摘要]。
+    目标数据库或字段不同时视为无效并重新开始；取值摘要不同（CSV 已修改）的行会重新写入。
+    并发写入时各分区线程共用一个实例。
+    """
+
+    def __init__(self, path, target):
+        self.path = path
+        self.header = {'target': target, 'fields': list(update_fields.values())}
+        self.committed = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def for_csv(cls, csv_file):
+        config = get_db_config()
+        target = f"{config.get('host')}:{config.get('port', 3306)}/{config.get('database')}"
+        return cls(f"{csv_file}.db_checkpoint", target)
+
+    @staticmethod
+    def row_token(row):
+        source_id, language_code, values = row
+        digest = hashlib.sha1(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+        return source_id, language_code, digest
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        try:
+            if not lines or json.loads(lines[0]) != self.header:
+                raise ValueError("目标数据库或字段不一致")
+            for line in lines[1:]:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    # 最后一行可能在写入时中断，之后的内容不可信
+                    break
+                self.committed.update(tuple(token) for token in batch)
+        except ValueError as exc:
+            print(f"检查点无效，将重新开始：{self.path} -> {exc}")
+            self.committed.clear()
+            os.remove(self.path)
+
+    def pending(self, rows):
+        """过滤掉已提交且取值未变的行，返回 (剩余行列表, 跳过行数)"""
+        remaining = []
+        skipped = 0
+        for row in rows:
+            if self.row_token(row) in self.committed:
+                skipped += 1
+            else:
+                remaining.append(row)
+        return remaining, skipped
+
+    def mark(self, batch):
+        """记录一个已提交的批次（在 commit 之后调用），写入后立即落盘"""
+        tokens = [self.row_token(row) for row in batch]
+        with self._lock:
+            first = not os.path.exists(self.path)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if first:
+                    f.write(json.dumps(self.header, ensure_ascii=False) + '\n')
+                f.write(json.dumps(tokens, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.committed.update(tokens)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def update_rows_one_by_one(conn, rows, checkpoint=None):
+    """逐行 UPDATE，全部完成后统一提交；返回写入行数"""
+    set_clause = ', '.join(f"{db_col} = %s" for db_col in update_fields.values())
+    sql = f"UPDATE recipes SET {set_clause} WHERE source_id = %s and language_code = %s"
+    written = []
+    with conn.cursor() as cur:
+        for row in rows:
+            source_id, language_code, values = row
+            cur.execute(sql, [*values, source_id, language_code])
+            print(f"已更新 source_id={source_id}, language_code={language_code}")
+            written.append(row)
+    conn.commit()
+    if checkpoint is not None:
+        checkpoint.mark(written)
+    return len(written)
+
+
+def _apply_case_batch(cur, batch):
+    """一条多行 UPDATE：每个字段一个 CASE 表达式，WHERE 限定本批的 (source_id, language_code)"""
+    set_clauses = []
+    params = []
+    for i, db_col in enumerate(update_fields.values()):
+        whens = ' '.join(['WHEN source_id = %s AND language_code = %s THEN %s'] * len(batch))
+        set_clauses.append(f"{db_col} = CASE {whens} ELSE {db_col} END")
+        for source_id, language_code, values in batch:
+            params.extend((source_id, language_code, values[i]))
+    keys = ', '.join(['(%s, %s)'] * len(batch))
+    for source_id, language_code, _ in batch:
+        params.extend((source_id, language_code))
+    sql = f"UPDATE recipes SET {', '.join(set_clauses)} WHERE (source_id, language_code) IN ({keys})"
+    return cur.execute(sql, params)
+
+
+def _ensure_temp_table(cur):
+    # 复制 recipes 中相关列的类型，保证 JOIN 时可以走索引
+    columns = ', '.join(['source_id', 'language_code', *update_fields.values()])
+    cur.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {TEMP_TABLE} AS SELECT {columns} FROM recipes LIMIT 0")
+
+
+def _apply_temp_table_batch(cur, batch):
+    """本批数据先批量写入临时表（executemany 会合并为多行 INSERT），再一条 UPDATE ... JOIN"""
+    db_cols = list(update_fields.values())
+    cur.execute(f"DELETE FROM {TEMP_TABLE}")
+    placeholders = ', '.join(['%s'] * (len(db_cols) + 2))
+    cur.executemany(
+        f"INSERT INTO {TEMP_TABLE} (source_id, language_code, {', '.join(db_cols)}) VALUES ({placeholders})",
+        [(source_id, language_code, *values) for source_id, language_code, values in batch],
+    )
+    set_clause = ', '.join(f"r.{col} = t.{col}" for col in db_cols)
+    return cur.execute(
+        f"UPDATE recipes r JOIN {TEMP_TABLE} t "
+        f"ON r.source_id = t.source_id AND r.language_code = t.language_code "
+        f"SET {set_clause}"
+    )
+
+
+def _apply_row_batch(cur, batch):
+    """逐行 UPDATE（供并发写入的 'row' 模式使用）"""
+    set_clause = ', '.join(f"{db_col} = %s" for db_col in update_fields.values())
+    sql = f"UPDATE recipes SET {set_clause} WHERE source_id = %s and language_code = %s"
+    return sum(cur.execute(sql, [*values, source_id, language_code]) for source_id, language_code, values in batch)
+
+
+BATCH_WRITERS = {
+    'row': _apply_row_batch,
+    'case': _apply_case_batch,
+    'temp_table': _apply_temp_table_batch,
+}
+
+
+def iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def update_rows_batched(conn, rows, batch_size=BATCH_SIZE, mode=WRITE_MODE, checkpoint=None):
+    """按批写入，每批单独提交；某批失败时回滚该批并抛出异常（之前的批次已提交）
+
+    Returns:
+        dict: rows（写入行数）、affected（数据库报告的受影响行数）、batches、seconds
+    """
+    apply_batch = BATCH_WRITERS[mode]
+    recorder = run_metrics.get_recorder()
+    stats = {'rows': 0, 'affected': 0, 'batches': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        if mode == 'temp_table':
+            _ensure_temp_table(cur)
+        for batch in iter_batches(rows, batch_size):
+            batch_start = time.perf_counter()
+            try:
+                stats['affected'] += apply_batch(cur, batch)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if checkpoint is not None:
+                checkpoint.mark(batch)
+            stats['rows'] += len(batch)
+            stats['batches'] += 1
+            elapsed = time.perf_counter() - batch_start
+            if recorder.enabled:
+                recorder.observe('db_batch', elapsed, label=f"batch {stats['batches']}", rows=len(batch), mode=mode)
+            print(f"第{stats['batches']}批：{len(batch)} 行，耗时 {elapsed * 1000:.0f} ms，累计 {stats['rows']} 行")
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def is_transient_error(exc):
+    return isinstance(exc, pymysql.err.OperationalError) and bool(exc.args) and exc.args[0] in TRANSIENT_ERROR_CODES
+
+
+def partition_rows(rows, partitions):
+    """按 source_id 的 CRC32 分区：同一 source_id 只会落在一个分区，且分区结果跨进程稳定"""
+    buckets = [[] for _ in range(partitions)]
+    for row in rows:
+        buckets[zlib.crc32(row[0].encode('utf-8')) % partitions].append(row)
+    return buckets
+
+
+def _write_partition(index, rows, batch_size, mode, retries, checkpoint=None):
+    """单个分区的写入：独立连接，每批一个事务，瞬时错误（含建立连接时）时重连并重试该批"""
+    apply_batch = BATCH_WRITERS[mode]
+    recorder = run_metrics.get_recorder()
+    stats = {'partition': index, 'rows': 0, 'affected': 0, 'batches': 0, 'retries': 0, 'error': None}
+    conn = None
+    try:
+        for batch in iter_batches(rows, batch_size):
+            attempt = 0
+            batch_start = time.perf_counter()
+            while True:
+                try:
+                    if conn is None:
+                        conn = connect()
+                    with conn.cursor() as cur:
+                        if mode == 'temp_table':
+                            _ensure_temp_table(cur)
+                        affected = apply_batch(cur, batch)
+                    conn.commit()
+                    break
+                except Exception as exc:
+                    if conn is not None:
+                        try:
+                            conn.rollback()
+                        except Exception:
+                            pass
+                    if attempt >= retries or not is_transient_error(exc):
+                        raise
+                    attempt += 1
+                    stats['retries'] += 1
+                    time.sleep(0.5 * 2 ** (attempt - 1))
+                    # 丢弃可能已断开的连接，下次尝试时重新连接（连接失败同样按瞬时错误重试）
+                    if conn is not None:
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
+                        conn = None
+            if checkpoint is not None:
+                checkpoint.mark(batch)
+            stats['rows'] += len(batch)
+            stats['affected'] += affected
+            stats['batches'] += 1
+            if recorder.enabled:
+                recorder.observe('db_batch', time.perf_counter() - batch_start,
+                                 label=f"partition {index} batch {stats['batches']}",
+                                 rows=len(batch), mode=mode, retries=attempt)
+    except Exception as exc:
+        stats['error'] = str(exc)
+    finally:
+        if conn is not None:
+            conn.close()
+    return stats
+
+
+def update_rows_concurrent(rows, connections=WRITER_CONNECTIONS, batch_size=BATCH_SIZE,
+                           mode=WRITE_MODE, retries=MAX_RETRIES, checkpoint=None):
+    """多连接并发写入：按 source_id 分区，每个分区由一个线程、一个连接负责，互不触碰相同的键
+
+    某个分区失败不影响其他分区；报告按分区序号输出，与线程完成顺序无关。
+    """
+    start = time.perf_counter()
+    partitions = partition_rows(rows, connections)
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = [executor.submit(_write_partition, i, part, batch_size, mode, retries, checkpoint)
+                   for i, part in enumerate(partitions) if part]
+        results = [future.result() for future in futures]
+
+    stats = {'rows': 0, 'affected': 0, 'batches': 0, 'seconds': time.perf_counter() - start, 'failed': []}
+    for result in results:
+        print(f"分区 {result['partition']}：写入 {result['rows']} 行，{result['batches']} 批，重试 {result['retries']} 次"
+              + (f"，失败：{result['error']}" if result['error'] else ""))
+        for key in ('rows', 'affected', 'batches'):
+            stats[key] += result[key]
+        if result['error']:
+            stats['failed'].append(result['partition'])
+    return stats
+
+
+def fetch_current_values(conn, keys, batch_size=BATCH_SIZE):
+    """批量读取 (source_id, language_code) 对应的当前字段值
+
+    Returns:
+        dict: (source_id, language_code) -> [按 update_fields 顺序的取值]，数据库中不存在的键不在其中
+    """
+    db_cols = ', '.join(update_fields.values())
+    current = {}
+    with conn.cursor() as cur:
+        for batch in iter_batches(keys, batch_size):
+            placeholders = ', '.join(['(%s, %s)'] * len(batch))
+            params = [part for key in batch for part in key]
+            cur.execute(
+                f"SELECT source_id, language_code, {db_cols} FROM recipes "
+                f"WHERE (source_id, language_code) IN ({placeholders})",
+                params,
+            )
+            for source_id, language_code, *values in cur.fetchall():
+                current[(str(source_id), str(language_code))] = values
+    return current
+
+
+def _comparable(value):
+    """比较用的规范化：JSON 文本解析为 Python 对象，忽略空白与键顺序（MySQL JSON 列会重排键）"""
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def diff_rows(rows, current):
+    """将待写入行与数据库当前值比较
+
+    Returns:
+        (changed, unchanged, missing)：有变化的行列表、未变化行数、数据库中不存在的行列表
+    """
+    changed = []
+    missing = []
+    unchanged = 0
+    for row in rows:
+        source_id, language_code, values = row
+        existing = current.get((source_id, language_code))
+        if existing is None:
+            missing.append(row)
+        elif all(_comparable(new) == _comparable(old) for new, old in zip(values, existing)):
+            unchanged += 1
+        else:
+            changed.append(row)
+    return changed, unchanged, missing
+
+
+def report_stats(stats):
+    rate = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    recorder = run_metrics.get_recorder()
+    if recorder.enabled:
+        recorder.event('db_update', rows=stats['rows'], affected=stats['affected'], batches=stats['batches'],
+                       seconds=round(stats['seconds'], 6), rows_per_sec=round(rate, 1))
+    print(f"共写入 {stats['rows']} 行（{stats['batches']} 批，数据库受影响 {stats['affected']} 行），"
+          f"耗时 {stats['seconds']:.2f} 秒，{rate:.1f} 行/秒")
+
+
+def main(csv_file=CSV_FILE, mode=WRITE_MODE, batch_size=BATCH_SIZE, sync=SYNC_MODE,
+         connections=WRITER_CONNECTIONS, checkpoint=CHECKPOINT):
+    """返回 0 表示全部写入成功；出错或有分区失败时返回 1（已提交的批次记录在检查点中）"""
     # 读取csv
-    df = pd.read_csv('recipes_801_934_with_images.csv', dtype=str).fillna('')
+    df = pd.read_csv(csv_file, dtype=str).fillna('')
 
     # 建立数据库连接
-    conn = pymysql.connect(**db_config)
+    conn = connect()
+    status = 0
     try:
-        with conn.cursor() as cur:
-            for idx, row in df.iterrows():
-                source_id = row.get('source_id', '').strip()
-                language_code = row.get('language_code', '').strip()
-                
-                if not source_id:
-                    print(f"第{idx+1}行缺少source_id，跳过")
-                    continue
-                    
-                if not language_code:
-                    print(f"第{idx+1}行缺少language_code，跳过")
-                    continue
-
-                # 构造SET子句
-                set_clauses = []
-                values = []
-                for csv_col, db_col in update_fields.items():
-                    val = row.get(csv_col, '')
-                    val = prepare_value(val)
-                    set_clauses.append(f"{db_col} = %s")
-                    values.append(val)
-
-                set_clause = ', '.join(set_clauses)
-                sql = f"UPDATE recipes SET {set_clause} WHERE source_id = %s and language_code = %s"
-                values.append(source_id)
-                values.append(language_code)
-                cur.execute(sql, values)
-                print(f"已更新 source_id={source_id}, language_code={language_code}")
-
-            conn.commit()
+        rows = iter_update_rows(df)
+        journal = BatchCheckpoint.for_csv(csv_file) if checkpoint else None
+        if journal is not None:
+            rows, resumed = journal.pending(rows)
+            if resumed:
+                print(f"检查点：跳过上次已提交的 {resumed} 行（{journal.path}）")
+        if sync:
+            rows = list(rows)
+            current = fetch_current_values(conn, [(sid, lang) for sid, lang, _ in rows], batch_size)
+            rows, unchanged, missing = diff_rows(rows, current)
+            print(f"差异同步：有变化 {len(rows)} 行，未变化 {unchanged} 行，数据库中不存在 {len(missing)} 行")
+            for source_id, language_code, _ in missing:
+                print(f"数据库中不存在 source_id={source_id}, language_code={language_code}")
+
+        if connections > 1:
+            stats = update_rows_concurrent(list(rows), connections, batch_size, mode, checkpoint=journal)
+            report_stats(stats)
+            if stats['failed']:
+                print(f"以下分区写入失败（其已提交的批次保留）：{stats['failed']}")
+                status = 1
+        elif mode == 'row':
+            start = time.perf_counter()
+            count = update_rows_one_by_one(conn, rows, journal)
+            report_stats({'rows': count, 'affected': count, 'batches': 1,
+                          'seconds': time.perf_counter() - start})
+        else:
+            report_stats(update_rows_batched(conn, rows, batch_size, mode, journal))
+        if journal is not None and status == 0:
+            journal.clear()
     except Exception as e:
         print(f"发生错误: {e}")
         conn.rollback()
+        status = 1
     finally:
         conn.close()
+    return status
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监听图片目录并自动压缩（轮询实现，适用于任意 Linux 文件系统）
+
+生成的阶段图片会在数小时内陆续写入 recipes_801_934 等目录，本脚本持续监听输入目录：
+- 每 POLL_INTERVAL 秒扫描一次目录（仅一级文件），发现新增或修改的图片
+- 防抖与半写入检测：大小与 mtime 在两次扫描间保持不变、mtime 距今超过 SETTLE_SECONDS，
+  且 JPEG/PNG 文件尾完整（JPEG 以 EOI 结尾，PNG 以 IEND 块结尾）才视为写入完成
+- 就绪文件提交到有界队列（最多 QUEUE_SIZE 个在途任务），由多进程并行压缩；队列满时留待下一轮
+- 某个 worker 进程崩溃（如被 OOM 杀死）时重建进程池，当时在途的文件各自单独重试一次，再次崩溃才记为失败
+- 启动时借助增量清单（见 auto_folder_compress.CompressionManifest）补处理停机期间的变化，
+  已压缩过的文件直接跳过
+- 每 STATUS_INTERVAL 秒输出一次状态摘要（可同时写入 JSON 状态文件，供健康检查）
+- 收到 SIGINT / SIGTERM 后停止扫描，等待在途任务完成并保存清单后退出；再次收到信号则取消排队任务
+
+压缩参数沿用 auto_folder_compress.py 中的配置。
+
+使用方法：
+  python watch_folder_compress.py
+  python watch_folder_compress.py --input-dir recipes_801_934 --status-file watch_status.json
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import auto_folder_compress as afc
+import run_metrics
+
+# ======================== 可配置参数（请在此修改） ========================
+# 扫描间隔（秒）
+POLL_INTERVAL = 1.0
+
+# 文件 mtime 距今至少这么多秒、且两次扫描间未变化，才认为写入完成
+SETTLE_SECONDS = 2.0
+
+# 在途任务上限（有界队列）；0 表示 worker 数的 2 倍
+QUEUE_SIZE = 0
+
+# 并行进程数；0 表示全部 CPU 核心（监听模式不沿用 auto_folder_compress.WORKERS 的串行默认值）
+WORKERS = 0
+
+# 状态摘要输出间隔（秒）
+STATUS_INTERVAL = 60.0
+
+# 清单最多每隔多少秒落盘一次（退出时总会保存）
+MANIFEST_SAVE_INTERVAL = 5.0
+# ======================================================================
+
+# 写入工具常见的临时文件名，直接忽略
+TEMP_SUFFIXES = (".tmp", ".part", ".partial", ".crdownload", ".download")
+
+PNG_TRAILER = b"IEND\xaeB`\x82"
+
+
+def looks_complete(path: Path) -> bool:
+    """检查文件尾部是否完整：JPEG 须包含 EOI（FFD9），PNG 须以 IEND 块结尾；其他格式只依赖防抖。"""
+    suffix = path.suffix.lower()
+    if suffix not in (".jpg", ".jpeg", ".png"):
+        return True
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 32))
+            tail = f.read()
+    except OSError:
+        return False
+    if suffix == ".png":
+        return tail.endswith(PNG_TRAILER)
+    # 部分相机/编辑器会在 EOI 后补零，只看末尾 32 字节内是否出现 EOI
+    return b"\xff\xd9" in tail
+
+
+def _ignore_interrupt() -> None:
+    """worker 进程忽略 SIGINT / SIGTERM（fork 出的进程会继承主进程的处理函数），由主进程统一处理停止流程"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def _is_candidate(entry: os.DirEntry) -> bool:
+    name = entry.name
+    if name.startswith(".") or name.lower().endswith(TEMP_SUFFIXES):
+        return False
+    return os.path.splitext(name)[1].lower() in afc.IMAGE_EXTENSIONS and entry.is_file()
+
+
+class FolderWatcher:
+    """轮询输入目录，将写入完成的图片交给多进程压缩。"""
+
+    def __init__(self, compressor: afc.ImageCompressor, input_dir: Path, output_dir: Path,
+                 initial_quality: int = 85, workers: int = 0, renditions: list[afc.Rendition] | None = None,
+                 poll_interval: float = POLL_INTERVAL, settle_seconds: float = SETTLE_SECONDS,
+                 queue_size: int = QUEUE_SIZE, status_interval: float = STATUS_INTERVAL,
+                 status_file: Path | None = None):
+        self.compressor = compressor
+        self.input_dir = Path(input_dir)
+        self.output_dir = Path(output_dir)
+        self.initial_quality = initial_quality
+        self.workers = workers or os.cpu_count() or 1
+        self.renditions = tuple(renditions) if renditions else afc.DEFAULT_RENDITIONS
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.queue_size = queue_size or self.workers * 2
+        self.status_interval = status_interval
+        self.status_file = Path(status_file) if status_file else None
+
+        self.manifest = afc.CompressionManifest.for_output_dir(self.output_dir)
+        self.params = compressor.manifest_params(initial_quality, self.renditions)
+
+        # 文件名 -> 上一次扫描到的 (大小, mtime_ns)
+        self.observed: dict[str, tuple[int, int]] = {}
+        # 文件名 -> 首次发现当前版本的时间（用于统计从到达到完成的延迟）
+        self.arrived: dict[str, float] = {}
+        # 文件名 -> 已处理（压缩或跳过）的版本，版本不变时不再处理
+        self.handled: dict[str, tuple[int, int]] = {}
+        # 在途任务：future -> (文件名, 版本, 到达时间)
+        self.in_flight: dict = {}
+        self.in_flight_names: set[str] = set()
+        # 进程崩溃（如被 OOM 杀死）时在途的文件 -> 版本：单独重试一次，再次崩溃才记为失败
+        self.retrying: dict[str, tuple[int, int]] = {}
+        self.executor: ProcessPoolExecutor | None = None
+        self.pool_restarts = 0
+
+        self.started = time.time()
+        self.counts = {"compressed": 0, "skipped": 0, "failed": 0}
+        self.latencies: list[float] = []
+        self.last_error: str | None = None
+        self.stopping = False
+        self._signals = 0
+        self._manifest_dirty = False
+        self._last_manifest_save = 0.0
+        self._last_status = time.monotonic()
+
+    # ---------------- 信号与状态 ----------------
+    def request_stop(self, signum=None, frame=None) -> None:
+        self._signals += 1
+        if self._signals == 1:
+            print("\n收到停止信号，等待在途任务完成后退出（再次发送信号将取消排队任务）...")
+            self.stopping = True
+        else:
+            print("\n再次收到停止信号，取消尚未开始的任务...")
+            for future in list(self.in_flight):
+                future.cancel()
+
+    def status(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "input_dir": str(self.input_dir),
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "state": "stopping" if self.stopping else "running",
+            "in_flight": len(self.in_flight),
+            "pool_restarts": self.pool_restarts,
+            "settling": sum(1 for name in self.observed
+                            if name not in self.in_flight_names and self.handled.get(name) != self.observed[name]),
+            **self.counts,
+            "latency_p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "latency_max": round(latencies[-1], 3) if latencies else None,
+            "last_error": self.last_error,
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def report_status(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_status < self.status_interval:
+            return
+        self._last_status = now
+        status = self.status()
+        latency = (f"，延迟 p50 {status['latency_p50']}s / 最大 {status['latency_max']}s"
+                   if status["latency_max"] is not None else "")
+        print(f"[状态] 在途 {status['in_flight']}，等待写入完成 {status['settling']}，"
+              f"已压缩 {status['compressed']}，跳过 {status['skipped']}，失败 {status['failed']}{latency}")
+        if self.status_file:
+            temp_path = self.status_file.with_name(self.status_file.name + ".tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(status, f, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.status_file)
+
+    def save_manifest(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if self._manifest_dirty and (force or now - self._last_manifest_save >= MANIFEST_SAVE_INTERVAL):
+            self.manifest.save()
+            self._manifest_dirty = False
+            self._last_manifest_save = now
+
+    # ---------------- 扫描与调度 ----------------
+    def scan(self) -> list[Path]:
+        """扫描一次目录，返回写入已完成且需要处理的文件（按文件名排序）"""
+        now = time.time()
+        ready: list[Path] = []
+        current: dict[str, tuple[int, int]] = {}
+        try:
+            entries = list(os.scandir(self.input_dir))
+        except OSError as exc:
+            self.last_error = f"扫描失败: {exc}"
+            return ready
+
+        for entry in entries:
+            if not _is_candidate(entry):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # 扫描期间被删除或改名
+                continue
+            version = (stat.st_size, stat.st_mtime_ns)
+            current[entry.name] = version
+            if self.handled.get(entry.name) == version or entry.name in self.in_flight_names:
+                continue
+
+            previous = self.observed.get(entry.name)
+            if previous != version:
+                self.arrived.setdefault(entry.name, now)
+            stable = (
+                previous == version
+                and stat.st_size > 0
+                and now - stat.st_mtime_ns / 1e9 >= self.settle_seconds
+            )
+            if stable and looks_complete(Path(entry.path)):
+                ready.append(Path(entry.path))
+
+        # 已删除的文件不再跟踪（输出与清单条目保留，交由下次 compress_directory 清理）
+        for name in set(self.observed) - set(current):
+            self.arrived.pop(name, None)
+            self.handled.pop(name, None)
+        self.observed = current
+        return sorted(ready, key=lambda p: p.name)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_ignore_interrupt)
+
+    def submit_ready(self, ready: list[Path]) -> None:
+        # 崩溃后待重试的文件优先，且只在没有其他在途任务时单独运行，以便区分是谁导致崩溃
+        ready = sorted(ready, key=lambda p: p.name not in self.retrying)
+        for img_file in ready:
+            if len(self.in_flight) >= self.queue_size:
+                # 队列已满，剩余文件下一轮再提交
+                break
+            if any(name in self.retrying for name in self.in_flight_names):
+                break
+            if img_file.name in self.retrying and self.in_flight:
+                break
+            outputs = [(r, r.output_path(self.output_dir, img_file.stem, self.compressor.encoder.extension))
+                       for r in self.renditions]
+            try:
+                todo, skipped = self.manifest.plan([(img_file, outputs)], self.params, self.output_dir)
+            except OSError:
+                continue
+            version = self.observed[img_file.name]
+            if skipped:
+                self.counts["skipped"] += 1
+                self.handled[img_file.name] = version
+                self.arrived.pop(img_file.name, None)
+                continue
+            future = self.executor.submit(afc._compress_task, self.compressor, img_file, outputs,
+                                          self.initial_quality)
+            self.in_flight[future] = (img_file, outputs, version, self.arrived.pop(img_file.name, time.time()))
+            self.in_flight_names.add(img_file.name)
+
+    def _restart_pool(self) -> None:
+        """进程池已损坏：重建进程池，当时在途的任务各自单独重试一次（已重试过的记为失败）"""
+        self.pool_restarts += 1
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._new_executor()
+        victims = list(self.in_flight.values())
+        self.in_flight.clear()
+        print(f"进程池异常，已重建（第 {self.pool_restarts} 次），在途任务 {len(victims)} 个")
+        for img_file, _, version, arrived in victims:
+            self.in_flight_names.discard(img_file.name)
+            if self.retrying.pop(img_file.name, None) is not None:
+                self.handled[img_file.name] = version
+                self.counts["failed"] += 1
+                self.last_error = f"{img_file.name}: 子进程异常退出（可能内存不足）"
+                self.manifest.pending.pop(img_file.name, None)
+                print(f"处理失败: {self.last_error}")
+            else:
+                # 不记入 handled，下一轮扫描时单独重试
+                self.retrying[img_file.name] = version
+                self.arrived.setdefault(img_file.name, arrived)
+                print(f"将单独重试: {img_file.name}")
+
+    def collect(self, done) -> None:
+        recorder = run_metrics.get_recorder()
+        broken = False
+        for future in done:
+            try:
+                result, stats = future.result()
+            except BrokenProcessPool:
+                # 留在在途列表中，由 _restart_pool 统一处理
+                broken = True
+                continue
+            except Exception as exc:
+                result, stats = None, {"error": str(exc)}
+            img_file, outputs, version, arrived = self.in_flight.pop(future)
+            self.in_flight_names.discard(img_file.name)
+            self.handled[img_file.name] = version
+            self.retrying.pop(img_file.name, None)
+            if not result:
+                self.counts["failed"] += 1
+                self.last_error = f"{img_file.name}: {stats.get('error', '已取消')}"
+                self.manifest.pending.pop(img_file.name, None)
+                continue
+            latency = time.time() - arrived
+            self.counts["compressed"] += 1
+            self.latencies.append(latency)
+            self.manifest.record(img_file, self.manifest.relative_outputs(outputs, self.output_dir), self.params,
+                                 self.output_dir)
+            self._manifest_dirty = True
+            print(f"已压缩: {img_file.name}（到达后 {latency:.1f}s）")
+            if recorder.enabled:
+                recorder.observe("watch_image", latency, label=img_file.name,
+                                 compress=round(stats.get("total", 0.0), 6), case=stats.get("case"))
+        if broken:
+            self._restart_pool()
+
+    def run(self) -> dict:
+        """持续监听直到收到停止信号，返回最终状态"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        previous_handlers = {sig: signal.signal(sig, self.request_stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+        print(f"开始监听: {self.input_dir} -> {self.output_dir}（{self.workers} 个进程，"
+              f"扫描间隔 {self.poll_interval}s，写入完成判定 {self.settle_seconds}s）")
+        self.executor = self._new_executor()
+        try:
+            while not self.stopping:
+                try:
+                    self.submit_ready(self.scan())
+                except BrokenProcessPool:
+                    # 提交时才发现进程池已损坏（崩溃发生在两次等待之间）
+                    self._restart_pool()
+                    continue
+                # 等待任务完成兼作扫描间隔
+                if self.in_flight:
+                    done, _ = wait(list(self.in_flight), timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    self.collect(done)
+                else:
+                    time.sleep(self.poll_interval)
+                self.save_manifest()
+                self.report_status()
+
+            # 停止：不再扫描，等待在途任务（被第二次信号取消或因崩溃待重试的任务，下次启动时重新处理）
+            while self.in_flight:
+                done, _ = wait(list(self.in_flight), timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                self.collect(done)
+        finally:
+            self.executor.shutdown(wait=True)
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+            self.save_manifest(force=True)
+            self.report_status(force=True)
+        print("监听已停止")
+        return self.status()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="监听图片目录并自动压缩")
+    parser.add_argument("--input-dir", help="输入目录（默认按 auto_folder_compress 中的配置解析）")
+    parser.add_argument("--output-dir", help="输出目录（默认为输入目录下的 compressed）")
+    parser.add_argument("--workers", type=int, help="并行进程数（0 为全部核心）")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="扫描间隔（秒）")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS, help="写入完成判定时间（秒）")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="在途任务上限（0 为 worker 数的 2 倍）")
+    parser.add_argument("--status-interval", type=float, default=STATUS_INTERVAL, help="状态摘要间隔（秒）")
+    parser.add_argument("--status-file", help="状态 JSON 文件（供健康检查）")
+    args = parser.parse_args(argv)
+
+    input_dir = Path(args.input_dir).expanduser().resolve() if args.input_dir else afc.resolve_input_directory()
+    if not input_dir.is_dir():
+        print(f"目录不存在: {input_dir}")
+        return 1
+    output_dir = Path(args.output_dir) if args.output_dir else input_dir / afc.OUTPUT_SUBDIR_NAME
+
+    workers = WORKERS if args.workers is None else args.workers
+    # 监听模式下同时处理的图片通常很少，自动模式按 worker 数分配空闲核心
+    parallel_encodes = afc.PARALLEL_ENCODES or afc.auto_parallel_encodes(workers or os.cpu_count() or 1)
+    compressor = afc.ImageCompressor(min_size_kb=afc.MIN_SIZE_KB, max_size_kb=afc.MAX_SIZE_KB,
+                                     parallel_encodes=parallel_encodes, encoder=afc.OUTPUT_ENCODER)
+    watcher = FolderWatcher(
+        compressor, input_dir, output_dir,
+        initial_quality=afc.INITIAL_QUALITY,
+        workers=workers,
+        renditions=[afc.Rendition(**spec) for spec in afc.RENDITIONS],
+        poll_interval=args.poll_interval, settle_seconds=args.settle, queue_size=args.queue_size,
+        status_interval=args.status_interval, status_file=args.status_file,
+    )
+    status = watcher.run()
+    return 1 if status["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())